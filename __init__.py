@@ -1,4 +1,3 @@
-from . import resources_rc
 def classFactory(iface):
     from .pk_tools import PKToolsPlugin
     return PKToolsPlugin(iface)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de rendimiento de PK Tools sobre redes calibradas sintéticas.
+
+Mide, sobre el núcleo sin Qt (core/), las operaciones que hay detrás de cada
+herramienta y genera un JSON con los resultados para poder comparar versiones:
+
+  index_build      lectura de la red desde WKB (lo que hace la preparación
+                   de la capa en segundo plano)
+  tree_build       R-tree de segmentos (también en la preparación)
+  identify_point   Identificar PK: segmento más cercano de toda la red con
+                   el R-tree (nearest)
+  identify_hover   lectura continua: R-tree con distancia máxima (nearest_within)
+  locate           Localizar PK: vía + PK → punto
+  distance         Distancia PK: segundo clic sobre la vía + distancia a lo
+                   largo de la vía
+  identify_batch   Identificar capa de puntos (nearest_many), por punto
+  locate_batch     Localizar por lote (locate_many), por fila
+  segment_batch    Segmentación por PK (cut_many), por evento
+  trace_match      Ajuste de traza GPS (TraceMatcher), por posición
+  calibration_qa   Control de calibración de toda la red
+
+Uso:
+  python benchmarks/run_benchmarks.py                      # 10k, 100k y 1M vértices
+  python benchmarks/run_benchmarks.py --sizes 10000 5000000 --kinds sinuous
+  python benchmarks/run_benchmarks.py --output actual.json --compare base.json
+
+Con --compare termina con código 1 si alguna operación es más lenta que en
+la referencia por encima de --threshold (1.25 → un 25 % más lenta).
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from core.linref import LinearReference  # noqa: E402
+from core.trace import TraceMatcher  # noqa: E402
+from core.calibration import audit_calibration  # noqa: E402
+from synthetic import KINDS, make_network, sample_points, sample_measures  # noqa: E402
+
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+MAX_DIST = 50.0
+
+
+def _stats(name, times, count=None):
+    """Resultado de una operación a partir de los tiempos (s) de cada repetición."""
+    times = np.asarray(times, dtype=np.float64)
+    count = len(times) if count is None else count
+    total = float(times.sum())
+    per_op = times * 1e6 if count == len(times) else np.array([total / count * 1e6])
+    return {
+        "op": name,
+        "n": int(count),
+        "total_s": round(total, 6),
+        "mean_us": round(total / max(count, 1) * 1e6, 3),
+        "median_us": round(float(np.median(per_op)), 3),
+        "p95_us": round(float(np.percentile(per_op, 95)), 3),
+    }
+
+
+def _time_each(func, args):
+    times = []
+    clock = time.perf_counter
+    for a in args:
+        t0 = clock()
+        func(*a)
+        times.append(clock() - t0)
+    return times
+
+
+def _time_once(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def run_case(kind, vertices, queries, batch, seed=0):
+    """Ejecuta todas las operaciones sobre una red. Devuelve la lista de resultados."""
+    net = make_network(kind, vertices, seed)
+    records = list(net.wkb_records())
+    results = []
+
+    dt, lr = _time_once(LinearReference.from_wkb, records)
+    results.append(_stats("index_build", [dt]))
+
+    dt, _ = _time_once(lr.segment_tree)
+    results.append(_stats("tree_build", [dt]))
+
+    # Clics: puntos junto a la red
+    px, py, _ = sample_points(net, lr, queries, seed=seed + 1)
+    n_feat = lr.feature_count
+    xs, ys = px.tolist(), py.tolist()
+
+    results.append(_stats("identify_point", _time_each(
+        lr.nearest, [(xs[i], ys[i]) for i in range(queries)])))
+    results.append(_stats("identify_hover", _time_each(
+        lr.nearest_within, [(xs[i], ys[i], MAX_DIST) for i in range(queries)])))
+
+    roads, pks = sample_measures(lr, queries, seed=seed + 2)
+    results.append(_stats("locate", _time_each(
+        lr.locate, list(zip(roads, pks.tolist())))))
+
+    # Distancia: primer clic ya resuelto, se mide el segundo + distancia
+    firsts = [lr.nearest(xs[i], ys[i]) for i in range(queries)]
+    j = np.roll(np.arange(queries), 1).tolist()
+
+    def distance(first, x, y):
+        if first is None:
+            return None
+        second = lr.nearest_on_road(x, y, first.road)
+        return None if second is None else lr.route_distance(first, second)
+
+    results.append(_stats("distance", _time_each(
+        distance, [(firsts[i], xs[j[i]], ys[j[i]]) for i in range(queries)])))
+
+    bx, by, _ = sample_points(net, lr, batch, seed=seed + 3)
+    dt, _ = _time_once(lr.nearest_many, bx, by, MAX_DIST)
+    results.append(_stats("identify_batch", [dt], batch))
+
+    b_roads, b_pks = sample_measures(lr, batch, seed=seed + 4)
+    dt, _ = _time_once(lr.locate_many, b_roads, b_pks)
+    results.append(_stats("locate_batch", [dt], batch))
+
+    dt, _ = _time_once(lr.cut_many, b_roads, b_pks, b_pks + 0.5)
+    results.append(_stats("segment_batch", [dt], batch))
+
+    # Traza: recorrido a lo largo de la primera vía con ruido
+    first_road = lr.road_features(lr.road_keys[0])
+    v0, v1 = lr.feat_offsets[first_road[0]], lr.feat_offsets[first_road[-1] + 1]
+    rng = np.random.default_rng(seed + 5)
+    pos = np.linspace(v0, v1 - 1, batch)
+    tx = np.interp(pos, np.arange(v0, v1), lr.x[v0:v1]) + rng.normal(0, 3, batch)
+    ty = np.interp(pos, np.arange(v0, v1), lr.y[v0:v1]) + rng.normal(0, 3, batch)
+    matcher = TraceMatcher(lr, MAX_DIST)
+    dt, _ = _time_once(matcher.match, tx, ty)
+    results.append(_stats("trace_match", [dt], batch))
+
+    dt, _ = _time_once(audit_calibration, lr)
+    results.append(_stats("calibration_qa", [dt]))
+
+    case = f"{kind}-{vertices}"
+    for r in results:
+        r.update(case=case, kind=kind, vertices=int(len(lr.x)), features=int(n_feat))
+    return results
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Operaciones más lentas que la referencia (por encima del umbral)."""
+    base = {(r["case"], r["op"]): r for r in baseline["results"]}
+    slower = []
+    for r in current["results"]:
+        ref = base.get((r["case"], r["op"]))
+        if ref and ref["mean_us"] > 0 and r["mean_us"] > ref["mean_us"] * threshold:
+            slower.append((r["case"], r["op"], ref["mean_us"], r["mean_us"]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pruebas de rendimiento de PK Tools")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="vértices de cada red (p. ej. 10000 5000000)")
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    parser.add_argument("--queries", type=int, default=2000,
+                        help="consultas individuales por operación")
+    parser.add_argument("--batch", type=int, default=100_000,
+                        help="filas / puntos de las operaciones por lotes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="fichero JSON de resultados (por defecto, stdout)")
+    parser.add_argument("--compare", help="JSON de referencia con el que comparar")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    results = []
+    for vertices in args.sizes:
+        for kind in args.kinds:
+            print(f"{kind} {vertices}…", file=sys.stderr)
+            results.extend(run_case(kind, vertices, args.queries, args.batch, args.seed))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "queries": args.queries,
+            "batch": args.batch,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            slower = compare(report, json.load(f), args.threshold)
+        for case, op, before, now in slower:
+            print(f"MÁS LENTO: {case} {op}: {before:.1f} → {now:.1f} µs", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Generador de redes calibradas sintéticas para las pruebas de rendimiento.
+
+Cada vía es una fila de features encadenadas (la M continúa de una feature a
+la siguiente, como en una red real) separadas ROAD_SPACING unidades. Tipos:
+  - straight:  líneas rectas
+  - sinuous:   líneas sinuosas (más vértices por metro de bbox)
+  - multipart: cada feature en dos partes con un pequeño hueco
+  - inverted:  una de cada dos features digitalizada en sentido contrario a
+               la M (M decreciente)
+La M es la longitud acumulada en metros desde el inicio de la vía.
+"""
+
+import struct
+
+import numpy as np
+
+
+KINDS = ("straight", "sinuous", "multipart", "inverted")
+
+ROAD_SPACING = 200.0      # separación entre vías
+VERTEX_SPACING = 10.0     # separación entre vértices a lo largo de la vía
+VERTICES_PER_FEATURE = 200
+FEATURES_PER_ROAD = 20
+
+# Tipos WKB ISO con M
+_WKB_LINESTRING_M = 2002
+_WKB_MULTILINESTRING_M = 2005
+
+
+class SyntheticNetwork:
+    """
+    Red sintética: ``features`` es una lista de (fid, vía, partes) con cada
+    parte como arrays (x, y, m), el formato de LinearReference.from_parts.
+    """
+
+    def __init__(self, kind, features):
+        self.kind = kind
+        self.features = features
+
+    @property
+    def vertex_count(self):
+        return sum(len(p[0]) for _, _, parts in self.features for p in parts)
+
+    @property
+    def roads(self):
+        return sorted({road for _, road, _ in self.features})
+
+    def wkb_records(self):
+        """(fid, vía, WKB) de cada feature, como los entrega la capa de QGIS."""
+        for fid, road, parts in self.features:
+            yield fid, road, to_wkb(parts)
+
+
+def to_wkb(parts):
+    """WKB ISO (LineStringM / MultiLineStringM, little endian) de las partes."""
+    def linestring(x, y, m):
+        coords = np.column_stack((x, y, m)).astype("<f8")
+        return struct.pack("<BII", 1, _WKB_LINESTRING_M, len(x)) + coords.tobytes()
+
+    if len(parts) == 1:
+        return linestring(*parts[0])
+    body = b"".join(linestring(*p) for p in parts)
+    return struct.pack("<BII", 1, _WKB_MULTILINESTRING_M, len(parts)) + body
+
+
+def make_network(kind, vertices, seed=0):
+    """
+    Genera una red del tipo ``kind`` con aproximadamente ``vertices`` vértices.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Tipo de red desconocido: {kind}")
+    rng = np.random.default_rng(seed)
+    per_road = VERTICES_PER_FEATURE * FEATURES_PER_ROAD
+    n_roads = max(1, int(round(vertices / per_road)))
+    n_feats = FEATURES_PER_ROAD if vertices >= per_road else max(1, vertices // VERTICES_PER_FEATURE)
+
+    features = []
+    fid = 0
+    for r in range(n_roads):
+        road = f"R{r:05d}"
+        # Eje de la vía: abscisa con pequeñas variaciones de paso
+        steps = VERTEX_SPACING * (0.5 + rng.random(n_feats * (VERTICES_PER_FEATURE - 1)))
+        x = np.concatenate(([0.0], np.cumsum(steps)))
+        y = np.full(len(x), r * ROAD_SPACING)
+        if kind == "sinuous":
+            phase = rng.random() * 2 * np.pi
+            y += 40.0 * np.sin(x / 150.0 + phase)
+        m = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+
+        for k in range(n_feats):
+            a = k * (VERTICES_PER_FEATURE - 1)
+            b = a + VERTICES_PER_FEATURE
+            px, py, pm = x[a:b], y[a:b], m[a:b]
+            if kind == "multipart":
+                h = VERTICES_PER_FEATURE // 2
+                parts = [(px[:h], py[:h], pm[:h]), (px[h:], py[h:], pm[h:])]
+            elif kind == "inverted" and k % 2:
+                parts = [(px[::-1].copy(), py[::-1].copy(), pm[::-1].copy())]
+            else:
+                parts = [(px.copy(), py.copy(), pm.copy())]
+            features.append((fid, road, parts))
+            fid += 1
+    return SyntheticNetwork(kind, features)
+
+
+def sample_points(network, lr, count, noise=5.0, seed=1):
+    """
+    Puntos de consulta junto a la red: vértices al azar desplazados
+    lateralmente hasta ``noise`` unidades. Devuelve (x, y, índice de feature).
+    """
+    rng = np.random.default_rng(seed)
+    v = rng.integers(0, len(lr.x), count)
+    fi = np.searchsorted(lr.feat_offsets, v, side="right") - 1
+    return (lr.x[v] + rng.uniform(-noise, noise, count),
+            lr.y[v] + rng.uniform(-noise, noise, count), fi)
+
+
+def sample_measures(lr, count, seed=2):
+    """(vías, PK en km) al azar dentro del rango de cada vía."""
+    rng = np.random.default_rng(seed)
+    roads = [r for r in lr.road_keys if lr.road_range(r) is not None]
+    pick = rng.integers(0, len(roads), count)
+    out_roads, pks = [], np.empty(count)
+    for i, j in enumerate(pick):
+        lo, hi = lr.road_range(roads[j])
+        out_roads.append(roads[j])
+        pks[i] = lo + rng.random() * (hi - lo)
+    return out_roads, pks
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Control de calidad de la calibración (M) de una red (solo Python + NumPy).
+
+Revisa toda la red preparada (LinearReference) en una sola pasada
+vectorizada, sin recorrer las features una a una, y devuelve las incidencias
+encontradas:
+  - FINDING_NULL_M:        vértices sin valor M (NaN)
+  - FINDING_NON_MONOTONIC: vértices donde la M retrocede respecto al sentido
+                           general de su feature
+  - FINDING_GAP:           hueco de M entre features consecutivas de una vía
+  - FINDING_OVERLAP:       solape de M entre features consecutivas de una vía
+  - FINDING_RATIO:         feature cuyo cociente (rango de M / longitud) se
+                           aparta del de la red más de la tolerancia
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from .linref import EPS
+
+
+FINDING_NULL_M = 0
+FINDING_NON_MONOTONIC = 1
+FINDING_GAP = 2
+FINDING_OVERLAP = 3
+FINDING_RATIO = 4
+
+# Incidencias de la revisión (un array por campo):
+#   kind:   tipo de incidencia (FINDING_*)
+#   fi:     índice de la feature en el motor
+#   vertex: índice global del vértice donde se sitúa la incidencia
+#   m:      M del vértice (NaN si no tiene)
+#   value:  magnitud: salto de M (km) en retrocesos, huecos y solapes;
+#           cociente relativo al de la red en FINDING_RATIO; NaN en FINDING_NULL_M
+CalibrationFindings = namedtuple("CalibrationFindings", "kind fi vertex m value")
+
+
+def audit_calibration(lr, gap_tolerance_km=0.001, ratio_tolerance=0.05):
+    """
+    Revisa la calibración de ``lr`` y devuelve CalibrationFindings ordenadas
+    por feature y vértice.
+
+    ``gap_tolerance_km``: huecos y solapes menores se ignoran.
+    ``ratio_tolerance``: desviación relativa admitida del cociente
+    M / longitud respecto a la mediana de la red (0.05 → ±5 %).
+    """
+    nf = lr.feature_count
+    factor = lr.factor
+    first = lr.feat_offsets[:-1]
+    last = lr.feat_offsets[1:] - 1
+    counts = np.diff(lr.feat_offsets)
+    vert_feat = np.repeat(np.arange(nf, dtype=np.int64), counts)
+    kinds, fis, verts, values = [], [], [], []
+
+    def add(kind, vertex, value):
+        kinds.append(np.full(len(vertex), kind, dtype=np.int8))
+        fis.append(vert_feat[vertex])
+        verts.append(vertex)
+        values.append(np.asarray(value, dtype=np.float64))
+
+    # Vértices sin M
+    null = np.nonzero(np.isnan(lr.m))[0]
+    add(FINDING_NULL_M, null, np.full(len(null), np.nan))
+
+    # Retrocesos de M: segmentos cuyo incremento va contra el sentido general
+    # de la feature (signo de la suma de incrementos). Los saltos entre partes
+    # de una multiparte no cuentan.
+    if len(lr.m) > 1 and nf:
+        seg = np.nonzero(lr.seg_valid)[0]
+        dm = lr.m[seg + 1] - lr.m[seg]
+        seg_feat = vert_feat[seg]
+        with np.errstate(invalid="ignore"):
+            net = np.bincount(seg_feat, weights=np.nan_to_num(dm), minlength=nf)
+            sense = np.where(net < 0, -1.0, 1.0)
+            back = dm * sense[seg_feat] < -EPS
+        add(FINDING_NON_MONOTONIC, seg[back] + 1, np.abs(dm[back]) / factor)
+
+    # Huecos y solapes entre features consecutivas de cada vía (orden por M):
+    # se compara el inicio de cada feature con el máximo de M alcanzado por
+    # las anteriores de la misma vía.
+    order = lr.road_sorted
+    if len(order) > 1:
+        offsets = lr.road_sorted_offsets
+        hi = lr.m_max[order]
+        # Máximo acumulado reiniciado en cada vía (se desplaza cada grupo para
+        # que quede por encima de todos los anteriores)
+        group = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        span = float(np.nanmax(lr.m_max) - np.nanmin(lr.m_min)) + 1.0
+        shift = group * span
+        hi_acc = np.maximum.accumulate(hi - np.nanmin(lr.m_min) + shift) - shift + np.nanmin(lr.m_min)
+        k = np.arange(1, len(order))
+        k = k[group[k] == group[k - 1]]
+        jump = (lr.m_min[order[k]] - hi_acc[k - 1]) / factor
+        start_vertex = _lowest_end(lr, order[k], first, last)
+        gap = jump > gap_tolerance_km
+        overlap = jump < -gap_tolerance_km
+        add(FINDING_GAP, start_vertex[gap], jump[gap])
+        add(FINDING_OVERLAP, start_vertex[overlap], -jump[overlap])
+
+    # Cociente rango de M / longitud geométrica, relativo a la mediana de la red
+    if nf:
+        length = lr.cum[last]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = (lr.m_max - lr.m_min) / length
+        ok = np.isfinite(ratio) & (length > EPS)
+        if ok.any():
+            ref = float(np.median(ratio[ok]))
+            if ref > 0:
+                rel = ratio / ref
+                with np.errstate(invalid="ignore"):
+                    bad = np.nonzero(ok & (np.abs(rel - 1.0) > ratio_tolerance))[0]
+                add(FINDING_RATIO, first[bad], rel[bad])
+
+    kind = np.concatenate(kinds)
+    fi = np.concatenate(fis)
+    vertex = np.concatenate(verts).astype(np.int64)
+    value = np.concatenate(values)
+    sort = np.lexsort((kind, vertex, fi))
+    return CalibrationFindings(
+        kind[sort], fi[sort], vertex[sort], lr.m[vertex[sort]], value[sort]
+    )
+
+
+def _lowest_end(lr, fis, first, last):
+    """Extremo (primer o último vértice) de cada feature con la M menor."""
+    a, b = first[fis], last[fis]
+    with np.errstate(invalid="ignore"):
+        pick_a = (lr.m[a] <= lr.m[b]) | np.isnan(lr.m[b])
+    return np.where(pick_a, a, b)
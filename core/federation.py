@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Referenciación lineal sobre varias redes calibradas a la vez (solo NumPy).
+
+La red puede estar repartida en varias capas (estatal, autonómica,
+municipal...), cada una con su campo identificador y sus unidades de M. En
+lugar de cambiar de capa y reconstruir índices, FederatedReference reúne los
+motores (LinearReference) de todas ellas:
+
+  - punto → PK: un único R-tree de segmentos sobre las coordenadas de todas
+    las redes, en un CRS común, y una sola búsqueda del segmento más
+    cercano. El resultado se traduce a la red de la que sale (fid, vía, PK y
+    posición en sus unidades), así que cada red conserva su calibración.
+  - vía → red: tabla de encaminamiento identificador de vía → red, para
+    localizar un PK o seguir una vía sin consultar todas las redes. Si un
+    identificador se repite en varias redes, manda la primera (orden de
+    prioridad de la configuración) y las demás quedan en ``shadowed``.
+
+Con una sola red en el CRS común no se copia nada: se usan directamente sus
+arrays y su R-tree.
+"""
+
+import numpy as np
+
+from .linref import nearest_on_segments
+from .segtree import SegmentTree
+
+
+class FederatedReference:
+    """Varias redes calibradas consultadas como una sola."""
+
+    def __init__(self, members, coords=None):
+        """
+        ``members``: motores (LinearReference), por orden de prioridad.
+        ``coords``: para cada red, (x, y) de sus vértices en el CRS común, o
+        None si ya está en él. Sin ``coords``, todas están en el mismo CRS.
+        """
+        self.members = list(members)
+        coords = list(coords) if coords is not None else [None] * len(self.members)
+
+        xs, ys, valid, offsets = [], [], [], [0]
+        for engine, xy in zip(self.members, coords):
+            x, y = (engine.x, engine.y) if xy is None else xy
+            xs.append(np.asarray(x, dtype=np.float64))
+            ys.append(np.asarray(y, dtype=np.float64))
+            # El "segmento" que une el último vértice de una red con el
+            # primero de la siguiente no existe
+            valid.append(np.append(engine.seg_valid, False) if len(x) else engine.seg_valid)
+            offsets.append(offsets[-1] + len(x))
+        self.vertex_offsets = np.asarray(offsets, dtype=np.int64)
+
+        self._tree = None
+        if len(self.members) == 1 and coords[0] is None:
+            self.x, self.y = self.members[0].x, self.members[0].y
+            self._seg_valid = self.members[0].seg_valid
+            self._tree = self.members[0].segment_tree()
+        elif self.members:
+            self.x, self.y = np.concatenate(xs), np.concatenate(ys)
+            # Vértices que no se han podido llevar al CRS común (NaN): fuera
+            finite = np.isfinite(self.x) & np.isfinite(self.y)
+            self._seg_valid = (np.concatenate(valid)[:max(len(self.x) - 1, 0)]
+                               & finite[:-1] & finite[1:])
+        else:
+            self.x = self.y = np.empty(0, dtype=np.float64)
+            self._seg_valid = np.empty(0, dtype=bool)
+
+        self._build_routing()
+
+    # ---------- Encaminamiento vía → red ----------
+    def _build_routing(self):
+        self.routing = {}    # identificador de vía → índice de la red
+        self.shadowed = {}   # identificador → redes que lo repiten (no se consultan)
+        self._by_text = {}   # texto → identificador (tablas y diálogos leen texto)
+        for k, engine in enumerate(self.members):
+            for road in engine.road_keys:
+                if road is None:
+                    continue
+                if road in self.routing:
+                    if self.routing[road] != k:
+                        self.shadowed.setdefault(road, []).append(k)
+                    continue
+                self.routing[road] = k
+                self._by_text.setdefault(str(road), road)
+
+    def route(self, road):
+        """
+        (índice de la red, identificador real) de una vía, aceptando también
+        el identificador como texto. None si ninguna red la tiene.
+        """
+        k = self.routing.get(road)
+        if k is None:
+            road = self._by_text.get(str(road))
+            k = self.routing.get(road)
+            if k is None:
+                return None
+        return k, road
+
+    def road_names(self):
+        """Identificadores de vía no vacíos de todas las redes, ordenados."""
+        return sorted({str(r) for r in self.routing if r != ""}, key=str.casefold)
+
+    # ---------- Punto → PK ----------
+    def segment_tree(self):
+        """R-tree de los segmentos de todas las redes (se construye una vez)."""
+        if self._tree is None:
+            self._tree = SegmentTree(self.x, self.y, np.nonzero(self._seg_valid)[0])
+        return self._tree
+
+    def nearest(self, px, py):
+        """
+        Segmento más cercano a (px, py), en el CRS común, entre todas las
+        redes. Devuelve (índice de la red, PKMatch) o None; el PKMatch está
+        en los términos de esa red salvo x, y (CRS común).
+        """
+        return self._nearest_on_segments(px, py, self.segment_tree().candidates(px, py))
+
+    def nearest_within(self, px, py, max_dist):
+        """Como nearest, descartando lo que esté a más de ``max_dist``."""
+        hit = self._nearest_on_segments(
+            px, py, self.segment_tree().candidates(px, py, max_dist)
+        )
+        return hit if hit is not None and hit[1].dist <= max_dist else None
+
+    def _nearest_on_segments(self, px, py, seg):
+        hit = nearest_on_segments(self.x, self.y, px, py, seg)
+        if hit is None:
+            return None
+        s, t, qx, qy, dist = hit
+        # Segmento del índice común → red y segmento dentro de ella
+        k = int(np.searchsorted(self.vertex_offsets, s, side="right") - 1)
+        return k, self.members[k]._match(s - int(self.vertex_offsets[k]), t, qx, qy, dist)
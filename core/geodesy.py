@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Longitudes elipsoidales vectorizadas (solo NumPy).
+
+geodesic_lengths resuelve el problema inverso de Vincenty sobre arrays de
+pares de puntos: todas las iteraciones se hacen a la vez para todos los
+segmentos, sin bucle por punto. Para segmentos de vía (cortos) converge en
+pocas iteraciones y coincide con QgsDistanceArea (GeographicLib) por debajo
+del milímetro. Los pares que no convergen (casi antípodas, que no aparecen
+en una red de carreteras) se resuelven sobre la esfera de radio medio.
+"""
+
+import numpy as np
+
+
+# Semieje mayor y aplanamiento de WGS 84
+WGS84_A = 6378137.0
+WGS84_F = 1.0 / 298.257223563
+
+
+def geodesic_lengths(lon1, lat1, lon2, lat2, a=WGS84_A, f=WGS84_F, max_iter=50, tol=1e-12):
+    """
+    Distancia geodésica (en unidades de ``a``, normalmente metros) entre
+    (lon1, lat1) y (lon2, lat2), en grados, elemento a elemento.
+    Las coordenadas NaN dan NaN.
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype=np.float64))
+                              for v in (lon1, lat1, lon2, lat2))
+    b = a * (1.0 - f)
+    L = lon2 - lon1
+    U1 = np.arctan((1.0 - f) * np.tan(lat1))
+    U2 = np.arctan((1.0 - f) * np.tan(lat2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sinLam, cosLam = np.sin(lam), np.cos(lam)
+            sinSigma = np.hypot(cosU2 * sinLam, cosU1 * sinU2 - sinU1 * cosU2 * cosLam)
+            cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLam
+            sigma = np.arctan2(sinSigma, cosSigma)
+            sinAlpha = np.where(sinSigma > 0, cosU1 * cosU2 * sinLam / sinSigma, 0.0)
+            cos2Alpha = 1.0 - sinAlpha * sinAlpha
+            # En el ecuador (cos2Alpha = 0) el término no interviene
+            cos2SigmaM = np.where(cos2Alpha > 0, cosSigma - 2.0 * sinU1 * sinU2 / cos2Alpha, 0.0)
+            C = f / 16.0 * cos2Alpha * (4.0 + f * (4.0 - 3.0 * cos2Alpha))
+            lam_prev = lam
+            lam = L + (1.0 - C) * f * sinAlpha * (
+                sigma + C * sinSigma * (cos2SigmaM + C * cosSigma * (-1.0 + 2.0 * cos2SigmaM ** 2))
+            )
+            converged = np.abs(lam - lam_prev) <= tol
+            if converged[~np.isnan(lam)].all():
+                break
+
+        u2 = cos2Alpha * (a * a - b * b) / (b * b)
+        A = 1.0 + u2 / 16384.0 * (4096.0 + u2 * (-768.0 + u2 * (320.0 - 175.0 * u2)))
+        B = u2 / 1024.0 * (256.0 + u2 * (-128.0 + u2 * (74.0 - 47.0 * u2)))
+        dSigma = B * sinSigma * (cos2SigmaM + B / 4.0 * (
+            cosSigma * (-1.0 + 2.0 * cos2SigmaM ** 2)
+            - B / 6.0 * cos2SigmaM * (-3.0 + 4.0 * sinSigma ** 2) * (-3.0 + 4.0 * cos2SigmaM ** 2)
+        ))
+        dist = b * A * (sigma - dSigma)
+
+    bad = ~converged & ~np.isnan(lam)
+    if bad.any():
+        dist[bad] = _spherical(lon1[bad], lat1[bad], lon2[bad], lat2[bad], (2.0 * a + b) / 3.0)
+    return dist
+
+
+def _spherical(lon1, lat1, lon2, lat2, radius):
+    """Distancia sobre la esfera (haversine); coordenadas en radianes."""
+    h = (np.sin((lat2 - lat1) / 2.0) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2)
+    return 2.0 * radius * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
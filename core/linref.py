@@ -0,0 +1,1091 @@
+# -*- coding: utf-8 -*-
+"""
+Núcleo de referenciación lineal de PK Tools (solo Python + NumPy).
+
+No depende de QGIS ni de Qt: se puede importar y probar en cualquier máquina
+con NumPy. Recibe la red calibrada como arrays o como WKB con M y resuelve
+sobre arrays contiguos las consultas "punto → PK", "PK → punto", tramos y
+distancias. Las herramientas del plugin (tools/pk_engine.py) son una capa
+fina que lee la capa de QGIS y delega aquí.
+
+Estructura (todas las features concatenadas):
+  - x, y, m:       coordenadas y medida de cada vértice
+  - cum:           longitud acumulada desde el inicio de su feature
+  - metric_cum:    lo mismo en metros (elipsoidal), si se ha preparado con
+                   prepare_geodesic / prepare_planar_metres
+  - feat_offsets:  índice del primer vértice de cada feature (n_feat + 1)
+  - part_offsets:  índice del primer vértice de cada parte (n_parts + 1)
+"""
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from .geodesy import geodesic_lengths
+from .segtree import SegmentTree
+
+
+# Resultado de una consulta punto → PK
+#   fid:    id de la feature en la capa
+#   road:   valor del campo identificador de la vía
+#   pk:     PK interpolado en km
+#   x, y:   punto proyectado sobre la línea (CRS de la capa)
+#   dist:   distancia del punto consultado a la línea (unidades de la capa)
+#   along:  distancia acumulada a lo largo de la feature (unidades de la capa)
+PKMatch = namedtuple("PKMatch", "fid road pk x y dist along")
+
+# Resultado de una consulta PK → punto
+PKLocation = namedtuple("PKLocation", "fid road pk x y along")
+
+# Resultado de una consulta PK → punto por lotes (un array por campo)
+PKLocationArray = namedtuple("PKLocationArray", "fi fid x y along status")
+
+# Tramo de vía entre dos PK: partes (x, y, m) en orden de digitalización
+PKSegment = namedtuple("PKSegment", "fid road parts length")
+
+# Tramo de un evento lineal (segmentación dinámica): puede abarcar varias
+# features de la vía (fids) y se devuelve como partes (x, y, m)
+PKEvent = namedtuple("PKEvent", "road fids parts length")
+
+# Resultado de una consulta punto → PK por lotes (un array por campo).
+# fi / fid valen -1 en los puntos sin línea dentro de la distancia máxima.
+# side: +1 a la derecha, -1 a la izquierda (según el sentido creciente del PK), 0 sobre la línea
+PKMatchArray = namedtuple("PKMatchArray", "fi fid pk x y dist along side")
+
+EPS = 1e-6
+
+# Estado de cada fila en las localizaciones por lote
+STATUS_FOUND = 0
+STATUS_OUT_OF_RANGE = 1
+STATUS_UNKNOWN_ROAD = 2
+
+
+# ============================================================
+# LECTURA DE WKB CON M
+# ============================================================
+def _read_linestring(buf, pos):
+    """
+    Lee un LineString WKB a partir de ``pos``.
+    Devuelve ((x, y, m), nueva_pos). Si no hay M, m es NaN.
+    """
+    endian = "<" if buf[pos] == 1 else ">"
+    (gtype,) = struct.unpack_from(endian + "I", buf, pos + 1)
+    (npts,) = struct.unpack_from(endian + "I", buf, pos + 5)
+    has_z, has_m = _wkb_dims(gtype)
+    ncoord = 2 + int(has_z) + int(has_m)
+    coords = np.frombuffer(
+        buf, dtype=np.dtype(endian + "f8"), count=npts * ncoord, offset=pos + 9
+    ).reshape(npts, ncoord)
+    x = coords[:, 0]
+    y = coords[:, 1]
+    m = coords[:, ncoord - 1] if has_m else np.full(npts, np.nan)
+    return (x, y, m), pos + 9 + npts * ncoord * 8
+
+
+def _wkb_dims(gtype):
+    """Devuelve (has_z, has_m) para un tipo WKB ISO o EWKB."""
+    if gtype & 0xC0000000:  # EWKB
+        return bool(gtype & 0x80000000), bool(gtype & 0x40000000)
+    dim = (gtype % 10000) // 1000
+    return dim in (1, 3), dim in (2, 3)
+
+
+def parse_wkb_lines(buf):
+    """
+    Convierte un WKB de LineString / MultiLineString en una lista de partes
+    (x, y, m), cada una como arrays de NumPy.
+    """
+    endian = "<" if buf[0] == 1 else ">"
+    (gtype,) = struct.unpack_from(endian + "I", buf, 1)
+    base = (gtype & 0x0FFFFFFF) % 1000
+    if base == 2:
+        part, _ = _read_linestring(buf, 0)
+        return [part]
+    if base == 5:
+        (nparts,) = struct.unpack_from(endian + "I", buf, 5)
+        parts, pos = [], 9
+        for _ in range(nparts):
+            part, pos = _read_linestring(buf, pos)
+            parts.append(part)
+        return parts
+    raise ValueError(f"Tipo WKB no soportado: {gtype}")
+
+
+def wkb_parts(records):
+    """
+    (fid, vía, wkb) → (fid, vía, partes), como espera from_parts. Se saltan
+    las geometrías vacías o que no son líneas.
+    """
+    for fid, road, wkb in records:
+        if not wkb:
+            continue
+        try:
+            yield fid, road, parse_wkb_lines(bytes(wkb))
+        except (ValueError, struct.error):
+            continue
+
+
+def _ranges(counts):
+    """Para counts = [2, 3] devuelve [0, 1, 0, 1, 2] (índice dentro de cada grupo)."""
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+# ============================================================
+# PROYECCIÓN SOBRE SEGMENTOS
+# ============================================================
+def nearest_on_segments(x, y, px, py, seg):
+    """
+    Proyecta (px, py) sobre los segmentos ``seg`` (vértice i → i+1 de los
+    arrays ``x``, ``y``) y devuelve el más cercano como (segmento, t, qx, qy,
+    distancia), con t ∈ [0, 1] la posición dentro del segmento y (qx, qy) el
+    punto proyectado. None si ``seg`` está vacío.
+    """
+    if not len(seg):
+        return None
+
+    ax, ay = x[seg], y[seg]
+    dx, dy = x[seg + 1] - ax, y[seg + 1] - ay
+    l2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(l2 > 0, ((px - ax) * dx + (py - ay) * dy) / l2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    qx, qy = ax + t * dx, ay + t * dy
+    d2 = (px - qx) ** 2 + (py - qy) ** 2
+
+    k = int(np.argmin(d2))
+    return int(seg[k]), float(t[k]), float(qx[k]), float(qy[k]), float(np.sqrt(d2[k]))
+
+
+# ============================================================
+# MOTOR
+# ============================================================
+class LinearReference:
+    """Red calibrada preparada en arrays para consultas rápidas de PK."""
+
+    # Arrays que se pueden guardar / recuperar sin recalcular (ver to_arrays)
+    PREPARED_ARRAYS = ("cum", "seg_valid", "m_min", "m_max", "m_monotonic")
+    ROAD_ARRAYS = ("road_offsets", "road_members", "road_sorted_offsets", "road_sorted")
+
+    def __init__(self, x, y, m, feat_offsets, part_offsets, fids, roads, m_units="m",
+                 prepared=None):
+        self.x = np.ascontiguousarray(x, dtype=np.float64)
+        self.y = np.ascontiguousarray(y, dtype=np.float64)
+        self.m = np.ascontiguousarray(m, dtype=np.float64)
+        self.feat_offsets = np.asarray(feat_offsets, dtype=np.int64)
+        self.part_offsets = np.asarray(part_offsets, dtype=np.int64)
+        self.fids = np.asarray(fids, dtype=np.int64)
+        self.roads = list(roads)
+        self.m_units = m_units if m_units in ("m", "km") else "m"
+
+        # Conversión de M a km según configuración:
+        # - "m": el campo M está en metros → dividimos entre 1000
+        # - "km": el campo M ya está en kilómetros → no convertimos
+        self.factor = 1000.0 if self.m_units == "m" else 1.0
+
+        self.metric_cum = None
+        self.metric_key = None   # qué CRS / elipsoide corresponde a metric_cum
+        self._fid_order = np.argsort(self.fids, kind="stable")
+        self._fid_sorted = self.fids[self._fid_order]
+        if prepared is None:
+            self._prepare()
+            self._build_road_index()
+        else:
+            for name in self.PREPARED_ARRAYS:
+                setattr(self, name, prepared[name])
+            self._build_road_index(
+                prepared["road_keys"], *(prepared[name] for name in self.ROAD_ARRAYS)
+            )
+
+    # ---------- Construcción ----------
+    @classmethod
+    def from_parts(cls, features, m_units="m"):
+        """
+        Construye el motor a partir de ``features``: iterable de
+        (fid, vía, partes), con cada parte como secuencias (x, y, m).
+        Se descartan las partes de menos de dos vértices.
+        """
+        xs, ys, ms = [], [], []
+        feat_offsets, part_offsets = [0], [0]
+        fids, roads = [], []
+        n = 0
+        for fid, road, parts in features:
+            parts = [
+                tuple(np.asarray(c, dtype=np.float64) for c in p)
+                for p in parts if len(p[0]) >= 2
+            ]
+            if not parts:
+                continue
+            for px, py, pm in parts:
+                xs.append(px)
+                ys.append(py)
+                ms.append(pm)
+                n += len(px)
+                part_offsets.append(n)
+            feat_offsets.append(n)
+            fids.append(fid)
+            roads.append(road)
+
+        if xs:
+            x, y, m = np.concatenate(xs), np.concatenate(ys), np.concatenate(ms)
+        else:
+            x = y = m = np.empty(0, dtype=np.float64)
+        return cls(x, y, m, feat_offsets, part_offsets, fids, roads, m_units)
+
+    @classmethod
+    def from_wkb(cls, records, m_units="m"):
+        """
+        Construye el motor a partir de ``records``: iterable de (fid, vía, wkb)
+        con LineString / MultiLineString (ISO o EWKB, con M). Las geometrías
+        vacías o de otro tipo se ignoran.
+        """
+        return cls.from_parts(wkb_parts(records), m_units)
+
+    def replace_features(self, fids, features):
+        """
+        Motor nuevo igual que este salvo las features ``fids``, que se quitan
+        y se sustituyen por ``features`` (como en from_parts: las que sigan
+        existiendo, con su geometría y vía actuales). Los vértices del resto
+        se copian tal cual, sin releer la capa; los arrays derivados se
+        recalculan y el R-tree se construye de nuevo al usarse.
+        """
+        drop = np.isin(self.fids, np.fromiter(fids, dtype=np.int64))
+        counts = np.diff(self.feat_offsets)
+        vert_keep = np.repeat(~drop, counts)
+        part_feat = np.searchsorted(self.feat_offsets, self.part_offsets[:-1], side="right") - 1
+        part_counts = np.diff(self.part_offsets)[~drop[part_feat]]
+        added = LinearReference.from_parts(features)
+
+        n = int(vert_keep.sum())
+        feat_offsets = np.concatenate((
+            [0], np.cumsum(counts[~drop]), n + added.feat_offsets[1:]
+        ))
+        part_offsets = np.concatenate((
+            [0], np.cumsum(part_counts), n + added.part_offsets[1:]
+        ))
+        return type(self)(
+            np.concatenate((self.x[vert_keep], added.x)),
+            np.concatenate((self.y[vert_keep], added.y)),
+            np.concatenate((self.m[vert_keep], added.m)),
+            feat_offsets, part_offsets,
+            np.concatenate((self.fids[~drop], added.fids)),
+            [road for road, d in zip(self.roads, drop) if not d] + added.roads,
+            self.m_units,
+        )
+
+    def _prepare(self):
+        """Precalcula longitudes acumuladas, segmentos válidos y rangos de M."""
+        n = len(self.x)
+        starts = self.feat_offsets[:-1]
+        counts = np.diff(self.feat_offsets)
+
+        # Longitud de cada segmento (i-1 → i)
+        seg = np.zeros(n, dtype=np.float64)
+        if n > 1:
+            seg[1:] = np.hypot(np.diff(self.x), np.diff(self.y))
+        self.cum = self._cumulative(seg)
+
+        # Segmento i (vértice i → i+1) válido si i+1 no abre una parte nueva
+        self.seg_valid = np.ones(max(n - 1, 0), dtype=bool)
+        if n > 1:
+            self.seg_valid[self.part_offsets[1:-1] - 1] = False
+
+        # Rango de M por feature (ignorando NaN)
+        if len(starts):
+            with np.errstate(invalid="ignore"):
+                self.m_min = np.fmin.reduceat(self.m, starts)
+                self.m_max = np.fmax.reduceat(self.m, starts)
+        else:
+            self.m_min = self.m_max = np.empty(0, dtype=np.float64)
+
+        # Sentido de la calibración por feature, para poder usar búsqueda binaria:
+        #   +1 → M no decreciente, -1 → M no creciente, 0 → no monótona (o con NaN)
+        # Se incluyen los saltos entre partes: la búsqueda recorre todos los vértices.
+        nf = len(starts)
+        self.m_monotonic = np.zeros(nf, dtype=np.int8)
+        if nf and n > 1:
+            vert_feat = np.repeat(np.arange(nf), counts)
+            same = vert_feat[:-1] == vert_feat[1:]
+            seg_feat = vert_feat[:-1][same]
+            dm = np.diff(self.m)[same]
+            with np.errstate(invalid="ignore"):
+                has_inc = np.bincount(seg_feat, weights=dm > EPS, minlength=nf) > 0
+                has_dec = np.bincount(seg_feat, weights=dm < -EPS, minlength=nf) > 0
+            has_nan = np.bincount(seg_feat, weights=np.isnan(dm), minlength=nf) > 0
+            self.m_monotonic[~has_dec] = 1
+            self.m_monotonic[has_dec & ~has_inc] = -1
+            self.m_monotonic[has_nan] = 0
+
+    def _cumulative(self, seg):
+        """
+        Longitud acumulada desde el inicio de cada feature a partir de la
+        longitud de cada segmento (i-1 → i); los saltos entre partes no cuentan.
+        """
+        seg[self.part_offsets[:-1]] = 0.0
+        total = np.cumsum(seg)
+        if not len(total):
+            return total
+        starts = self.feat_offsets[:-1]
+        return total - np.repeat(total[starts], np.diff(self.feat_offsets))
+
+    # ---------- Longitudes en metros ----------
+    def prepare_geodesic(self, lon, lat, a, f):
+        """
+        Precalcula ``metric_cum`` con longitudes elipsoidales: ``lon``, ``lat``
+        son las coordenadas geográficas (grados) de cada vértice sobre el
+        elipsoide de semieje ``a`` y aplanamiento ``f``. Se calcula una vez,
+        vectorizado; después cada distancia es una búsqueda y una interpolación.
+        """
+        self.set_metric_cum(self.geodesic_cum(lon, lat, a, f))
+
+    def geodesic_cum(self, lon, lat, a, f):
+        """
+        Como prepare_geodesic, pero devuelve el array sin guardarlo en el
+        motor (se puede calcular en otro hilo; ver set_metric_cum).
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        seg = np.zeros(len(self.x), dtype=np.float64)
+        if len(seg) > 1:
+            seg[1:] = geodesic_lengths(lon[:-1], lat[:-1], lon[1:], lat[1:], a, f)
+        # Vértices que no se pudieron transformar: el segmento no suma
+        seg[np.isnan(seg)] = 0.0
+        return self._cumulative(seg)
+
+    def prepare_planar_metres(self, factor):
+        """``metric_cum`` como longitud plana por ``factor`` (unidades del CRS → m)."""
+        self.set_metric_cum(self.cum * float(factor))
+
+    def set_metric_cum(self, metric_cum, key=None):
+        """Fija ``metric_cum`` (y la clave que lo identifica) y descarta la ruta en metros."""
+        self.metric_cum = metric_cum
+        self.metric_key = key
+        self._metric_route = None
+
+    def metric_along(self, fid, along):
+        """
+        Distancia en metros desde el inicio de la feature ``fid`` hasta el
+        punto situado a ``along`` (unidades de la capa) de ese inicio.
+        None si no se ha preparado ``metric_cum`` o no existe la feature.
+        """
+        fi = self.feature_index(fid)
+        if fi is None or self.metric_cum is None:
+            return None
+        s, t = self._segment_at_distance(fi, along)
+        return float(self.metric_cum[s] + t * (self.metric_cum[s + 1] - self.metric_cum[s]))
+
+    def _build_road_index(self, keys=None, offsets=None, members=None,
+                          sorted_offsets=None, sorted_members=None):
+        """
+        Índice de vías:
+          - road → índices de sus features (en orden de capa)
+          - road → intervalos [m_min, m_max] ordenados por m_min, con el máximo
+            acumulado de m_max, para encontrar por búsqueda binaria las
+            features cuyo rango contiene una medida.
+
+        Se guarda también en forma plana (claves + offsets + miembros) para
+        poder persistirlo y reconstruir los diccionarios sin reagrupar.
+        """
+        if keys is None:
+            groups = {}
+            for fi, road in enumerate(self.roads):
+                groups.setdefault(road, []).append(fi)
+            keys = list(groups)
+            offsets, members, sorted_offsets, sorted_members = [0], [], [0], []
+            for road in keys:
+                fis = np.asarray(groups[road], dtype=np.int64)
+                members.append(fis)
+                offsets.append(offsets[-1] + len(fis))
+                fis = fis[~np.isnan(self.m_min[fis])]
+                fis = fis[np.argsort(self.m_min[fis], kind="stable")]
+                sorted_members.append(fis)
+                sorted_offsets.append(sorted_offsets[-1] + len(fis))
+            empty = np.empty(0, dtype=np.int64)
+            members = np.concatenate(members) if members else empty
+            sorted_members = np.concatenate(sorted_members) if sorted_members else empty
+
+        self.road_keys = list(keys)
+        self.road_offsets = np.asarray(offsets, dtype=np.int64)
+        self.road_members = np.asarray(members, dtype=np.int64)
+        self.road_sorted_offsets = np.asarray(sorted_offsets, dtype=np.int64)
+        self.road_sorted = np.asarray(sorted_members, dtype=np.int64)
+
+        self._road_index = {}
+        self._road_intervals = {}
+        for i, road in enumerate(self.road_keys):
+            self._road_index[road] = self.road_members[self.road_offsets[i]:self.road_offsets[i + 1]]
+            fis = self.road_sorted[self.road_sorted_offsets[i]:self.road_sorted_offsets[i + 1]]
+            hi = self.m_max[fis]
+            self._road_intervals[road] = (
+                fis, self.m_min[fis], hi, np.maximum.accumulate(hi) if len(hi) else hi
+            )
+
+    # ---------- Persistencia ----------
+    def to_arrays(self):
+        """
+        Devuelve (arrays, roads, road_keys) con todo lo necesario para
+        reconstruir el motor con ``from_arrays`` sin recalcular nada, R-tree
+        de segmentos incluido.
+        """
+        names = ("x", "y", "m", "feat_offsets", "part_offsets", "fids")
+        arrays = {name: getattr(self, name) for name in names + self.PREPARED_ARRAYS + self.ROAD_ARRAYS}
+        arrays.update(self.segment_tree().to_arrays())
+        return arrays, self.roads, self.road_keys
+
+    @classmethod
+    def from_arrays(cls, arrays, roads, road_keys, m_units="m"):
+        """Reconstruye el motor a partir de la salida de ``to_arrays``."""
+        prepared = {name: arrays[name] for name in cls.PREPARED_ARRAYS + cls.ROAD_ARRAYS}
+        prepared["road_keys"] = road_keys
+        engine = cls(
+            arrays["x"], arrays["y"], arrays["m"],
+            arrays["feat_offsets"], arrays["part_offsets"], arrays["fids"],
+            roads, m_units, prepared=prepared,
+        )
+        if "tree_items" in arrays:
+            engine._tree = SegmentTree.from_arrays(arrays)
+        return engine
+
+    def feature_bboxes(self):
+        """Extensión (xmin, ymin, xmax, ymax) de cada feature, como arrays."""
+        starts = self.feat_offsets[:-1]
+        if not len(starts):
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty, empty, empty
+        return (
+            np.minimum.reduceat(self.x, starts), np.minimum.reduceat(self.y, starts),
+            np.maximum.reduceat(self.x, starts), np.maximum.reduceat(self.y, starts),
+        )
+
+    # ---------- Utilidades ----------
+    @property
+    def feature_count(self):
+        return len(self.fids)
+
+    def feature_index(self, fid):
+        """Índice interno de una feature a partir de su fid (o None)."""
+        k = int(np.searchsorted(self._fid_sorted, fid))
+        if k < len(self._fid_sorted) and self._fid_sorted[k] == fid:
+            return int(self._fid_order[k])
+        return None
+
+    def road_names(self):
+        """Lista ordenada de identificadores de vía no vacíos."""
+        return sorted({r for r in self.roads if r})
+
+    def _segments_of(self, fis):
+        """Índices de los segmentos válidos de las features indicadas."""
+        ranges = [
+            np.arange(self.feat_offsets[fi], self.feat_offsets[fi + 1] - 1)
+            for fi in fis
+        ]
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        seg = np.concatenate(ranges)
+        return seg[self.seg_valid[seg]]
+
+    def _feature_of_vertex(self, vidx):
+        return int(np.searchsorted(self.feat_offsets, vidx, side="right") - 1)
+
+    # ---------- Punto → PK ----------
+    def segment_tree(self):
+        """R-tree empaquetado de los segmentos válidos (se construye una vez)."""
+        tree = getattr(self, "_tree", None)
+        if tree is None:
+            self._tree = tree = SegmentTree(self.x, self.y, np.nonzero(self.seg_valid)[0])
+        return tree
+
+    def nearest(self, px, py, fids=None):
+        """
+        Proyecta (px, py) sobre los segmentos de las features candidatas y
+        devuelve un PKMatch o None. Sin ``fids`` busca en toda la red con el
+        R-tree de segmentos: el resultado es el segmento más cercano, no el de
+        la feature de extensión más cercana.
+        """
+        if fids is None:
+            seg = self.segment_tree().candidates(px, py)
+        else:
+            fis = [fi for fi in (self.feature_index(f) for f in fids) if fi is not None]
+            seg = self._segments_of(fis)
+        return self._nearest_on_segments(px, py, seg)
+
+    def nearest_on_road(self, px, py, road):
+        """Proyecta (px, py) sobre cualquiera de las features de la vía. PKMatch o None."""
+        return self._nearest_on_segments(px, py, self._segments_of(self.road_features(road)))
+
+    def _nearest_on_segments(self, px, py, seg):
+        hit = nearest_on_segments(self.x, self.y, px, py, seg)
+        return None if hit is None else self._match(*hit)
+
+    def _match(self, s, t, qx, qy, dist):
+        fi = self._feature_of_vertex(s)
+        m0, m1 = self.m[s], self.m[s + 1]
+        pk = (m0 + t * (m1 - m0)) / self.factor
+        along = self.cum[s] + t * (self.cum[s + 1] - self.cum[s])
+        return PKMatch(int(self.fids[fi]), self.roads[fi], float(pk), qx, qy, dist, float(along))
+
+    # ---------- Punto → PK por lotes ----------
+    def nearest_many(self, px, py, max_dist, chunk=20000):
+        """
+        Proyección vectorizada de muchos puntos sobre la red.
+
+        Todos los puntos de un bloque bajan a la vez por el R-tree de
+        segmentos, con la poda del segmento más cercano de cada punto, así
+        que cada punto se compara con unos pocos segmentos aunque la red
+        mezcle segmentos muy largos y muy cortos. Devuelve un PKMatchArray.
+        """
+        px = np.asarray(px, dtype=np.float64)
+        py = np.asarray(py, dtype=np.float64)
+        n = len(px)
+        res = PKMatchArray(
+            np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64),
+            np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan),
+            np.full(n, np.nan), np.full(n, np.nan), np.zeros(n, dtype=np.int8),
+        )
+        if not n or not self.seg_valid.any() or max_dist <= 0:
+            return res
+
+        for c0 in range(0, n, chunk):
+            qx_pts, qy_pts = px[c0:c0 + chunk], py[c0:c0 + chunk]
+            owner, s = self.segment_tree().pairs_within(qx_pts, qy_pts, max_dist, nearest=True)
+            owner, s, t, d2 = self._project_pairs(qx_pts, qy_pts, owner, s, max_dist)
+            if not len(owner):
+                continue
+
+            # Mínimo por punto: los pares ya están agrupados por punto
+            order = np.lexsort((d2, owner))
+            first = order[np.r_[True, owner[order][1:] != owner[order][:-1]]]
+            rows = owner[first]
+            self._fill_matches(res, c0 + rows, s[first], t[first], qx_pts[rows], qy_pts[rows],
+                               d2[first])
+
+        return res
+
+    def _candidate_pairs(self, qx_pts, qy_pts, max_dist):
+        """
+        Todos los pares (punto, segmento) a menos de ``max_dist``, buscados
+        en el R-tree de segmentos. Devuelve arrays (índice del punto,
+        segmento, parámetro t de la proyección, distancia²), agrupados por
+        punto.
+        """
+        owner, s = self.segment_tree().pairs_within(qx_pts, qy_pts, max_dist)
+        return self._project_pairs(qx_pts, qy_pts, owner, s, max_dist)
+
+    def _project_pairs(self, qx_pts, qy_pts, owner, s, max_dist):
+        """
+        Proyecta cada punto ``owner`` sobre su segmento candidato ``s`` y se
+        queda con los pares a menos de ``max_dist``. Devuelve arrays
+        (índice del punto, segmento, parámetro t, distancia²).
+        """
+        ppx, ppy = qx_pts[owner], qy_pts[owner]
+        ax, ay = self.x[s], self.y[s]
+        dx, dy = self.x[s + 1] - ax, self.y[s + 1] - ay
+        l2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(l2 > 0, ((ppx - ax) * dx + (ppy - ay) * dy) / l2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        d2 = (ppx - (ax + t * dx)) ** 2 + (ppy - (ay + t * dy)) ** 2
+        near = d2 <= float(max_dist) ** 2
+        return owner[near], s[near], t[near], d2[near]
+
+    def _fill_matches(self, res, rows, s, t, ppx, ppy, d2):
+        """Rellena las filas ``rows`` de un PKMatchArray con las proyecciones (s, t)."""
+        fi = np.searchsorted(self.feat_offsets, s, side="right") - 1
+        ax, ay = self.x[s], self.y[s]
+        dx, dy = self.x[s + 1] - ax, self.y[s + 1] - ay
+        m0, m1 = self.m[s], self.m[s + 1]
+        cross = dx * (ppy - ay) - dy * (ppx - ax)
+        sense = np.where(m1 < m0, -1.0, 1.0)
+
+        res.fi[rows] = fi
+        res.fid[rows] = self.fids[fi]
+        res.pk[rows] = (m0 + t * (m1 - m0)) / self.factor
+        res.x[rows], res.y[rows] = ax + t * dx, ay + t * dy
+        res.dist[rows] = np.sqrt(d2)
+        res.along[rows] = self.cum[s] + t * (self.cum[s + 1] - self.cum[s])
+        # Producto vectorial > 0 → izquierda del sentido de digitalización
+        res.side[rows] = np.where(np.abs(cross) <= EPS, 0, -np.sign(cross) * sense)
+
+    def nearest_within(self, px, py, max_dist):
+        """
+        Proyección de un solo punto con el R-tree de segmentos, descartando
+        desde la raíz lo que esté a más de ``max_dist`` (pensada para
+        consultas muy frecuentes, como el seguimiento del ratón).
+        Devuelve PKMatch o None si no hay línea a menos de ``max_dist``.
+        """
+        seg = self.segment_tree().candidates(px, py, max_dist)
+        match = self._nearest_on_segments(px, py, seg)
+        return match if match is not None and match.dist <= max_dist else None
+
+    # ---------- PK → punto ----------
+    def road_features(self, road):
+        """Índices internos de las features de una vía (array vacío si no existe)."""
+        return self._road_index.get(road, np.empty(0, dtype=np.int64))
+
+    def has_road(self, road):
+        return road in self._road_index
+
+    def road_range(self, road):
+        """Rango (min, max) de PK en km de una vía, o None si no hay M válidas."""
+        intervals = self._road_intervals.get(road)
+        if intervals is None or not len(intervals[0]):
+            return None
+        _, lo, _, hi_acc = intervals
+        return float(lo[0]) / self.factor, float(hi_acc[-1]) / self.factor
+
+    def features_at_measure(self, road, target):
+        """
+        Features de la vía cuyo rango de M contiene ``target`` (unidades de M),
+        en orden de capa. Solo se examinan los intervalos candidatos.
+        """
+        intervals = self._road_intervals.get(road)
+        if intervals is None:
+            return []
+        fis, lo, hi, hi_acc = intervals
+        j0 = int(np.searchsorted(hi_acc, target - EPS, side="left"))
+        j1 = int(np.searchsorted(lo, target + EPS, side="right"))
+        if j0 >= j1:
+            return []
+        cand = fis[j0:j1][hi[j0:j1] >= target - EPS]
+        return sorted(int(fi) for fi in cand)
+
+    def locate(self, road, pk_km):
+        """
+        Localiza el punto de la vía con el PK dado (km).
+        Soporta multipartes y M invertida. Devuelve PKLocation o None.
+        """
+        target = pk_km * self.factor
+        for fi in self.features_at_measure(road, target):
+            pos = self._position_at_measure(fi, target)
+            if pos is not None:
+                x, y, along = self._interpolate(*pos)
+                return PKLocation(int(self.fids[fi]), self.roads[fi], pk_km, x, y, along)
+        return None
+
+    def _segment_at_measure(self, fi, target):
+        """
+        Segmento de la feature que contiene la medida ``target`` (el primero
+        en orden de vértices), o None.
+
+        Si la calibración de la feature es monótona se usa búsqueda binaria
+        sobre su array de M; si no, se recurre a un barrido vectorizado.
+        """
+        a, b = int(self.feat_offsets[fi]), int(self.feat_offsets[fi + 1])
+        sense = self.m_monotonic[fi]
+        if sense != 0:
+            ms = self.m[a:b] if sense > 0 else -self.m[a:b]
+            key = target if sense > 0 else -target
+            k = int(np.searchsorted(ms, key - EPS, side="left"))
+            s = a + min(max(k, 1), b - a - 1) - 1
+            lo, hi = sorted((self.m[s], self.m[s + 1]))
+            if not (lo - EPS <= target <= hi + EPS):
+                return None
+            if not self.seg_valid[s]:
+                # Cae en el salto entre dos partes: solo vale el inicio de la siguiente
+                return s + 1 if abs(target - self.m[s + 1]) < EPS else None
+            return s
+
+        seg = self._segments_of([fi])
+        m0, m1 = self.m[seg], self.m[seg + 1]
+        lo, hi = np.fmin(m0, m1), np.fmax(m0, m1)
+        hits = np.nonzero((lo - EPS <= target) & (target <= hi + EPS))[0]
+        return int(seg[hits[0]]) if len(hits) else None
+
+    def _position_at_measure(self, fi, target):
+        """(segmento, t) de la feature con medida ``target`` (unidades de M), o None."""
+        s = self._segment_at_measure(fi, target)
+        if s is None:
+            return None
+        m0, m1 = self.m[s], self.m[s + 1]
+        if abs(m1 - m0) < EPS:
+            return s, 0.0
+        return s, min(max((target - m0) / (m1 - m0), 0.0), 1.0)
+
+    def _point_at_measure(self, fi, target):
+        """Interpola el punto de la feature con medida ``target`` (unidades de M)."""
+        pos = self._position_at_measure(fi, target)
+        if pos is None:
+            return None
+        x, y, _ = self._interpolate(*pos)
+        return x, y
+
+    def _interpolate(self, s, t):
+        """Punto (x, y) y distancia acumulada en la fracción t del segmento s."""
+        return (
+            float(self.x[s] + t * (self.x[s + 1] - self.x[s])),
+            float(self.y[s] + t * (self.y[s + 1] - self.y[s])),
+            float(self.cum[s] + t * (self.cum[s + 1] - self.cum[s])),
+        )
+
+    # ---------- PK → punto por lotes ----------
+    def locate_many(self, roads, pks_km):
+        """
+        Localiza muchos pares (vía, PK km) de una vez.
+
+        Agrupa por vía y resuelve cada grupo con búsquedas binarias
+        vectorizadas sobre el índice de intervalos de M. Devuelve un
+        PKLocationArray, con NaN / -1 en las filas no encontradas y status en
+        STATUS_FOUND / STATUS_OUT_OF_RANGE / STATUS_UNKNOWN_ROAD.
+        """
+        targets = np.asarray(pks_km, dtype=np.float64) * self.factor
+        n = len(targets)
+        res = PKLocationArray(
+            np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64),
+            np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan),
+            np.full(n, STATUS_UNKNOWN_ROAD, dtype=np.int8),
+        )
+
+        groups = {}
+        for i, road in enumerate(roads):
+            groups.setdefault(road, []).append(i)
+
+        for road, rows in groups.items():
+            intervals = self._road_intervals.get(road)
+            if intervals is None:
+                continue
+            rows = np.asarray(rows, dtype=np.int64)
+            res.status[rows] = STATUS_OUT_OF_RANGE
+            fis, lo, hi, hi_acc = intervals
+            if not len(fis):
+                continue
+            tg = targets[rows]
+            ok = ~np.isnan(tg)
+            j0 = np.searchsorted(hi_acc, tg - EPS, side="left")
+            j1 = np.searchsorted(lo, tg + EPS, side="right")
+
+            # Caso habitual: un único intervalo candidato → resolución vectorizada
+            single = ok & (j1 - j0 == 1)
+            cand = np.where(single, fis[np.minimum(j0, len(fis) - 1)], -1)
+            single &= hi[np.minimum(j0, len(fis) - 1)] >= tg - EPS
+            cand[~single] = -1
+            for fi in np.unique(cand[cand >= 0]):
+                sel = np.nonzero(cand == fi)[0]
+                seg, t, found = self._positions_at_measures(int(fi), tg[sel])
+                seg, t = seg[found], t[found]
+                r = rows[sel[found]]
+                res.x[r] = self.x[seg] + t * (self.x[seg + 1] - self.x[seg])
+                res.y[r] = self.y[seg] + t * (self.y[seg + 1] - self.y[seg])
+                res.along[r] = self.cum[seg] + t * (self.cum[seg + 1] - self.cum[seg])
+                res.fi[r] = fi
+                res.fid[r] = self.fids[fi]
+                res.status[r] = STATUS_FOUND
+
+            # Intervalos solapados: se recurre a la búsqueda fila a fila
+            for k in np.nonzero(ok & (j1 - j0 > 1))[0]:
+                loc = self.locate(road, float(tg[k]) / self.factor)
+                if loc is not None:
+                    r = rows[k]
+                    res.x[r], res.y[r], res.along[r] = loc.x, loc.y, loc.along
+                    res.fid[r] = loc.fid
+                    res.fi[r] = self.feature_index(loc.fid)
+                    res.status[r] = STATUS_FOUND
+
+        return res
+
+    def _positions_at_measures(self, fi, targets):
+        """
+        Versión vectorizada de _position_at_measure para varias medidas de una
+        feature. Devuelve arrays (segmento, t, encontrado).
+        """
+        if self.m_monotonic[fi] == 0:
+            pos = [self._position_at_measure(fi, t) for t in targets]
+            found = np.array([p is not None for p in pos], dtype=bool)
+            return (
+                np.array([p[0] if p else 0 for p in pos], dtype=np.int64),
+                np.array([p[1] if p else 0.0 for p in pos], dtype=np.float64),
+                found,
+            )
+
+        a, b = int(self.feat_offsets[fi]), int(self.feat_offsets[fi + 1])
+        sense = self.m_monotonic[fi]
+        ms = self.m[a:b] if sense > 0 else -self.m[a:b]
+        keys = targets if sense > 0 else -targets
+        k = np.searchsorted(ms, keys - EPS, side="left")
+        s = a + np.clip(k, 1, b - a - 1) - 1
+
+        # Saltos entre partes: solo vale el inicio de la parte siguiente
+        jump = ~self.seg_valid[s]
+        s = np.where(jump & (np.abs(targets - self.m[s + 1]) < EPS), s + 1, s)
+        valid = self.seg_valid[s]
+
+        m0, m1 = self.m[s], self.m[s + 1]
+        found = valid & (np.fmin(m0, m1) - EPS <= targets) & (targets <= np.fmax(m0, m1) + EPS)
+        dm = m1 - m0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(np.abs(dm) < EPS, 0.0, (targets - m0) / dm)
+        return s, np.clip(t, 0.0, 1.0), found
+
+    # ---------- Tramo entre dos PK ----------
+    def segment_between(self, road, pk_from, pk_to):
+        """
+        Tramo de la vía entre dos PK (km) dentro de una misma feature.
+        Devuelve PKSegment (partes en orden de digitalización) o None.
+        """
+        t_from, t_to = pk_from * self.factor, pk_to * self.factor
+        both = set(self.features_at_measure(road, t_from)) & set(self.features_at_measure(road, t_to))
+        for fi in sorted(both):
+            p0 = self._position_at_measure(fi, t_from)
+            p1 = self._position_at_measure(fi, t_to)
+            if p0 is None or p1 is None:
+                continue
+            if (p1[0], p1[1]) < (p0[0], p0[1]):
+                p0, p1 = p1, p0
+            parts = self._cut(p0[0], p0[1], p1[0], p1[1])
+            length = self._interpolate(*p1)[2] - self._interpolate(*p0)[2]
+            return PKSegment(int(self.fids[fi]), self.roads[fi], parts, float(length))
+        return None
+
+    def _cut(self, s0, t0, s1, t1):
+        """
+        Recorta la línea entre (s0, t0) y (s1, t1) (s0 <= s1, misma feature).
+        Devuelve una lista de partes (x, y, m); se separan en los saltos entre partes.
+        """
+        idx = np.arange(s0 + 1, s1 + 1)
+        x = np.concatenate(([self.x[s0] + t0 * (self.x[s0 + 1] - self.x[s0])], self.x[idx],
+                            [self.x[s1] + t1 * (self.x[s1 + 1] - self.x[s1])]))
+        y = np.concatenate(([self.y[s0] + t0 * (self.y[s0 + 1] - self.y[s0])], self.y[idx],
+                            [self.y[s1] + t1 * (self.y[s1 + 1] - self.y[s1])]))
+        m = np.concatenate(([self.m[s0] + t0 * (self.m[s0 + 1] - self.m[s0])], self.m[idx],
+                            [self.m[s1] + t1 * (self.m[s1 + 1] - self.m[s1])]))
+
+        # Segmentos recorridos: s0..s1; los no válidos son saltos entre partes.
+        # En el array recortado el segmento s (s0 <= s <= s1) une j = s - s0 con j + 1.
+        breaks = np.nonzero(~self.seg_valid[s0:s1 + 1])[0] + 1
+        parts = []
+        for xs, ys, ms in zip(np.split(x, breaks), np.split(y, breaks), np.split(m, breaks)):
+            if len(xs) >= 2:
+                parts.append((xs, ys, ms))
+        return parts
+
+    # ---------- Cadena de medidas por vía (ruta) ----------
+    def _route_index(self, metric=False):
+        """
+        Cadena de medidas de cada vía: sus features ordenadas por M (el mismo
+        orden que road_sorted) con la longitud acumulada de la vía al inicio de
+        cada una. Se calcula una vez (por separado en unidades de la capa y en
+        metros). Devuelve arrays por feature: (inicio en la ruta, sentido de
+        la M, longitud); inicio NaN si la feature no tiene M válida.
+        """
+        attr = "_metric_route" if metric else "_route"
+        route = getattr(self, attr, None)
+        if route is None:
+            cum = self.metric_cum if metric else self.cum
+            first, last = self.feat_offsets[:-1], self.feat_offsets[1:] - 1
+            length = cum[last] if len(last) else np.empty(0, dtype=np.float64)
+            sense = np.where(self.m[last] < self.m[first], -1, 1).astype(np.int8)
+            start = np.full(len(length), np.nan)
+            order = self.road_sorted
+            if len(order):
+                csum = np.cumsum(length[order]) - length[order]
+                counts = np.diff(self.road_sorted_offsets)
+                group_start = np.repeat(csum[np.minimum(self.road_sorted_offsets[:-1], len(order) - 1)],
+                                        counts)
+                start[order] = csum - group_start
+            route = (start, sense, length)
+            setattr(self, attr, route)
+        return route
+
+    def route_position(self, fid, along, metric=False):
+        """
+        Distancia a lo largo de la vía, en el sentido creciente del PK, del
+        punto situado a ``along`` del inicio de la feature ``fid``. None si
+        la feature no forma parte de ninguna cadena. Con ``metric``, en
+        metros (requiere ``metric_cum``).
+        """
+        fi = self.feature_index(fid)
+        if fi is None:
+            return None
+        if metric:
+            if self.metric_cum is None:
+                return None
+            along = self.metric_along(fid, along)
+        start, sense, length = self._route_index(metric)
+        if np.isnan(start[fi]):
+            return None
+        offset = along if sense[fi] > 0 else length[fi] - along
+        return float(start[fi] + offset)
+
+    def route_distance(self, a, b, metric=False):
+        """
+        Longitud sobre la geometría entre dos puntos (PKMatch / PKLocation) de
+        la misma vía, aunque estén en features distintas: se suman las
+        longitudes precalculadas de las features intermedias de la cadena, sin
+        volver a recorrer la geometría. None si son de vías distintas.
+        Con ``metric``, en metros sobre ``metric_cum`` (elipsoidal); sin él,
+        en unidades del CRS de la capa.
+        """
+        if a.road is None or a.road != b.road:
+            return None
+        if a.fid == b.fid:
+            if metric:
+                ma, mb = self.metric_along(a.fid, a.along), self.metric_along(b.fid, b.along)
+                return None if ma is None else abs(mb - ma)
+            return abs(b.along - a.along)
+        pa = self.route_position(a.fid, a.along, metric)
+        pb = self.route_position(b.fid, b.along, metric)
+        if pa is None or pb is None:
+            return None
+        return abs(pb - pa)
+
+    # ---------- Segmentación dinámica ----------
+    def cut_range(self, road, pk_from, pk_to):
+        """Tramo de la vía entre dos PK (km), en una o varias features. PKEvent o None."""
+        events, _ = self.cut_many([road], [pk_from], [pk_to])
+        return events[0]
+
+    def cut_many(self, roads, pks_from, pks_to):
+        """
+        Segmentación dinámica por lotes: para cada evento (vía, PK inicial,
+        PK final, en km) recorta las líneas de la vía cuya M cae entre ambos.
+
+        - Las features candidatas salen del índice de intervalos de M de la
+          vía (búsqueda binaria), sin recorrer la capa.
+        - En features con M monótona (creciente o invertida) solo se recortan
+          los segmentos entre las dos medidas, localizados por búsqueda binaria.
+        - Las partes se separan en los saltos entre partes y entre features y
+          se devuelven en orden de digitalización (la M indica el sentido).
+
+        Devuelve (lista de PKEvent o None, array de estado STATUS_*). Los
+        eventos de longitud nula no generan geometría.
+        """
+        a_km = np.asarray(pks_from, dtype=np.float64) * self.factor
+        b_km = np.asarray(pks_to, dtype=np.float64) * self.factor
+        lo_all, hi_all = np.fmin(a_km, b_km), np.fmax(a_km, b_km)
+        lo_all[np.isnan(a_km) | np.isnan(b_km)] = np.nan
+        n = len(lo_all)
+        status = np.full(n, STATUS_UNKNOWN_ROAD, dtype=np.int8)
+        events = [None] * n
+
+        # 1) Pares (evento, feature) con rangos de M solapados, por vía
+        groups = {}
+        for i, road in enumerate(roads):
+            groups.setdefault(road, []).append(i)
+        ev_parts, fi_parts = [], []
+        for road, rows in groups.items():
+            intervals = self._road_intervals.get(road)
+            if intervals is None:
+                continue
+            rows = np.asarray(rows, dtype=np.int64)
+            status[rows] = STATUS_OUT_OF_RANGE
+            fis, lo, hi, hi_acc = intervals
+            if not len(fis):
+                continue
+            elo, ehi = lo_all[rows], hi_all[rows]
+            ok = ~np.isnan(elo)
+            j0 = np.searchsorted(hi_acc, np.where(ok, elo, 0.0) - EPS, side="left")
+            j1 = np.searchsorted(lo, np.where(ok, ehi, 0.0) + EPS, side="right")
+            cnt = np.where(ok, np.maximum(j1 - j0, 0), 0)
+            owner = np.repeat(np.arange(len(rows)), cnt)
+            j = np.repeat(j0, cnt) + _ranges(cnt)
+            keep = hi[j] >= elo[owner] - EPS
+            ev_parts.append(rows[owner[keep]])
+            fi_parts.append(fis[j[keep]])
+        if not ev_parts:
+            return events, status
+        ev = np.concatenate(ev_parts)
+        fi = np.concatenate(fi_parts).astype(np.int64)
+        order = np.lexsort((fi, ev))
+        ev, fi = ev[order], fi[order]
+
+        # 2) Rango de segmentos por par: toda la feature, o solo el tramo entre
+        #    las dos medidas si la calibración es monótona
+        seg_a = self.feat_offsets[fi].copy()
+        seg_b = self.feat_offsets[fi + 1] - 1
+        mono = self.m_monotonic[fi] != 0
+        if mono.any():
+            idx = np.nonzero(mono)[0]
+            idx = idx[np.argsort(fi[idx], kind="stable")]
+            feats, starts = np.unique(fi[idx], return_index=True)
+            for f, sel in zip(feats, np.split(idx, starts[1:])):
+                a, b = int(self.feat_offsets[f]), int(self.feat_offsets[f + 1])
+                if self.m_monotonic[f] > 0:
+                    ms, klo, khi = self.m[a:b], lo_all[ev[sel]], hi_all[ev[sel]]
+                else:
+                    ms, klo, khi = -self.m[a:b], -hi_all[ev[sel]], -lo_all[ev[sel]]
+                k0 = np.searchsorted(ms, klo - EPS, side="left")
+                k1 = np.searchsorted(ms, khi + EPS, side="right")
+                seg_a[sel] = a + np.maximum(k0 - 1, 0)
+                seg_b[sel] = a + np.minimum(k1, b - a - 1)
+
+        cnt = np.maximum(seg_b - seg_a, 0)
+        owner = np.repeat(np.arange(len(ev)), cnt)
+        s = np.repeat(seg_a, cnt) + _ranges(cnt)
+        ev_s = ev[owner]
+
+        # 3) Recorte de cada segmento a la ventana de M del evento
+        lo_s, hi_s = lo_all[ev_s], hi_all[ev_s]
+        m0, m1 = self.m[s], self.m[s + 1]
+        dm = m1 - m0
+        flat = np.abs(dm) < EPS
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ta = (lo_s - m0) / dm
+            tb = (hi_s - m0) / dm
+            tmin = np.where(flat, 0.0, np.clip(np.fmin(ta, tb), 0.0, 1.0))
+            tmax = np.where(flat, 1.0, np.clip(np.fmax(ta, tb), 0.0, 1.0))
+            inside_flat = (m0 >= lo_s - EPS) & (m0 <= hi_s + EPS)
+            keep = self.seg_valid[s] & np.where(flat, inside_flat, tmax - tmin > 0)
+        s, ev_s, tmin, tmax = s[keep], ev_s[keep], tmin[keep], tmax[keep]
+        if not len(s):
+            return events, status
+
+        # 4) Tramos continuos: segmentos consecutivos recorridos enteros
+        join = (
+            (ev_s[1:] == ev_s[:-1]) & (s[1:] == s[:-1] + 1)
+            & (tmax[:-1] >= 1.0 - EPS) & (tmin[1:] <= EPS)
+        )
+        new_run = np.r_[True, ~join]
+        npts = 1 + new_run.astype(np.int64)
+        pos = np.cumsum(npts) - npts
+        total = int(npts.sum())
+
+        out = [np.empty(total, dtype=np.float64) for _ in range(3)]
+        first = pos[new_run]
+        for arr, src in zip(out, (self.x, self.y, self.m)):
+            d = src[s + 1] - src[s]
+            arr[first] = (src[s] + tmin * d)[new_run]
+            arr[pos + new_run] = src[s] + tmax * d
+
+        seg_len = np.hypot(self.x[s + 1] - self.x[s], self.y[s + 1] - self.y[s])
+        lengths = np.bincount(ev_s, weights=(tmax - tmin) * seg_len, minlength=n)
+
+        # 5) Tramos agrupados por evento (ya vienen ordenados por evento)
+        run_start = np.nonzero(new_run)[0]
+        run_ev = ev_s[run_start]
+        run_fid = self.fids[np.searchsorted(self.feat_offsets, s[run_start], side="right") - 1]
+        bounds = np.r_[first, total].tolist()
+        x_out, y_out, m_out = out
+        ev_ids, ev_first = np.unique(run_ev, return_index=True)
+        ev_first = np.r_[ev_first, len(run_ev)].tolist()
+        for k, e in enumerate(ev_ids.tolist()):
+            r0, r1 = ev_first[k], ev_first[k + 1]
+            parts = [
+                (x_out[bounds[r]:bounds[r + 1]], y_out[bounds[r]:bounds[r + 1]],
+                 m_out[bounds[r]:bounds[r + 1]])
+                for r in range(r0, r1)
+            ]
+            fids = sorted(set(run_fid[r0:r1].tolist()))
+            events[e] = PKEvent(roads[e], fids, parts, float(lengths[e]))
+        status[ev_ids] = STATUS_FOUND
+        return events, status
+
+    # ---------- Distancia a lo largo → PK ----------
+    def _segment_at_distance(self, fi, along):
+        """
+        Segmento de la feature que contiene la distancia acumulada ``along``
+        y fracción t dentro de él, por búsqueda binaria sobre ``cum``.
+        """
+        a, b = int(self.feat_offsets[fi]), int(self.feat_offsets[fi + 1])
+        k = int(np.searchsorted(self.cum[a:b], along, side="left"))
+        s = a + min(max(k, 1), b - a - 1) - 1
+        seg_len = self.cum[s + 1] - self.cum[s]
+        t = (along - self.cum[s]) / seg_len if seg_len > 0 else 0.0
+        return s, min(max(t, 0.0), 1.0)
+
+    def pk_at_distance(self, fid, along):
+        """PK (km) a una distancia ``along`` desde el inicio de la feature ``fid``."""
+        fi = self.feature_index(fid)
+        if fi is None:
+            return None
+        s, t = self._segment_at_distance(fi, along)
+        m0, m1 = self.m[s], self.m[s + 1]
+        return float(m0 + t * (m1 - m0)) / self.factor
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+R-tree estático de segmentos, empaquetado con STR (Sort-Tile-Recursive).
+
+Se construye de una vez a partir de las extensiones de todos los segmentos
+de la red y se guarda como arrays por nivel (extensiones de los nodos y
+rango de hijos), sin objetos por nodo. La búsqueda del segmento más cercano
+es exacta: se baja nivel a nivel descartando, de forma vectorizada, los
+nodos cuya distancia mínima al punto supera la cota superior (MINMAXDIST:
+cada lado de la extensión de un nodo toca al menos un segmento). En las
+hojas quedan unos pocos segmentos sobre los que se proyecta el punto.
+
+A diferencia de buscar las N features de extensión más cercana, una feature
+larga y curva no puede tapar a otra corta que esté más cerca: se compara
+segmento a segmento.
+"""
+
+import numpy as np
+
+
+def _str_order(cx, cy, fanout):
+    """Permutación STR: franjas verticales por x y, dentro de cada una, orden por y."""
+    n = len(cx)
+    leaves = -(-n // fanout)
+    slabs = max(int(np.ceil(np.sqrt(leaves))), 1)
+    slab_size = slabs * fanout
+    by_x = np.argsort(cx, kind="stable")
+    slab = np.arange(n) // slab_size
+    return by_x[np.lexsort((cy[by_x], slab))]
+
+
+def _group(boxes, fanout):
+    """
+    Agrupa elementos consecutivos de ``fanout`` en ``fanout``. Devuelve las
+    extensiones de los grupos (n, 4: xmin, ymin, xmax, ymax) y el primer
+    elemento de cada grupo (n + 1).
+    """
+    n = len(boxes)
+    start = np.arange(0, n, fanout, dtype=np.int64)
+    group = np.empty((len(start), 4), dtype=np.float64)
+    group[:, :2] = np.minimum.reduceat(boxes[:, :2], start)
+    group[:, 2:] = np.maximum.reduceat(boxes[:, 2:], start)
+    return group, np.append(start, n)
+
+
+def _ranges_of(start, end):
+    """Concatena los rangos [start, end) como un solo array de índices."""
+    counts = end - start
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(start - (np.cumsum(counts) - counts), counts)
+    return np.arange(total, dtype=np.int64) + offsets
+
+
+class SegmentTree:
+    """R-tree empaquetado (STR) sobre los segmentos ``seg`` (vértice i → i+1)."""
+
+    FANOUT = 16
+
+    def __init__(self, x, y, seg, fanout=FANOUT):
+        self.fanout = fanout
+        ax, bx = x[seg], x[seg + 1]
+        ay, by = y[seg], y[seg + 1]
+        xmin, xmax = np.fmin(ax, bx), np.fmax(ax, bx)
+        ymin, ymax = np.fmin(ay, by), np.fmax(ay, by)
+
+        # Hojas: segmentos en orden STR
+        order = _str_order((xmin + xmax) * 0.5, (ymin + ymax) * 0.5, fanout) if len(seg) else seg
+        self.items = np.asarray(seg, dtype=np.int64)[order]
+        boxes = np.column_stack((xmin, ymin, xmax, ymax))[order]
+
+        # Niveles de abajo arriba: (extensiones, inicio de hijos, fin de hijos).
+        # Cada nivel reordena (STR) los grupos del anterior, así que los hijos
+        # de un nodo son siempre un rango contiguo del nivel inferior.
+        self.levels = []
+        while len(self.items):
+            group, offsets = _group(boxes, fanout)
+            start, end = offsets[:-1], offsets[1:]
+            if len(group) <= fanout:
+                self.levels.append((group, start, end))
+                break
+            order = _str_order((group[:, 0] + group[:, 2]) * 0.5,
+                               (group[:, 1] + group[:, 3]) * 0.5, fanout)
+            boxes = group[order]
+            self.levels.append((boxes, start[order], end[order]))
+        self.levels.reverse()   # raíz primero
+
+    # ---------- Persistencia ----------
+    def to_arrays(self):
+        """
+        Arrays planos del árbol (niveles concatenados, raíz primero) para
+        guardarlo y reabrirlo con ``from_arrays`` sin reconstruirlo.
+        """
+        sizes = [len(boxes) for boxes, _, _ in self.levels]
+        empty = np.empty(0, dtype=np.int64)
+        return {
+            "tree_items": self.items,
+            "tree_levels": np.concatenate(([0], np.cumsum(sizes, dtype=np.int64))),
+            "tree_boxes": (np.concatenate([lv[0] for lv in self.levels]) if self.levels
+                           else np.empty((0, 4), dtype=np.float64)),
+            "tree_start": np.concatenate([lv[1] for lv in self.levels]) if self.levels else empty,
+            "tree_end": np.concatenate([lv[2] for lv in self.levels]) if self.levels else empty,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, fanout=FANOUT):
+        """Reabre el árbol guardado con ``to_arrays`` (admite arrays mapeados en memoria)."""
+        tree = cls.__new__(cls)
+        tree.fanout = fanout
+        tree.items = arrays["tree_items"]
+        offsets = np.asarray(arrays["tree_levels"], dtype=np.int64)
+        boxes, start, end = arrays["tree_boxes"], arrays["tree_start"], arrays["tree_end"]
+        tree.levels = [
+            (boxes[a:b], start[a:b], end[a:b]) for a, b in zip(offsets[:-1], offsets[1:])
+        ]
+        return tree
+
+    def candidates(self, px, py, max_dist=None):
+        """
+        Segmentos que pueden ser el más cercano a (px, py): todos los de las
+        hojas que sobreviven a la poda. Con ``max_dist`` se descartan además
+        los nodos más lejanos que esa distancia.
+        """
+        if not self.levels:
+            return np.empty(0, dtype=np.int64)
+        bound = np.inf if max_dist is None else float(max_dist) ** 2
+        p = np.array([px, py, px, py], dtype=np.float64)
+        nodes = np.arange(len(self.levels[0][0]), dtype=np.int64)
+        for boxes, start, end in self.levels:
+            b = boxes[nodes]
+            # Distancias con signo a los lados: (xmin - px, ymin - py, px - xmax, py - ymax)
+            d = (b - p) * (1.0, 1.0, -1.0, -1.0)
+            out = np.maximum(np.maximum(d[:, :2], d[:, 2:]), 0.0)
+            mindist = (out * out).sum(axis=1)
+
+            # MINMAXDIST: lado cercano en un eje y extremo lejano en el otro
+            d2 = d * d
+            near = np.minimum(d2[:, :2], d2[:, 2:])
+            far = np.maximum(d2[:, :2], d2[:, 2:])
+            minmax = np.minimum(near[:, 0] + far[:, 1], near[:, 1] + far[:, 0])
+            if len(minmax):
+                bound = min(bound, float(minmax.min()))
+
+            keep = nodes[mindist <= bound]
+            nodes = _ranges_of(start[keep], end[keep])
+            if not len(nodes):
+                break
+        return self.items[nodes]
+
+    def pairs_within(self, px, py, max_dist, nearest=False):
+        """
+        Búsqueda por lotes: pares (índice del punto, segmento) cuya extensión
+        está a menos de ``max_dist`` de cada punto de (px, py), bajando el
+        árbol para todos los puntos a la vez. Con ``nearest`` se poda además
+        cada punto con su cota MINMAXDIST, como en candidates: solo quedan
+        los segmentos que pueden ser su más cercano.
+        Los pares salen ordenados por punto.
+        """
+        px = np.asarray(px, dtype=np.float64)
+        py = np.asarray(py, dtype=np.float64)
+        empty = np.empty(0, dtype=np.int64)
+        if not self.levels or not len(px):
+            return empty, empty
+
+        bound = np.full(len(px), float(max_dist) ** 2)
+        ok = np.nonzero(~(np.isnan(px) | np.isnan(py)))[0]
+        n_root = len(self.levels[0][0])
+        owner = np.repeat(ok, n_root)
+        nodes = np.tile(np.arange(n_root, dtype=np.int64), len(ok))
+        for boxes, start, end in self.levels:
+            qx, qy = px[owner], py[owner]
+            b = boxes[nodes]
+            d = np.column_stack((b[:, 0] - qx, b[:, 1] - qy, qx - b[:, 2], qy - b[:, 3]))
+            out = np.maximum(np.maximum(d[:, :2], d[:, 2:]), 0.0)
+            mindist = (out * out).sum(axis=1)
+            if nearest:
+                d2 = d * d
+                near = np.minimum(d2[:, :2], d2[:, 2:])
+                far = np.maximum(d2[:, :2], d2[:, 2:])
+                minmax = np.minimum(near[:, 0] + far[:, 1], near[:, 1] + far[:, 0])
+                # owner está ordenado: mínimo por punto con reduceat
+                first = np.r_[0, np.nonzero(owner[1:] != owner[:-1])[0] + 1]
+                pts = owner[first]
+                bound[pts] = np.minimum(bound[pts], np.minimum.reduceat(minmax, first))
+            keep = mindist <= bound[owner]
+            owner, nodes = owner[keep], nodes[keep]
+            if not len(nodes):
+                return empty, empty
+            owner = np.repeat(owner, end[nodes] - start[nodes])
+            nodes = _ranges_of(start[nodes], end[nodes])
+            if not len(nodes):
+                return empty, empty
+        return owner, self.items[nodes]
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Ajuste de trazas GPS a la red calibrada (solo Python + NumPy).
+
+Asigna vía y PK a cada posición de una traza (p. ej. un recorrido de
+auscultación) teniendo en cuenta la posición anterior: mientras el vehículo
+sigue en la misma vía con el PK avanzando en el mismo sentido, se prefiere esa
+vía aunque otra (un enlace, un paso superior...) quede algo más cerca.
+
+La traza se procesa por bloques (TraceMatcher.match) conservando el estado
+entre bloques, así que se puede leer y escribir en streaming. Los candidatos
+de cada bloque se calculan de forma vectorizada con el R-tree de segmentos
+del motor; solo la elección entre los pocos candidatos de cada posición se
+hace en secuencia.
+
+La red debe estar en un CRS en metros: el avance del PK (en metros) se
+compara con el desplazamiento entre posiciones en unidades del CRS. El
+algoritmo de Processing rechaza las capas calibradas en otras unidades
+(grados, pies...). Se asume además que la M es comparable a la longitud
+(como en la distancia lineal de Distancia PK).
+"""
+
+import math
+
+import numpy as np
+
+from .linref import PKMatchArray
+
+
+class TraceMatcher:
+    """
+    Estado del ajuste de una traza sobre un LinearReference.
+
+    Coste de cada candidato (el menor gana):
+      - distancia de la posición a la vía;
+      - ``switch_penalty`` si cambia de vía respecto a la posición anterior;
+      - ``switch_penalty`` si sigue en la misma vía pero el PK retrocede más de
+        ``backtrack_tolerance`` respecto al sentido de avance, o salta mucho
+        más de lo que se ha desplazado el vehículo.
+    """
+
+    def __init__(self, lr, max_dist, switch_penalty=None, backtrack_tolerance=None):
+        self.lr = lr
+        self.max_dist = float(max_dist)
+        self.switch_penalty = self.max_dist if switch_penalty is None else float(switch_penalty)
+        self.backtrack_tolerance = (self.max_dist if backtrack_tolerance is None
+                                    else float(backtrack_tolerance))
+        # Código entero de la vía de cada feature (índice en road_keys)
+        codes = {road: i for i, road in enumerate(lr.road_keys)}
+        self._road_code = np.fromiter((codes[r] for r in lr.roads), dtype=np.int64,
+                                      count=len(lr.roads))
+        self.reset()
+
+    def reset(self):
+        """Olvida la posición anterior (nueva traza)."""
+        self._prev = None        # (x, y, código de vía, PK en m)
+        self._anchor = None      # PK (m) de referencia para fijar el sentido
+        self._direction = 0      # +1 PK creciente, -1 decreciente, 0 aún sin fijar
+
+    def match(self, px, py):
+        """
+        Ajusta el siguiente bloque de posiciones de la traza. Devuelve un
+        PKMatchArray (fi = -1 en las posiciones sin vía a menos de max_dist).
+        """
+        lr = self.lr
+        px = np.asarray(px, dtype=np.float64)
+        py = np.asarray(py, dtype=np.float64)
+        n = len(px)
+        res = PKMatchArray(
+            np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64),
+            np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan),
+            np.full(n, np.nan), np.full(n, np.nan), np.zeros(n, dtype=np.int8),
+        )
+        if not n or not lr.seg_valid.any() or self.max_dist <= 0:
+            return res
+
+        owner, s, t, d2 = lr._candidate_pairs(px, py, self.max_dist)
+        if not len(owner):
+            return res
+
+        # Un candidato por (posición, vía): su proyección más cercana
+        fi = np.searchsorted(lr.feat_offsets, s, side="right") - 1
+        road = self._road_code[fi]
+        order = np.lexsort((d2, road, owner))
+        keep = order[np.r_[True, (owner[order][1:] != owner[order][:-1])
+                           | (road[order][1:] != road[order][:-1])]]
+        owner, s, t, d2, road = owner[keep], s[keep], t[keep], d2[keep], road[keep]
+        m0, m1 = lr.m[s], lr.m[s + 1]
+        pk_m = (m0 + t * (m1 - m0)) * (1000.0 / lr.factor)
+        bounds = np.searchsorted(owner, np.arange(n + 1))
+
+        # Elección secuencial entre los candidatos de cada posición
+        chosen = np.full(n, -1, dtype=np.int64)
+        c_road, c_pk = road.tolist(), pk_m.tolist()
+        c_dist = np.sqrt(d2).tolist()
+        xs, ys, lims = px.tolist(), py.tolist(), bounds.tolist()
+        penalty, back_tol = self.switch_penalty, self.backtrack_tolerance
+        prev, anchor, direction = self._prev, self._anchor, self._direction
+        for i in range(n):
+            lo, hi = lims[i], lims[i + 1]
+            if lo == hi:
+                continue
+            best, best_cost = lo, math.inf
+            for k in range(lo, hi):
+                cost = c_dist[k]
+                if prev is not None:
+                    if c_road[k] != prev[2]:
+                        cost += penalty
+                    else:
+                        dpk = c_pk[k] - prev[3]
+                        step = math.hypot(xs[i] - prev[0], ys[i] - prev[1])
+                        if direction * dpk < -back_tol or abs(dpk) > step + 2.0 * self.max_dist:
+                            cost += penalty
+                if cost < best_cost:
+                    best, best_cost = k, cost
+            chosen[i] = best
+
+            # Sentido de avance: se fija cuando el PK se ha alejado lo bastante
+            # del de entrada en la vía
+            if prev is None or c_road[best] != prev[2]:
+                anchor, direction = c_pk[best], 0
+            elif direction == 0 and abs(c_pk[best] - anchor) > back_tol:
+                direction = 1 if c_pk[best] > anchor else -1
+            prev = (xs[i], ys[i], c_road[best], c_pk[best])
+
+        self._prev, self._anchor, self._direction = prev, anchor, direction
+
+        rows = np.nonzero(chosen >= 0)[0]
+        k = chosen[rows]
+        lr._fill_matches(res, rows, s[k], t[k], px[rows], py[rows], d2[k])
+        return res
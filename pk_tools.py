@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 from qgis.PyQt.QtGui import QIcon
-from qgis.PyQt.QtWidgets import QAction, QToolButton, QMenu, QStyle
+from qgis.PyQt.QtWidgets import QAction, QToolButton, QMenu, QStyle, QFileDialog
 from qgis.PyQt.QtCore import Qt,QSize
+from qgis.core import QgsApplication
 
 from . import resources_rc
 from .tools.identificar_pk import IdentificarPK
 from .tools.localizar_pk import LocalizarPK
 from .tools.distancia_pk import DistanciaPK
+from .tools.index_registry import release_index_registry
+from .tools.profiling import profiler
+from .tools.transforms import release_transforms
+from .tools.history_store import release_history_store
+from .tools.federation import release_federation
+from .processing_provider.provider import PKToolsProvider
 from .settings import PKToolsSettings, show_settings_dialog
 
 
@@ -20,9 +27,16 @@ class PKToolsPlugin:
 
         self.toolbar = None
         self.actions = []  # por si quieres usarlo después
+        self.provider = None
+
+    def initProcessing(self):
+        """Registrar los algoritmos de PK Tools en Processing."""
+        self.provider = PKToolsProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
         """Crear la barra de herramientas propia del plugin y sus botones."""
+        self.initProcessing()
 
         # Crear toolbar propia
         self.toolbar = self.iface.addToolBar("PK Tools")
@@ -78,6 +92,20 @@ class PKToolsPlugin:
         act_cfg.triggered.connect(lambda: show_settings_dialog(self.iface))
         options_menu.addAction(act_cfg)
 
+        # Medición de tiempos por etapas (registro de mensajes, pestaña "PK Tools")
+        options_menu.addSeparator()
+        act_prof = QAction("Medir tiempos (registro 'PK Tools')", self.iface.mainWindow())
+        act_prof.setCheckable(True)
+        act_prof.setChecked(profiler().enabled)
+        act_prof.toggled.connect(profiler().set_enabled)
+        options_menu.addAction(act_prof)
+        act_prof_log = QAction("Resumen de tiempos en el registro", self.iface.mainWindow())
+        act_prof_log.triggered.connect(profiler().log_summary)
+        options_menu.addAction(act_prof_log)
+        act_prof_json = QAction("Exportar perfil de tiempos (JSON)…", self.iface.mainWindow())
+        act_prof_json.triggered.connect(self._export_profile)
+        options_menu.addAction(act_prof_json)
+
         menu_button.setMenu(options_menu)
         
         '''
@@ -105,6 +133,20 @@ class PKToolsPlugin:
         if not self.settings_mgr.has_config():
             show_settings_dialog(self.iface)
 
+    def _export_profile(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(), "Exportar perfil de tiempos", "pk_tools_perfil.json",
+            "JSON (*.json)"
+        )
+        if not path:
+            return
+        try:
+            profiler().dump_json(path)
+        except OSError as e:
+            self.iface.messageBar().pushWarning("PK Tools", f"No se pudo guardar el perfil: {e}")
+            return
+        self.iface.messageBar().pushInfo("PK Tools", f"Perfil de tiempos guardado en {path}")
+
     def unload(self):
         """Eliminar la barra de herramientas al desinstalar el plugin."""
         if self.toolbar is not None:
@@ -112,3 +154,11 @@ class PKToolsPlugin:
             self.iface.mainWindow().removeToolBar(self.toolbar)
             self.toolbar = None
         self.actions = []
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+        # Soltar índices cacheados y sus conexiones a señales de capas/proyecto
+        release_federation()
+        release_index_registry()
+        release_transforms()
+        release_history_store()
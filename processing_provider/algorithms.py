@@ -0,0 +1,845 @@
+# -*- coding: utf-8 -*-
+"""
+Algoritmos de Processing de PK Tools.
+
+  - Localizar PK:     tabla (vía, PK) → puntos con ESTADO
+  - Identificar PK:   capa de puntos → VIA, PK_KM, PK, DIST, LADO
+  - Distancia PK:     tabla (vía, PK1, PK2) → distancia por PK y lineal
+  - Segmentación PK:  tabla (vía, PK inicial, PK final) → tramos de línea M
+  - Control de calibración: capa calibrada → puntos con las incidencias de M
+  - Ajuste de traza GPS: traza de puntos → VIA, PK_KM, PK, DIST, LADO continuos
+  - Localizar PK desde CSV: CSV muy grande (vía, PK) → GeoPackage/FlatGeobuf en streaming
+
+Todos leen la capa calibrada (parámetro NETWORK) con el mismo motor que las
+herramientas del mapa (PKEngine), informan del progreso, se pueden cancelar
+y se ejecutan en segundo plano.
+"""
+
+import numpy as np
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsProcessing, QgsProcessingAlgorithm, QgsProcessingException,
+    QgsProcessingMultiStepFeedback, QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField, QgsProcessingParameterEnum,
+    QgsProcessingParameterDistance, QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterNumber, QgsFeatureRequest, QgsExpression,
+    QgsProcessingParameterFile, QgsProcessingParameterString,
+    QgsProcessingParameterFileDestination,
+    QgsFeature, QgsFeatureSink, QgsFields,
+    QgsGeometry, QgsPointXY, QgsLineString, QgsMultiLineString, QgsWkbTypes,
+    QgsCoordinateTransform, QgsUnitTypes
+)
+
+from ..settings import read_current_settings
+from ..tools.pk_engine import (
+    PKEngine, STATUS_FOUND, STATUS_OUT_OF_RANGE, STATUS_UNKNOWN_ROAD
+)
+from ..tools.localizar_lote import STATUS_LABELS, parse_pk, road_lookup
+from ..tools.identificar_lote import OUTPUT_FIELDS, SIDE_LABELS
+from ..tools.identificar_pk import formato_pk
+from ..tools import index_cache
+from ..tools.localizar_csv import ENCODINGS, ENCODING_LABELS, locate_csv
+from ..tools.file_writer import FILE_FILTER, extend_fields
+from ..tools.transforms import transform_xy
+from ..core.trace import TraceMatcher
+from ..core.calibration import (
+    audit_calibration, FINDING_NULL_M, FINDING_NON_MONOTONIC, FINDING_GAP,
+    FINDING_OVERLAP, FINDING_RATIO
+)
+
+
+M_UNITS = ["m", "km"]
+
+
+# ============================================================
+# BASE COMÚN: CAPA CALIBRADA Y MOTOR
+# ============================================================
+class _PKAlgorithm(QgsProcessingAlgorithm):
+    """Parámetros de la capa calibrada y construcción del motor de PK."""
+
+    NETWORK = "NETWORK"
+    NETWORK_ID_FIELD = "NETWORK_ID_FIELD"
+    M_UNITS = "M_UNITS"
+    INPUT = "INPUT"
+    OUTPUT = "OUTPUT"
+
+    def createInstance(self):
+        return type(self)()
+
+    def group(self):
+        return "Referenciación lineal"
+
+    def groupId(self):
+        return "referenciacion"
+
+    def add_network_parameters(self):
+        cfg = read_current_settings()
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.NETWORK, "Capa calibrada (líneas con M)",
+            [QgsProcessing.TypeVectorLine]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.NETWORK_ID_FIELD, "Campo identificador de la vía",
+            defaultValue=cfg["id_field"], parentLayerParameterName=self.NETWORK
+        ))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.M_UNITS, "Unidades del campo M", options=M_UNITS,
+            defaultValue=M_UNITS.index(cfg["m_units"])
+        ))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """
+        Hilo principal: resuelve la capa calibrada y el destino de su caché en
+        disco (consulta la capa y el proyecto), para que processAlgorithm, que
+        corre en segundo plano, solo tenga que abrir o construir los arrays.
+        Si el parámetro limita las features (selección, límite o filtro), la
+        caché de la capa entera no sirve y se lee la fuente.
+        """
+        self._cache_target = None
+        if index_cache.is_subset_source(parameters.get(self.NETWORK)):
+            return True
+        layer = self.parameterAsVectorLayer(parameters, self.NETWORK, context)
+        if layer is not None:
+            id_field = self.parameterAsString(parameters, self.NETWORK_ID_FIELD, context)
+            m_units = M_UNITS[self.parameterAsEnum(parameters, self.M_UNITS, context)]
+            self._cache_target = index_cache.cache_target(layer, id_field, m_units)
+        return True
+
+    def prepare_engine(self, parameters, context, feedback):
+        """
+        Devuelve (motor, fuente de la capa calibrada). Usa la caché en disco
+        resuelta en prepareAlgorithm si la capa es de fichero; si no, lee la
+        capa informando del progreso.
+        """
+        source = self.parameterAsSource(parameters, self.NETWORK, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.NETWORK))
+        id_field = self.parameterAsString(parameters, self.NETWORK_ID_FIELD, context)
+        m_units = M_UNITS[self.parameterAsEnum(parameters, self.M_UNITS, context)]
+        if source.fields().indexOf(id_field) == -1:
+            raise QgsProcessingException(f"La capa calibrada no tiene el campo '{id_field}'.")
+        if not QgsWkbTypes.hasM(source.wkbType()):
+            raise QgsProcessingException("La capa calibrada no tiene geometría M.")
+
+        target = getattr(self, "_cache_target", None)
+        engine = None if target is None else index_cache.load_from(target, m_units)
+        if engine is None:
+            feedback.pushInfo("Preparando la capa calibrada…")
+            engine = PKEngine.from_layer(source, id_field, m_units, feedback=feedback)
+        return engine, source
+
+    def read_rows(self, source, road_field, pk_fields, engine, feedback):
+        """
+        Lee la tabla de entrada: devuelve (features, vías, arrays de PK en km).
+        Los PK no válidos quedan como NaN.
+        """
+        lookup = road_lookup(engine)
+        total = max(source.featureCount(), 1)
+        feats, roads = [], []
+        pks = [[] for _ in pk_fields]
+        for count, feat in enumerate(source.getFeatures()):
+            if feedback.isCanceled():
+                break
+            via = feat[road_field]
+            roads.append(lookup.get(str(via), via))
+            for values, name in zip(pks, pk_fields):
+                pk = parse_pk(feat[name])
+                values.append(np.nan if pk is None else pk)
+            feats.append(feat)
+            feedback.setProgress(100.0 * count / total)
+        return feats, roads, [np.asarray(v, dtype=np.float64) for v in pks]
+
+
+# ============================================================
+# LOCALIZAR PK
+# ============================================================
+class LocalizarPKAlgorithm(_PKAlgorithm):
+    ROAD_FIELD = "ROAD_FIELD"
+    PK_FIELD = "PK_FIELD"
+
+    def name(self):
+        return "localizarpk"
+
+    def displayName(self):
+        return "Localizar PK"
+
+    def shortHelpString(self):
+        return (
+            "Localiza sobre la capa calibrada cada fila de la tabla (vía + PK, "
+            "en km o 'km+mmm'). Las filas no encontradas se conservan sin "
+            "geometría y con su ESTADO (FUERA DE RANGO / VIA DESCONOCIDA)."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Tabla de entrada", [QgsProcessing.TypeVector]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.ROAD_FIELD, "Campo de vía", parentLayerParameterName=self.INPUT
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.PK_FIELD, "Campo de PK", parentLayerParameterName=self.INPUT
+        ))
+        self.add_network_parameters()
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "PK localizados", QgsProcessing.TypeVectorPoint
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        steps = QgsProcessingMultiStepFeedback(3, feedback)
+        engine, network = self.prepare_engine(parameters, context, steps)
+        if engine is None or feedback.isCanceled():
+            return {}
+
+        table = self.parameterAsSource(parameters, self.INPUT, context)
+        if table is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        road_field = self.parameterAsString(parameters, self.ROAD_FIELD, context)
+        pk_field = self.parameterAsString(parameters, self.PK_FIELD, context)
+
+        steps.setCurrentStep(1)
+        feats, roads, (pks,) = self.read_rows(table, road_field, [pk_field], engine, steps)
+        if feedback.isCanceled():
+            return {}
+        res = engine.locate_many(roads, pks)
+
+        fields = extend_fields(table.fields(), [("PK_KM", QVariant.Double), ("ESTADO", QVariant.String)])
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields, QgsWkbTypes.Point, network.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        steps.setCurrentStep(2)
+        total = max(len(feats), 1)
+        for i, feat in enumerate(feats):
+            if feedback.isCanceled():
+                break
+            f = QgsFeature(fields)
+            pk = pks[i]
+            f.setAttributes(feat.attributes() + [None if pk != pk else float(pk),
+                                                 STATUS_LABELS[int(res.status[i])]])
+            if res.status[i] == STATUS_FOUND:
+                f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(float(res.x[i]), float(res.y[i]))))
+            sink.addFeature(f, QgsFeatureSink.FastInsert)
+            steps.setProgress(100.0 * i / total)
+
+        found = int((res.status == STATUS_FOUND).sum())
+        feedback.pushInfo(f"{found} de {len(feats)} filas localizadas.")
+        return {self.OUTPUT: dest_id}
+
+
+# ============================================================
+# IDENTIFICAR PK
+# ============================================================
+class IdentificarPKAlgorithm(_PKAlgorithm):
+    MAX_DIST = "MAX_DIST"
+
+    def name(self):
+        return "identificarpk"
+
+    def displayName(self):
+        return "Identificar PK de puntos"
+
+    def shortHelpString(self):
+        return (
+            "Proyecta cada punto sobre la vía más cercana de la capa calibrada "
+            "(hasta la distancia máxima indicada) y añade VIA, PK_KM, PK, DIST "
+            "y LADO (D/I respecto al sentido creciente del PK)."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Capa de puntos", [QgsProcessing.TypeVectorPoint]
+        ))
+        self.add_network_parameters()
+        self.addParameter(QgsProcessingParameterDistance(
+            self.MAX_DIST, "Distancia máxima a la vía",
+            defaultValue=50.0, minValue=0.0, parentParameterName=self.NETWORK
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "PK identificados", QgsProcessing.TypeVectorPoint
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        steps = QgsProcessingMultiStepFeedback(3, feedback)
+        engine, network = self.prepare_engine(parameters, context, steps)
+        if engine is None or feedback.isCanceled():
+            return {}
+
+        points = self.parameterAsSource(parameters, self.INPUT, context)
+        if points is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        max_dist = self.parameterAsDouble(parameters, self.MAX_DIST, context)
+
+        # Coordenadas en el CRS de la capa calibrada
+        steps.setCurrentStep(1)
+        xf = None
+        if points.sourceCrs() != network.sourceCrs():
+            xf = QgsCoordinateTransform(points.sourceCrs(), network.sourceCrs(),
+                                        context.transformContext())
+        total = max(points.featureCount(), 1)
+        feats, xs, ys = [], [], []
+        for count, feat in enumerate(points.getFeatures()):
+            if feedback.isCanceled():
+                return {}
+            geom = feat.geometry()
+            x = y = np.nan
+            if geom is not None and not geom.isEmpty():
+                pt = geom.vertexAt(0)
+                x, y = pt.x(), pt.y()
+            feats.append(feat)
+            xs.append(x)
+            ys.append(y)
+            steps.setProgress(100.0 * count / total)
+
+        xs, ys = transform_xy(xf, xs, ys)
+        res = engine.nearest_many(xs, ys, max_dist)
+
+        fields = extend_fields(points.fields(), OUTPUT_FIELDS)
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields, points.wkbType(), points.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        steps.setCurrentStep(2)
+        for i, feat in enumerate(feats):
+            if feedback.isCanceled():
+                break
+            f = QgsFeature(fields)
+            f.setGeometry(feat.geometry())
+            fi = int(res.fi[i])
+            if fi >= 0:
+                pk = float(res.pk[i])
+                extra = [engine.roads[fi], pk, formato_pk(pk),
+                         float(res.dist[i]), SIDE_LABELS[int(res.side[i])]]
+            else:
+                extra = [None] * len(OUTPUT_FIELDS)
+            f.setAttributes(feat.attributes() + extra)
+            sink.addFeature(f, QgsFeatureSink.FastInsert)
+            steps.setProgress(100.0 * i / total)
+
+        feedback.pushInfo(f"{int((res.fi >= 0).sum())} de {len(feats)} puntos identificados.")
+        return {self.OUTPUT: dest_id}
+
+
+# ============================================================
+# DISTANCIA PK
+# ============================================================
+class DistanciaPKAlgorithm(_PKAlgorithm):
+    ROAD_FIELD = "ROAD_FIELD"
+    PK1_FIELD = "PK1_FIELD"
+    PK2_FIELD = "PK2_FIELD"
+
+    def name(self):
+        return "distanciapk"
+
+    def displayName(self):
+        return "Distancia PK"
+
+    def shortHelpString(self):
+        return (
+            "Para cada fila (vía, PK1, PK2) calcula la distancia por PK y la "
+            "distancia lineal medida sobre la geometría, en km: sobre el "
+            "elipsoide del proyecto o, sin elipsoide, en el plano convirtiendo "
+            "las unidades del CRS. La distancia lineal se mide a lo largo de la "
+            "vía aunque los PK estén en features distintas."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Tabla de entrada", [QgsProcessing.TypeVector]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.ROAD_FIELD, "Campo de vía", parentLayerParameterName=self.INPUT
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.PK1_FIELD, "Campo de PK 1", parentLayerParameterName=self.INPUT
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.PK2_FIELD, "Campo de PK 2", parentLayerParameterName=self.INPUT
+        ))
+        self.add_network_parameters()
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Distancias PK", QgsProcessing.TypeVector
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        steps = QgsProcessingMultiStepFeedback(3, feedback)
+        engine, network = self.prepare_engine(parameters, context, steps)
+        if engine is None or feedback.isCanceled():
+            return {}
+        engine.prepare_metric(network.sourceCrs(), context.ellipsoid(), context.transformContext())
+
+        table = self.parameterAsSource(parameters, self.INPUT, context)
+        if table is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        road_field = self.parameterAsString(parameters, self.ROAD_FIELD, context)
+        pk_fields = [self.parameterAsString(parameters, name, context)
+                     for name in (self.PK1_FIELD, self.PK2_FIELD)]
+
+        steps.setCurrentStep(1)
+        feats, roads, (pk1, pk2) = self.read_rows(table, road_field, pk_fields, engine, steps)
+        if feedback.isCanceled():
+            return {}
+
+        fields = extend_fields(table.fields(), [
+            ("DIST_PK", QVariant.Double),
+            ("DIST_LINEAL", QVariant.Double),
+            ("ESTADO", QVariant.String),
+        ])
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields, QgsWkbTypes.NoGeometry
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        steps.setCurrentStep(2)
+        total = max(len(feats), 1)
+        for i, feat in enumerate(feats):
+            if feedback.isCanceled():
+                break
+            dist_pk = dist_lin = None
+            if not engine.has_road(roads[i]):
+                status = STATUS_UNKNOWN_ROAD
+            else:
+                loc1 = engine.locate(roads[i], float(pk1[i]))
+                loc2 = engine.locate(roads[i], float(pk2[i]))
+                if loc1 is None or loc2 is None:
+                    status = STATUS_OUT_OF_RANGE
+                else:
+                    status = STATUS_FOUND
+                    dist_pk = abs(float(pk2[i]) - float(pk1[i]))
+                    # Distancia lineal a lo largo de la vía (puede cruzar features)
+                    dist = engine.route_distance(loc1, loc2, metric=True)
+                    if dist is not None:
+                        dist_lin = dist / 1000.0
+            f = QgsFeature(fields)
+            f.setAttributes(feat.attributes() + [dist_pk, dist_lin, STATUS_LABELS[status]])
+            sink.addFeature(f, QgsFeatureSink.FastInsert)
+            steps.setProgress(100.0 * i / total)
+
+        return {self.OUTPUT: dest_id}
+
+
+# ============================================================
+# SEGMENTACIÓN DINÁMICA
+# ============================================================
+class SegmentacionPKAlgorithm(_PKAlgorithm):
+    ROAD_FIELD = "ROAD_FIELD"
+    PK_FROM_FIELD = "PK_FROM_FIELD"
+    PK_TO_FIELD = "PK_TO_FIELD"
+    CHUNK = 20000   # eventos por bloque
+
+    def name(self):
+        return "segmentacionpk"
+
+    def displayName(self):
+        return "Segmentación por PK"
+
+    def shortHelpString(self):
+        return (
+            "Genera, para cada evento (vía, PK inicial, PK final), el tramo de "
+            "línea con M correspondiente de la capa calibrada. El tramo puede "
+            "abarcar varias features de la vía; se admiten M invertida y "
+            "multipartes. Si el evento se sale de la calibración se recorta a la "
+            "parte existente. Los eventos que no se pueden resolver se conservan "
+            "sin geometría con su ESTADO."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Tabla de eventos", [QgsProcessing.TypeVector]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.ROAD_FIELD, "Campo de vía", parentLayerParameterName=self.INPUT
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.PK_FROM_FIELD, "Campo de PK inicial", parentLayerParameterName=self.INPUT
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.PK_TO_FIELD, "Campo de PK final", parentLayerParameterName=self.INPUT
+        ))
+        self.add_network_parameters()
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Tramos", QgsProcessing.TypeVectorLine
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        steps = QgsProcessingMultiStepFeedback(3, feedback)
+        engine, network = self.prepare_engine(parameters, context, steps)
+        if engine is None or feedback.isCanceled():
+            return {}
+
+        table = self.parameterAsSource(parameters, self.INPUT, context)
+        if table is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        road_field = self.parameterAsString(parameters, self.ROAD_FIELD, context)
+        pk_fields = [self.parameterAsString(parameters, name, context)
+                     for name in (self.PK_FROM_FIELD, self.PK_TO_FIELD)]
+
+        steps.setCurrentStep(1)
+        feats, roads, (pk_from, pk_to) = self.read_rows(table, road_field, pk_fields, engine, steps)
+        if feedback.isCanceled():
+            return {}
+
+        fields = extend_fields(table.fields(), [
+            ("LONGITUD", QVariant.Double),
+            ("ESTADO", QVariant.String),
+        ])
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields,
+            QgsWkbTypes.MultiLineStringM, network.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        # Segmentación por bloques de eventos (memoria acotada en tablas grandes)
+        steps.setCurrentStep(2)
+        total = max(len(feats), 1)
+        found = 0
+        for c0 in range(0, len(feats), self.CHUNK):
+            if feedback.isCanceled():
+                break
+            c1 = c0 + self.CHUNK
+            tramos, status = engine.cut_many(roads[c0:c1], pk_from[c0:c1], pk_to[c0:c1])
+            for k, feat in enumerate(feats[c0:c1]):
+                f = QgsFeature(fields)
+                tramo = tramos[k]
+                label = STATUS_LABELS[int(status[k])]
+                if tramo is not None:
+                    multi = QgsMultiLineString()
+                    for xs, ys, ms in tramo.parts:
+                        multi.addGeometry(QgsLineString(xs.tolist(), ys.tolist(), [], ms.tolist()))
+                    f.setGeometry(QgsGeometry(multi))
+                    f.setAttributes(feat.attributes() + [tramo.length, label])
+                    found += 1
+                else:
+                    f.setAttributes(feat.attributes() + [None, label])
+                sink.addFeature(f, QgsFeatureSink.FastInsert)
+            steps.setProgress(100.0 * min(c1, len(feats)) / total)
+
+        feedback.pushInfo(f"{found} de {len(feats)} eventos segmentados.")
+        return {self.OUTPUT: dest_id}
+
+
+# ============================================================
+# CONTROL DE CALIBRACIÓN
+# ============================================================
+FINDING_LABELS = {
+    FINDING_NULL_M: "M NULA",
+    FINDING_NON_MONOTONIC: "M NO MONOTONA",
+    FINDING_GAP: "HUECO DE M",
+    FINDING_OVERLAP: "SOLAPE DE M",
+    FINDING_RATIO: "M / LONGITUD",
+}
+
+
+class CalibracionPKAlgorithm(_PKAlgorithm):
+    GAP_TOLERANCE = "GAP_TOLERANCE"
+    RATIO_TOLERANCE = "RATIO_TOLERANCE"
+
+    def name(self):
+        return "calibracionpk"
+
+    def displayName(self):
+        return "Control de calibración"
+
+    def shortHelpString(self):
+        return (
+            "Revisa la calibración de toda la capa en una sola pasada y genera "
+            "una capa de puntos con las incidencias encontradas (TIPO):\n"
+            "  - M NULA: vértice sin valor M.\n"
+            "  - M NO MONOTONA: la M retrocede respecto al sentido de la feature.\n"
+            "  - HUECO DE M / SOLAPE DE M: entre features consecutivas de una "
+            "vía (ordenadas por M), mayores que la tolerancia.\n"
+            "  - M / LONGITUD: el rango de M de la feature no corresponde con su "
+            "longitud (cociente relativo al de la red fuera de la tolerancia).\n"
+            "VALOR es el salto de M en km, o el cociente relativo en M / LONGITUD."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.add_network_parameters()
+        self.addParameter(QgsProcessingParameterNumber(
+            self.GAP_TOLERANCE, "Tolerancia de huecos y solapes (km)",
+            QgsProcessingParameterNumber.Double, defaultValue=0.001, minValue=0.0
+        ))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.RATIO_TOLERANCE, "Tolerancia del cociente M / longitud (0.05 = ±5 %)",
+            QgsProcessingParameterNumber.Double, defaultValue=0.05, minValue=0.0
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Incidencias de calibración", QgsProcessing.TypeVectorPoint
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        steps = QgsProcessingMultiStepFeedback(2, feedback)
+        engine, network = self.prepare_engine(parameters, context, steps)
+        if engine is None or feedback.isCanceled():
+            return {}
+        gap_tol = self.parameterAsDouble(parameters, self.GAP_TOLERANCE, context)
+        ratio_tol = self.parameterAsDouble(parameters, self.RATIO_TOLERANCE, context)
+
+        findings = audit_calibration(engine, gap_tol, ratio_tol)
+
+        fields = extend_fields(QgsFields(), [
+            ("TIPO", QVariant.String),
+            ("VIA", QVariant.String),
+            ("FID", QVariant.LongLong),
+            ("M", QVariant.Double),
+            ("VALOR", QVariant.Double),
+        ])
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields,
+            QgsWkbTypes.Point, network.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        steps.setCurrentStep(1)
+        total = max(len(findings.kind), 1)
+        for i in range(len(findings.kind)):
+            if feedback.isCanceled():
+                break
+            fi, v = int(findings.fi[i]), int(findings.vertex[i])
+            m, value = float(findings.m[i]), float(findings.value[i])
+            road = engine.roads[fi]
+            f = QgsFeature(fields)
+            f.setGeometry(QgsGeometry.fromPointXY(
+                QgsPointXY(float(engine.x[v]), float(engine.y[v]))
+            ))
+            f.setAttributes([
+                FINDING_LABELS[int(findings.kind[i])],
+                None if road is None else str(road),
+                int(engine.fids[fi]),
+                None if np.isnan(m) else m,
+                None if np.isnan(value) else value,
+            ])
+            sink.addFeature(f, QgsFeatureSink.FastInsert)
+            if i % 1000 == 0:
+                steps.setProgress(100.0 * i / total)
+
+        counts = np.bincount(findings.kind, minlength=len(FINDING_LABELS))
+        for kind, label in FINDING_LABELS.items():
+            feedback.pushInfo(f"{label}: {int(counts[kind])}")
+        return {self.OUTPUT: dest_id}
+
+
+# ============================================================
+# AJUSTE DE TRAZA GPS
+# ============================================================
+class AjusteTrazaAlgorithm(_PKAlgorithm):
+    ORDER_FIELD = "ORDER_FIELD"
+    TRACE_FIELD = "TRACE_FIELD"
+    MAX_DIST = "MAX_DIST"
+    CHUNK = 5000   # posiciones por bloque
+
+    def name(self):
+        return "ajustetrazapk"
+
+    def displayName(self):
+        return "Ajuste de traza GPS"
+
+    def shortHelpString(self):
+        return (
+            "Asigna vía y PK a cada posición de una traza GPS teniendo en "
+            "cuenta la posición anterior: mientras el vehículo sigue por la "
+            "misma vía con el PK avanzando en el mismo sentido se mantiene esa "
+            "vía, aunque otra (enlace, paso superior...) quede algo más cerca. "
+            "Las posiciones se recorren en el orden del campo de orden (p. ej. "
+            "la hora) y, si se indica un campo de recorrido, cada recorrido se "
+            "ajusta por separado. La traza se procesa por bloques, sin cargarla "
+            "entera en memoria. La capa calibrada debe estar en un CRS en metros "
+            "(el avance del PK se compara con el desplazamiento entre posiciones)."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Traza GPS (puntos)", [QgsProcessing.TypeVectorPoint]
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.ORDER_FIELD, "Campo de orden (fecha/hora, nº de posición...)",
+            parentLayerParameterName=self.INPUT, optional=True
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.TRACE_FIELD, "Campo de recorrido", parentLayerParameterName=self.INPUT,
+            optional=True
+        ))
+        self.add_network_parameters()
+        self.addParameter(QgsProcessingParameterDistance(
+            self.MAX_DIST, "Distancia máxima a la vía",
+            defaultValue=25.0, minValue=0.0, parentParameterName=self.NETWORK
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Traza con PK", QgsProcessing.TypeVectorPoint
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        # El coste compara el avance del PK (m) con el desplazamiento entre
+        # posiciones en unidades del CRS: en grados o pies no tendría sentido
+        source = self.parameterAsSource(parameters, self.NETWORK, context)
+        if source is not None and source.sourceCrs().mapUnits() != QgsUnitTypes.DistanceMeters:
+            raise QgsProcessingException(
+                "El ajuste de trazas necesita la capa calibrada en un CRS en metros "
+                f"({source.sourceCrs().authid() or 'CRS de la capa'} no lo está). "
+                "Reproyecta la capa a un CRS proyectado en metros."
+            )
+
+        steps = QgsProcessingMultiStepFeedback(2, feedback)
+        engine, network = self.prepare_engine(parameters, context, steps)
+        if engine is None or feedback.isCanceled():
+            return {}
+
+        points = self.parameterAsSource(parameters, self.INPUT, context)
+        if points is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        order_field = self.parameterAsString(parameters, self.ORDER_FIELD, context)
+        trace_field = self.parameterAsString(parameters, self.TRACE_FIELD, context)
+        max_dist = self.parameterAsDouble(parameters, self.MAX_DIST, context)
+
+        fields = extend_fields(points.fields(), OUTPUT_FIELDS)
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields, points.wkbType(), points.sourceCrs()
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        xf = None
+        if points.sourceCrs() != network.sourceCrs():
+            xf = QgsCoordinateTransform(points.sourceCrs(), network.sourceCrs(),
+                                        context.transformContext())
+
+        # El proveedor entrega las posiciones ya ordenadas por recorrido y orden
+        request = QgsFeatureRequest()
+        for name in (trace_field, order_field):
+            if name:
+                request.addOrderBy(QgsExpression.quotedColumnRef(name), True)
+
+        matcher = TraceMatcher(engine, max_dist)
+        steps.setCurrentStep(1)
+        total = max(points.featureCount(), 1)
+        stats = [0, 0]   # posiciones leídas, posiciones ajustadas
+        block = []
+        current_trace = None
+
+        def flush():
+            if not block:
+                return
+            xs, ys = transform_xy(xf, [b[1] for b in block], [b[2] for b in block])
+            res = matcher.match(xs, ys)
+            for i, (feat, _, _) in enumerate(block):
+                f = QgsFeature(fields)
+                f.setGeometry(feat.geometry())
+                fi = int(res.fi[i])
+                if fi >= 0:
+                    pk = float(res.pk[i])
+                    extra = [engine.roads[fi], pk, formato_pk(pk),
+                             float(res.dist[i]), SIDE_LABELS[int(res.side[i])]]
+                    stats[1] += 1
+                else:
+                    extra = [None] * len(OUTPUT_FIELDS)
+                f.setAttributes(feat.attributes() + extra)
+                sink.addFeature(f, QgsFeatureSink.FastInsert)
+            block.clear()
+
+        for feat in points.getFeatures(request):
+            if feedback.isCanceled():
+                return {}
+            if trace_field:
+                trace = feat[trace_field]
+                if stats[0] and trace != current_trace:
+                    # Recorrido nuevo: se ajusta sin tener en cuenta el anterior
+                    flush()
+                    matcher.reset()
+                current_trace = trace
+            x = y = np.nan
+            geom = feat.geometry()
+            if geom is not None and not geom.isEmpty():
+                pt = geom.vertexAt(0)
+                x, y = pt.x(), pt.y()
+            block.append((feat, x, y))
+            stats[0] += 1
+            if len(block) >= self.CHUNK:
+                flush()
+                steps.setProgress(100.0 * stats[0] / total)
+        flush()
+
+        feedback.pushInfo(f"{stats[1]} de {stats[0]} posiciones ajustadas.")
+        return {self.OUTPUT: dest_id}
+
+
+# ============================================================
+# LOCALIZAR PK DESDE CSV (STREAMING)
+# ============================================================
+class LocalizarCSVAlgorithm(_PKAlgorithm):
+    ROAD_COLUMN = "ROAD_COLUMN"
+    PK_COLUMN = "PK_COLUMN"
+    DELIMITER = "DELIMITER"
+    ENCODING = "ENCODING"
+
+    def name(self):
+        return "localizarcsv"
+
+    def displayName(self):
+        return "Localizar PK desde CSV (fichero grande)"
+
+    def shortHelpString(self):
+        return (
+            "Localiza cada fila (vía + PK, en km o 'km+mmm') de un CSV de "
+            "cualquier tamaño y escribe el resultado directamente a GeoPackage "
+            "o FlatGeobuf. El CSV se lee y se escribe por bloques, sin cargarlo "
+            "como capa, así que la memoria no crece con el número de filas. "
+            "Salida: columnas del CSV (texto) + PK_KM + ESTADO; las filas no "
+            "encontradas se escriben sin geometría. Codificación: 'Detectar' "
+            "prueba UTF-8 y, si no, Windows-1252. Si falla la lectura, no se "
+            "deja el fichero de salida a medias."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(
+            self.INPUT, "Fichero CSV", extension="csv"
+        ))
+        self.addParameter(QgsProcessingParameterString(
+            self.ROAD_COLUMN, "Columna de vía", defaultValue="VIA"
+        ))
+        self.addParameter(QgsProcessingParameterString(
+            self.PK_COLUMN, "Columna de PK", defaultValue="PK"
+        ))
+        self.addParameter(QgsProcessingParameterString(
+            self.DELIMITER, "Separador (vacío: detectar)", optional=True
+        ))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.ENCODING, "Codificación", options=ENCODING_LABELS, defaultValue=0
+        ))
+        self.add_network_parameters()
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OUTPUT, "PK localizados", fileFilter=FILE_FILTER
+        ))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        steps = QgsProcessingMultiStepFeedback(2, feedback)
+        engine, network = self.prepare_engine(parameters, context, steps)
+        if engine is None or feedback.isCanceled():
+            return {}
+
+        path = self.parameterAsFile(parameters, self.INPUT, context)
+        road_col = self.parameterAsString(parameters, self.ROAD_COLUMN, context)
+        pk_col = self.parameterAsString(parameters, self.PK_COLUMN, context)
+        delimiter = self.parameterAsString(parameters, self.DELIMITER, context) or None
+        encoding = ENCODINGS[self.parameterAsEnum(parameters, self.ENCODING, context)]
+        dest = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+
+        steps.setCurrentStep(1)
+        try:
+            counts = locate_csv(
+                engine, path, road_col, pk_col, dest, network.sourceCrs(),
+                context.transformContext(), delimiter, feedback=steps, encoding=encoding
+            )
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            raise QgsProcessingException(str(e))
+        if counts is None or feedback.isCanceled():
+            return {}
+
+        feedback.pushInfo(" · ".join(f"{k}: {v}" for k, v in counts.items()))
+        return {self.OUTPUT: dest}
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Proveedor de Processing de PK Tools.
+
+Expone las operaciones de PK como algoritmos de Processing para poder usarlas
+en modelos, en el modo por lotes y desde qgis_process, sin pasar por la barra
+de herramientas.
+"""
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import QgsProcessingProvider
+
+from .algorithms import (
+    LocalizarPKAlgorithm, IdentificarPKAlgorithm, DistanciaPKAlgorithm,
+    SegmentacionPKAlgorithm, CalibracionPKAlgorithm, AjusteTrazaAlgorithm,
+    LocalizarCSVAlgorithm
+)
+
+
+class PKToolsProvider(QgsProcessingProvider):
+
+    def loadAlgorithms(self):
+        for alg in (
+            LocalizarPKAlgorithm(),
+            IdentificarPKAlgorithm(),
+            DistanciaPKAlgorithm(),
+            SegmentacionPKAlgorithm(),
+            CalibracionPKAlgorithm(),
+            AjusteTrazaAlgorithm(),
+            LocalizarCSVAlgorithm(),
+        ):
+            self.addAlgorithm(alg)
+
+    def id(self):
+        return "pktools"
+
+    def name(self):
+        return "PK Tools"
+
+    def icon(self):
+        return QIcon(":/plugins/pk_tools/icons/identificar.png")
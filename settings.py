@@ -7,12 +7,17 @@ Módulo de configuración para PK Tools.
     * Capa de trabajo por defecto
     * Campo identificador de la vía
     * Unidades del campo M (m o km)
+    * Otras capas calibradas que se consultan junto a la principal, cada
+      una con su campo y sus unidades (red estatal, autonómica, municipal...)
     * Vista previa de algunos valores M
+    * Acceso al control de calibración de toda la capa (Processing)
 """
 
+import json
+
 from qgis.PyQt.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel,
-    QComboBox, QPushButton, QDialogButtonBox, QTextEdit
+    QComboBox, QPushButton, QDialogButtonBox, QTextEdit, QListWidget
 )
 from qgis.PyQt.QtCore import Qt
 from qgis.core import (
@@ -32,6 +37,8 @@ class PKToolsSettings:
     KEY_LAYER_NAME = SETTINGS_GROUP + "/layer_name"
     KEY_ID_FIELD = SETTINGS_GROUP + "/id_field"
     KEY_M_UNITS  = SETTINGS_GROUP + "/m_units"   # "m" o "km"
+    # Capas adicionales (JSON: lista de {layer_name, id_field, m_units})
+    KEY_EXTRA_LAYERS = SETTINGS_GROUP + "/extra_layers"
 
     def __init__(self):
         self._qsettings = QgsSettings()
@@ -45,25 +52,60 @@ class PKToolsSettings:
     def load(self):
         """
         Devuelve un dict con la configuración actual (o valores por defecto).
+
+        Además de la capa principal (layer_name, id_field, m_units), incluye:
+          - extra_layers: capas adicionales, cada una como dict
+            {layer_name, id_field, m_units}
+          - layers: la principal seguida de las adicionales (orden de
+            prioridad); vacía si no hay capa principal
         """
         layer_name = self._qsettings.value(self.KEY_LAYER_NAME, "", type=str)
         id_field   = self._qsettings.value(self.KEY_ID_FIELD, "ID_ROAD", type=str)
         m_units    = self._qsettings.value(self.KEY_M_UNITS, "m", type=str)
         if m_units not in ("m", "km"):
             m_units = "m"
+        extra = self._load_extra_layers()
+        primary = layer_config(layer_name, id_field, m_units)
         return {
             "layer_name": layer_name,
             "id_field": id_field,
             "m_units": m_units,
+            "extra_layers": extra,
+            "layers": [primary] + extra if layer_name else [],
         }
 
-    def save(self, layer_name: str, id_field: str, m_units: str):
+    def _load_extra_layers(self):
+        raw = self._qsettings.value(self.KEY_EXTRA_LAYERS, "", type=str)
+        try:
+            entries = json.loads(raw) if raw else []
+        except ValueError:
+            return []
+        return [
+            layer_config(e.get("layer_name"), e.get("id_field"), e.get("m_units"))
+            for e in entries if isinstance(e, dict) and e.get("layer_name")
+        ]
+
+    def save(self, layer_name: str, id_field: str, m_units: str, extra_layers=None):
         """
-        Guarda los valores indicados.
+        Guarda los valores indicados. ``extra_layers`` (lista de dicts como
+        los de load) sustituye a las capas adicionales; None las conserva.
         """
         self._qsettings.setValue(self.KEY_LAYER_NAME, layer_name)
         self._qsettings.setValue(self.KEY_ID_FIELD, id_field)
         self._qsettings.setValue(self.KEY_M_UNITS, m_units)
+        if extra_layers is not None:
+            self._qsettings.setValue(self.KEY_EXTRA_LAYERS, json.dumps([
+                layer_config(e["layer_name"], e["id_field"], e["m_units"]) for e in extra_layers
+            ]))
+
+
+def layer_config(layer_name, id_field, m_units):
+    """Entrada de capa calibrada, con los valores por defecto si faltan."""
+    return {
+        "layer_name": layer_name or "",
+        "id_field": id_field or "ID_ROAD",
+        "m_units": m_units if m_units in ("m", "km") else "m",
+    }
 
 
 class PKToolsSettingsDialog(QDialog):
@@ -75,6 +117,7 @@ class PKToolsSettingsDialog(QDialog):
       - Campo identificador de la vía
       - Unidades del campo M (m o km)
       - Vista previa de algunos valores M de la capa
+      - Otras capas calibradas, cada una con su campo y unidades
     """
 
     def __init__(self, parent=None):
@@ -84,6 +127,8 @@ class PKToolsSettingsDialog(QDialog):
 
         self.settings_mgr = PKToolsSettings()
         self.current_cfg = self.settings_mgr.load()
+        self._entries = []      # capas calibradas, la principal primero
+        self._loading = True    # combos actualizándose desde código
 
         self._layers = self._find_candidate_layers()
 
@@ -96,6 +141,26 @@ class PKToolsSettingsDialog(QDialog):
     def _build_ui(self):
         layout = QVBoxLayout(self)
 
+        # Capas calibradas: la seleccionada se edita con los combos de abajo
+        layout.addWidget(QLabel(
+            "Capas calibradas (se consultan todas; la primera es la principal y\n"
+            "manda si un identificador de vía se repite en varias):"
+        ))
+        row_list = QHBoxLayout()
+        self.lst_layers = QListWidget()
+        self.lst_layers.setMaximumHeight(100)
+        self.lst_layers.currentRowChanged.connect(self._on_entry_selected)
+        row_list.addWidget(self.lst_layers)
+        col_btns = QVBoxLayout()
+        for text, slot in (("Añadir", self._add_entry), ("Quitar", self._remove_entry),
+                           ("Subir", self._move_entry_up)):
+            btn = QPushButton(text)
+            btn.clicked.connect(slot)
+            col_btns.addWidget(btn)
+        col_btns.addStretch()
+        row_list.addLayout(col_btns)
+        layout.addLayout(row_list)
+
         # Capa
         row_layer = QHBoxLayout()
         row_layer.addWidget(QLabel("Capa de vías calibradas:"))
@@ -103,6 +168,7 @@ class PKToolsSettingsDialog(QDialog):
         for lyr in self._layers:
             self.cbo_layer.addItem(lyr.name())
         self.cbo_layer.currentIndexChanged.connect(self._on_layer_changed)
+        self.cbo_layer.currentIndexChanged.connect(self._store_entry)
         row_layer.addWidget(self.cbo_layer)
         layout.addLayout(row_layer)
 
@@ -110,6 +176,7 @@ class PKToolsSettingsDialog(QDialog):
         row_field = QHBoxLayout()
         row_field.addWidget(QLabel("Campo identificador de la vía:"))
         self.cbo_field = QComboBox()
+        self.cbo_field.currentIndexChanged.connect(self._store_entry)
         row_field.addWidget(self.cbo_field)
         layout.addLayout(row_field)
 
@@ -119,6 +186,7 @@ class PKToolsSettingsDialog(QDialog):
         self.cbo_units = QComboBox()
         self.cbo_units.addItem("Metros", "m")
         self.cbo_units.addItem("Kilómetros", "km")
+        self.cbo_units.currentIndexChanged.connect(self._store_entry)
         row_units.addWidget(self.cbo_units)
         layout.addLayout(row_units)
 
@@ -129,6 +197,11 @@ class PKToolsSettingsDialog(QDialog):
         self.txt_preview.setMinimumHeight(120)
         layout.addWidget(self.txt_preview)
 
+        # Revisión completa de la calibración (algoritmo de Processing)
+        self.btn_audit = QPushButton("Revisar la calibración de toda la capa…")
+        self.btn_audit.clicked.connect(self._open_calibration_audit)
+        layout.addWidget(self.btn_audit)
+
         # Botones OK / Cancelar
         self.btn_box = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
@@ -147,29 +220,98 @@ class PKToolsSettingsDialog(QDialog):
         Intenta seleccionar en la UI los valores guardados.
         """
         cfg = self.current_cfg
+        self._entries = [dict(e) for e in cfg["layers"]] or [
+            layer_config("", cfg["id_field"], cfg["m_units"])
+        ]
+        self._loading = False
+        self._refresh_list(0)
+
+    def _show_entry(self, entry):
+        """Muestra en los combos la capa, el campo y las unidades de una entrada."""
+        self._loading = True
+        found = False
 
         # Seleccionar capa por nombre
-        if self._layers and cfg["layer_name"]:
+        if self._layers and entry["layer_name"]:
             for i, lyr in enumerate(self._layers):
-                if lyr.name() == cfg["layer_name"]:
+                if lyr.name() == entry["layer_name"]:
                     self.cbo_layer.setCurrentIndex(i)
+                    found = True
                     break
 
         # Disparar actualización de campos + preview
         self._on_layer_changed(self.cbo_layer.currentIndex())
 
         # Seleccionar id_field
-        if cfg["id_field"]:
-            idx = self.cbo_field.findText(cfg["id_field"])
+        if entry["id_field"]:
+            idx = self.cbo_field.findText(entry["id_field"])
             if idx >= 0:
                 self.cbo_field.setCurrentIndex(idx)
 
         # Seleccionar unidades
-        units = cfg["m_units"]
-        idx_units = self.cbo_units.findData(units)
+        idx_units = self.cbo_units.findData(entry["m_units"])
         if idx_units >= 0:
             self.cbo_units.setCurrentIndex(idx_units)
 
+        self._loading = False
+        # Una capa que no está en el proyecto se conserva tal cual; si no, la
+        # entrada pasa a ser lo que muestran los combos
+        if found or not entry["layer_name"]:
+            self._store_entry()
+
+    # ---------------------------
+    # Lista de capas calibradas
+    # ---------------------------
+    def _entry_text(self, entry):
+        text = (f"{entry['layer_name'] or '(sin capa)'} · {entry['id_field']} · "
+                f"M en {entry['m_units']}")
+        if entry["layer_name"] and not any(lyr.name() == entry["layer_name"] for lyr in self._layers):
+            text += " (no cargada)"
+        return text
+
+    def _refresh_list(self, row):
+        self._loading = True
+        self.lst_layers.clear()
+        for entry in self._entries:
+            self.lst_layers.addItem(self._entry_text(entry))
+        self._loading = False
+        self.lst_layers.setCurrentRow(row)
+
+    def _on_entry_selected(self, row):
+        if not self._loading and 0 <= row < len(self._entries):
+            self._show_entry(self._entries[row])
+
+    def _store_entry(self, *args):
+        """Guarda en la entrada seleccionada lo que muestran los combos."""
+        if self._loading:
+            return
+        row = self.lst_layers.currentRow()
+        if not 0 <= row < len(self._entries):
+            return
+        self._entries[row] = layer_config(
+            self.selected_layer_name(), self.selected_id_field(), self.selected_m_units()
+        )
+        self.lst_layers.item(row).setText(self._entry_text(self._entries[row]))
+
+    def _add_entry(self):
+        """Añade una capa (la primera candidata que aún no esté en la lista)."""
+        used = {e["layer_name"] for e in self._entries}
+        name = next((lyr.name() for lyr in self._layers if lyr.name() not in used), "")
+        self._entries.append(layer_config(name, None, None))
+        self._refresh_list(len(self._entries) - 1)
+
+    def _remove_entry(self):
+        row = self.lst_layers.currentRow()
+        if len(self._entries) > 1 and 0 <= row < len(self._entries):
+            del self._entries[row]
+            self._refresh_list(min(row, len(self._entries) - 1))
+
+    def _move_entry_up(self):
+        row = self.lst_layers.currentRow()
+        if 0 < row < len(self._entries):
+            self._entries[row - 1], self._entries[row] = self._entries[row], self._entries[row - 1]
+            self._refresh_list(row - 1)
+
     # ---------------------------
     # Búsqueda de capas y preview
     # ---------------------------
@@ -239,6 +381,21 @@ class PKToolsSettingsDialog(QDialog):
         else:
             self.txt_preview.setPlainText("\n".join(lines))
 
+    def _open_calibration_audit(self):
+        """
+        Abre el algoritmo "Control de calibración" con la capa, el campo y las
+        unidades elegidos en el diálogo.
+        """
+        idx = self.cbo_layer.currentIndex()
+        if idx < 0 or idx >= len(self._layers):
+            return
+        import processing  # Solo disponible dentro de QGIS
+        processing.execAlgorithmDialog("pktools:calibracionpk", {
+            "NETWORK": self._layers[idx],
+            "NETWORK_ID_FIELD": self.selected_id_field(),
+            "M_UNITS": ["m", "km"].index(self.selected_m_units()),
+        })
+
     # ---------------------------
     # Acceso sencillo a valores
     # ---------------------------
@@ -260,13 +417,18 @@ class PKToolsSettingsDialog(QDialog):
     # ---------------------------
     def accept(self):
         """
-        Al aceptar, guardamos la configuración.
+        Al aceptar, guardamos la configuración: la primera capa de la lista
+        es la principal y el resto, las adicionales.
         """
-        layer_name = self.selected_layer_name()
-        id_field   = self.selected_id_field() or "ID_ROAD"
-        m_units    = self.selected_m_units()
-
-        self.settings_mgr.save(layer_name, id_field, m_units)
+        entries = []
+        for entry in self._entries:
+            if entry["layer_name"] and entry not in entries:
+                entries.append(entry)
+        primary = entries[0] if entries else layer_config("", None, None)
+
+        self.settings_mgr.save(
+            primary["layer_name"], primary["id_field"], primary["m_units"], entries[1:]
+        )
         super().accept()
 
 
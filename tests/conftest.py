@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Las pruebas cubren el núcleo sin QGIS (core/): se importan sus módulos como
+paquete ``core`` desde la raíz del plugin. Las partes puras de tools/ se
+importan con el fixture ``headless``, que sustituye los módulos de qgis por
+módulos vacíos.
+"""
+
+import importlib
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.linref import LinearReference  # noqa: E402
+
+HEADLESS_PACKAGE = "pk_tools_headless"
+QGIS_MODULES = ("qgis", "qgis.core", "qgis.gui", "qgis.PyQt", "qgis.PyQt.QtCore",
+                "qgis.PyQt.QtGui", "qgis.PyQt.QtWidgets")
+
+
+class _QgisStub(types.ModuleType):
+    """Módulo cuyos nombres son clases vacías (from qgis.core import X)."""
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return type(name, (), {})
+
+
+@pytest.fixture
+def headless(monkeypatch):
+    """
+    Importa módulos del plugin sin QGIS: ``headless("tools.index_cache")``.
+    El plugin se carga como paquete ``pk_tools_headless`` para que funcionen
+    los imports relativos; todo se deshace al acabar la prueba.
+    """
+    for name in QGIS_MODULES:
+        monkeypatch.setitem(sys.modules, name, _QgisStub(name))
+    package = types.ModuleType(HEADLESS_PACKAGE)
+    package.__path__ = [ROOT]
+    monkeypatch.setitem(sys.modules, HEADLESS_PACKAGE, package)
+    for name in list(sys.modules):
+        if name.startswith(HEADLESS_PACKAGE + "."):
+            monkeypatch.delitem(sys.modules, name)
+    return lambda module: importlib.import_module(HEADLESS_PACKAGE + "." + module)
+
+
+@pytest.fixture(scope="session")
+def mixed_network():
+    """
+    Red con un segmento diagonal de 100 km y muchos segmentos de 1 m: con una
+    rejilla dimensionada por la longitud típica, el segmento largo ocupaba
+    millones de celdas. Al sur (y < 0) lleva además vías con la M invertida
+    (INV), multiparte con un hueco de M entre partes y continuación en otra
+    feature (MULTI) y calibración no monótona (NOMONO).
+    """
+    rng = np.random.default_rng(0)
+    features = [(0, "LARGA", [([0.0, 100000.0], [0.0, 100000.0], [0.0, 141421.0])])]
+    x0 = rng.uniform(0.0, 100000.0, 20000)
+    y0 = rng.uniform(0.0, 100000.0, 20000)
+    for i in range(20000):
+        features.append((i + 1, f"V{i % 50}", [([x0[i], x0[i] + 1.0], [y0[i], y0[i]], [0.0, 1.0])]))
+    features += [
+        (30001, "INV", [([0.0, 1000.0, 2000.0], [-10.0, -10.0, -10.0], [2000.0, 1000.0, 0.0])]),
+        (30002, "MULTI", [([0.0, 250.0, 500.0], [-20.0, -20.0, -20.0], [0.0, 250.0, 500.0]),
+                          ([600.0, 1050.0], [-20.0, -20.0], [550.0, 1000.0])]),
+        (30003, "MULTI", [([1050.0, 1300.0, 1550.0], [-20.0, -25.0, -20.0], [1000.0, 1250.0, 1500.0])]),
+        (30004, "NOMONO", [([0.0, 100.0, 200.0, 300.0], [-30.0, -30.0, -30.0, -30.0],
+                            [0.0, 100.0, 50.0, 150.0])]),
+    ]
+    return LinearReference.from_parts(features)
+
+
+@pytest.fixture(scope="session")
+def calibration_defects():
+    """
+    Red calibrada en metros (M = longitud) salvo un defecto de cada tipo:
+    retroceso de M en la feature 10 (vía RETRO), hueco de 50 m entre las
+    features 20 y 21 (HUECO), solape de 20 m entre 30 y 31 (SOLAPE) y
+    cociente M / longitud doble en la 40 (COCIENTE).
+    """
+    def line(x0, x1, m0, m1, y):
+        return [([x0, x1], [y, y], [m0, m1])]
+
+    features = [(i, "BUENA", line(100.0 * i, 100.0 * (i + 1), 100.0 * i, 100.0 * (i + 1), 0.0))
+                for i in range(6)]
+    features += [
+        (10, "RETRO", [([0.0, 100.0, 200.0, 300.0], [10.0] * 4, [0.0, 100.0, 90.0, 300.0])]),
+        (20, "HUECO", line(0.0, 100.0, 0.0, 100.0, 20.0)),
+        (21, "HUECO", line(100.0, 200.0, 150.0, 250.0, 20.0)),
+        (30, "SOLAPE", line(0.0, 100.0, 0.0, 100.0, 30.0)),
+        (31, "SOLAPE", line(100.0, 200.0, 80.0, 180.0, 30.0)),
+        (40, "COCIENTE", line(0.0, 100.0, 0.0, 200.0, 40.0)),
+    ]
+    return LinearReference.from_parts(features)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Pruebas del control de calidad de la calibración (core/calibration.py)."""
+
+import numpy as np
+
+from core.calibration import (
+    FINDING_GAP,
+    FINDING_NON_MONOTONIC,
+    FINDING_OVERLAP,
+    FINDING_RATIO,
+    audit_calibration,
+)
+
+
+def test_audit_reports_each_defect(calibration_defects):
+    lr = calibration_defects
+    found = audit_calibration(lr)
+    fids = lr.fids[found.fi]
+    report = sorted(zip(found.kind.tolist(), fids.tolist()))
+    assert report == [
+        (FINDING_NON_MONOTONIC, 10),
+        (FINDING_GAP, 21),
+        (FINDING_OVERLAP, 31),
+        (FINDING_RATIO, 40),
+    ]
+
+    by_kind = {int(k): i for i, k in enumerate(found.kind)}
+    # Retroceso de 10 m en el tercer vértice de la feature 10
+    i = by_kind[FINDING_NON_MONOTONIC]
+    assert found.m[i] == 90.0 and np.isclose(found.value[i], 0.010)
+    # Hueco y solape en el primer vértice de la feature siguiente, en km
+    i = by_kind[FINDING_GAP]
+    assert found.m[i] == 150.0 and np.isclose(found.value[i], 0.050)
+    i = by_kind[FINDING_OVERLAP]
+    assert found.m[i] == 80.0 and np.isclose(found.value[i], 0.020)
+    # Cociente doble que el de la red
+    i = by_kind[FINDING_RATIO]
+    assert np.isclose(found.value[i], 2.0)
+
+
+def test_audit_tolerances(calibration_defects):
+    # Tolerancias por encima de los defectos: solo queda el retroceso
+    found = audit_calibration(calibration_defects, gap_tolerance_km=0.1, ratio_tolerance=1.5)
+    assert found.kind.tolist() == [FINDING_NON_MONOTONIC]
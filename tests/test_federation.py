@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de la referenciación sobre varias redes (core/federation.py)."""
+
+import numpy as np
+
+from core.federation import FederatedReference
+from core.linref import LinearReference
+
+
+def _network(fid0, road, y0, n=20):
+    return LinearReference.from_parts([
+        (fid0 + i, f"{road}{i % 3}",
+         [([i * 100.0, i * 100.0 + 90.0], [y0, y0 + 5.0], [0.0, 1000.0])])
+        for i in range(n)
+    ])
+
+
+def test_nearest_translates_to_member_terms():
+    a, b = _network(0, "A", 0.0), _network(100, "B", 50.0)
+    fed = FederatedReference([a, b])
+    rng = np.random.default_rng(3)
+    for px, py in np.column_stack((rng.uniform(0, 2000, 200), rng.uniform(-20, 70, 200))):
+        k, match = fed.nearest(px, py)
+        best = min((a.nearest(px, py), b.nearest(px, py)), key=lambda m: m.dist)
+        assert (k == 0) == (match.fid < 100)
+        assert match.fid == best.fid
+        assert np.isclose(match.pk, best.pk) and np.isclose(match.dist, best.dist)
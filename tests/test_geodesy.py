@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Pruebas de las longitudes elipsoidales (core/geodesy.py)."""
+
+import numpy as np
+
+from core.geodesy import WGS84_A, WGS84_F, geodesic_lengths
+from core.linref import LinearReference
+
+
+def _dms(d, m, s):
+    return d + m / 60.0 + s / 3600.0
+
+
+def test_known_vincenty_distances():
+    pairs = [
+        # (lon1, lat1, lon2, lat2, metros)
+        (0.0, 0.0, 1.0, 0.0, 111319.491),        # 1° de ecuador
+        (0.0, 0.0, 0.0, 1.0, 110574.389),        # 1° de meridiano desde el ecuador
+        (0.0, 0.0, 90.0, 0.0, 10018754.171),     # cuarto de ecuador: a · π / 2
+        (0.0, 0.0, 0.0, 90.0, 10001965.729),     # cuarto de meridiano
+        # Flinders Peak → Buninyong (ejemplo de Vincenty, 1975)
+        (_dms(144, 25, 29.52440), -_dms(37, 57, 3.72030),
+         _dms(143, 55, 35.38390), -_dms(37, 39, 10.15610), 54972.271),
+    ]
+    lon1, lat1, lon2, lat2, expected = map(np.array, zip(*pairs))
+    dist = geodesic_lengths(lon1, lat1, lon2, lat2)
+    assert np.allclose(dist, expected, rtol=0, atol=1e-3)
+    # Simétrica
+    assert np.allclose(geodesic_lengths(lon2, lat2, lon1, lat1), expected, rtol=0, atol=1e-3)
+
+
+def test_degenerate_and_antipodal():
+    dist = geodesic_lengths([0.0, 3.0, 0.0, 0.0], [0.0, 40.0, 0.0, np.nan],
+                            [0.0, 3.0, 180.0, 1.0], [0.0, 40.0, 0.0, 1.0])
+    assert dist[0] == 0.0 and dist[1] == 0.0
+    # Antípodas en el ecuador: Vincenty no converge y se resuelve sobre la
+    # esfera; el resultado queda cerca de medio meridiano (20003931.459 m)
+    assert np.isfinite(dist[2]) and abs(dist[2] / 20003931.459 - 1.0) < 1e-3
+    assert np.isnan(dist[3])
+
+
+def test_metric_cum_with_geodesic_lengths():
+    # Vía en coordenadas geográficas a lo largo del ecuador y de un meridiano
+    lon = [0.0, 1.0, 1.0]
+    lat = [0.0, 0.0, 1.0]
+    lr = LinearReference.from_parts([(7, "G", [(lon, lat, [0.0, 1.0, 2.0])])], m_units="km")
+    lr.prepare_geodesic(np.array(lon), np.array(lat), WGS84_A, WGS84_F)
+    first = 111319.491
+    second = geodesic_lengths(1.0, 0.0, 1.0, 1.0)
+    assert np.allclose(lr.metric_cum, [0.0, first, first + second], rtol=0, atol=1e-3)
+    # Mitad del primer segmento: interpolación lineal del acumulado
+    assert np.isclose(lr.metric_along(7, 0.5), first / 2.0, rtol=0, atol=1e-3)
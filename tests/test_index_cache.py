@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la caché en disco (tools/index_cache.py) sin QGIS: los módulos
+de qgis se sustituyen por módulos vacíos solo para poder importarla.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def index_cache(headless):
+    return headless("tools.index_cache")
+
+
+def _definition(selected=False, limit=-1, expression=""):
+    # Mismos atributos que QgsProcessingFeatureSourceDefinition
+    return SimpleNamespace(selectedFeaturesOnly=selected, featureLimit=limit,
+                           filterExpression=expression)
+
+
+def test_whole_layer_uses_cache(index_cache):
+    assert not index_cache.is_subset_source(None)
+    assert not index_cache.is_subset_source("/datos/red.gpkg|layername=red")
+    assert not index_cache.is_subset_source(_definition())
+
+
+@pytest.mark.parametrize("definition", [
+    _definition(selected=True),
+    _definition(limit=100),
+    _definition(limit=0),
+    _definition(expression="\"VIA\" = 'M-30'"),
+])
+def test_subset_skips_cache(index_cache, definition):
+    assert index_cache.is_subset_source(definition)
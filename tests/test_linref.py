@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Pruebas del motor de arrays (core/linref.py)."""
+
+import numpy as np
+
+from core.linref import LinearReference
+
+
+def test_nearest_many_mixed_segment_lengths(mixed_network):
+    lr = mixed_network
+    rng = np.random.default_rng(1)
+    # Puntos junto a segmentos cortos y sobre la diagonal
+    fi = rng.integers(1, lr.feature_count, 2000)
+    px = lr.x[lr.feat_offsets[fi]] + rng.uniform(-2.0, 3.0, len(fi))
+    py = lr.y[lr.feat_offsets[fi]] + rng.uniform(-2.0, 2.0, len(fi))
+    d = rng.uniform(0.0, 100000.0, 500)
+    px = np.r_[px, d + 1.0]
+    py = np.r_[py, d]
+
+    res = lr.nearest_many(px, py, 5.0)
+    for i in range(len(px)):
+        match = lr.nearest(px[i], py[i])
+        if match.dist <= 5.0:
+            assert res.fi[i] != -1
+            assert np.isclose(res.dist[i], match.dist)
+            assert np.isclose(res.pk[i], match.pk)
+        else:
+            assert res.fi[i] == -1
+
+
+def test_arrays_round_trip_keeps_segment_tree(mixed_network):
+    arrays, roads, road_keys = mixed_network.to_arrays()
+    lr = type(mixed_network).from_arrays(arrays, roads, road_keys)
+    # El árbol se reabre tal cual, sin reconstruirlo
+    assert lr._tree is not None
+    assert np.array_equal(lr._tree.items, mixed_network.segment_tree().items)
+    rng = np.random.default_rng(2)
+    for px, py in rng.uniform(0.0, 100000.0, (50, 2)):
+        a, b = mixed_network.nearest(px, py), lr.nearest(px, py)
+        assert a.fid == b.fid and np.isclose(a.dist, b.dist)
+
+
+def test_replace_features_matches_rebuild():
+    def parts(i):
+        if i % 2:
+            return [([0.0, 1.0, 2.0], [i, i, i], [0.0, 10.0, 20.0]),
+                    ([5.0, 6.0], [i, i + 1.0], [30.0, 40.0])]
+        return [([0.0, 3.0], [i, i], [0.0, 30.0])]
+
+    features = [(i, f"V{i % 3}", parts(i)) for i in range(10)]
+    lr = LinearReference.from_parts(features)
+    # Cambio de geometría y de vía (3), baja (4) y alta (100)
+    edited = [(3, "V9", [([0.0, 9.0], [3.0, 3.0], [0.0, 90.0])]),
+              (100, "N", [([0.0, 1.0], [0.0, 0.0], [0.0, 1.0])])]
+    patched = lr.replace_features([3, 4, 100], edited)
+    rebuilt = LinearReference.from_parts([f for f in features if f[0] not in (3, 4)] + edited)
+
+    for name in ("x", "y", "m", "feat_offsets", "part_offsets", "fids", "cum", "seg_valid"):
+        assert np.array_equal(getattr(patched, name), getattr(rebuilt, name)), name
+    assert patched.roads == rebuilt.roads
+    assert patched.locate("V9", 0.05).fid == 3
+    assert patched.nearest(0.5, 0.0).fid == 100
+
+
+def _clip_brute_force(lr, road, pk_from, pk_to):
+    """Trozos (x0, y0, x1, y1) y longitud del evento, segmento a segmento."""
+    lo, hi = sorted((pk_from * lr.factor, pk_to * lr.factor))
+    pieces, length = [], 0.0
+    for fi in range(lr.feature_count):
+        if lr.roads[fi] != road:
+            continue
+        for s in range(lr.feat_offsets[fi], lr.feat_offsets[fi + 1] - 1):
+            if not lr.seg_valid[s]:
+                continue
+            m0, m1 = lr.m[s], lr.m[s + 1]
+            if abs(m1 - m0) < 1e-6:
+                if not lo - 1e-6 <= m0 <= hi + 1e-6:
+                    continue
+                t0, t1 = 0.0, 1.0
+            else:
+                ta, tb = sorted(((lo - m0) / (m1 - m0), (hi - m0) / (m1 - m0)))
+                t0, t1 = min(max(ta, 0.0), 1.0), min(max(tb, 0.0), 1.0)
+                if t1 - t0 <= 0:
+                    continue
+            dx, dy = lr.x[s + 1] - lr.x[s], lr.y[s + 1] - lr.y[s]
+            pieces.append((lr.x[s] + t0 * dx, lr.y[s] + t0 * dy,
+                           lr.x[s] + t1 * dx, lr.y[s] + t1 * dy))
+            length += (t1 - t0) * np.hypot(dx, dy)
+    return pieces, length
+
+
+def test_cut_many_matches_brute_force(mixed_network):
+    from core.linref import STATUS_FOUND, STATUS_OUT_OF_RANGE, STATUS_UNKNOWN_ROAD
+
+    lr = mixed_network
+    events = [
+        ("LARGA", 10.0, 50.0), ("LARGA", 50.0, 10.0),    # PK en cualquier orden
+        ("INV", 0.3, 1.7), ("INV", 1.9, 2.5),            # M invertida
+        ("MULTI", 0.4, 0.7),                             # entre partes
+        ("MULTI", 0.9, 1.2),                             # entre features
+        ("MULTI", 0.0, 1.5),                             # vía entera
+        ("NOMONO", 0.06, 0.12),                          # M no monótona
+        ("V3", 0.0002, 0.0007),                          # muchas features cortas
+    ]
+    roads, pk_from, pk_to = zip(*events)
+    got, status = lr.cut_many(list(roads), np.array(pk_from), np.array(pk_to))
+    for event, (road, a, b), st in zip(got, events, status):
+        pieces, length = _clip_brute_force(lr, road, a, b)
+        assert st == STATUS_FOUND and event is not None
+        assert np.isclose(event.length, length)
+        cut = [(px[j], py[j], px[j + 1], py[j + 1])
+               for px, py, _ in event.parts for j in range(len(px) - 1)]
+        assert np.allclose(cut, pieces)
+        # Extremos de cada parte con la M del evento dentro de la ventana
+        lo, hi = sorted((a * lr.factor, b * lr.factor))
+        for _, _, pm in event.parts:
+            assert lo - 1e-6 <= pm.min() and pm.max() <= hi + 1e-6
+
+    # Hueco de M entre partes, fuera de rango, vía desconocida y PK no válido
+    got, status = lr.cut_many(["MULTI", "LARGA", "NADA", "LARGA"],
+                              np.array([0.51, 200.0, 0.0, np.nan]),
+                              np.array([0.54, 300.0, 1.0, 5.0]))
+    assert got == [None] * 4
+    assert status.tolist() == [STATUS_OUT_OF_RANGE, STATUS_OUT_OF_RANGE,
+                               STATUS_UNKNOWN_ROAD, STATUS_OUT_OF_RANGE]
+    assert not _clip_brute_force(lr, "MULTI", 0.51, 0.54)[0]
+
+
+def test_route_distance_chains_features():
+    nan = float("nan")
+    lr = LinearReference.from_parts([
+        (1, "R", [([0.0, 100.0], [0.0, 0.0], [0.0, 100.0])]),
+        (2, "R", [([200.0, 150.0, 100.0], [0.0, 0.0, 0.0], [200.0, 150.0, 100.0])]),  # invertida
+        (3, "R", [([200.0, 300.0], [0.0, 0.0], [200.0, 300.0])]),
+        (4, "R", [([400.0, 500.0], [0.0, 0.0], [nan, nan])]),       # sin M: fuera de la cadena
+        (5, "S", [([0.0, 100.0], [50.0, 50.0], [0.0, 100.0])]),
+    ])
+    a, b, c = lr.nearest(50.0, 1.0), lr.nearest(170.0, 1.0), lr.nearest(250.0, 1.0)
+    assert (a.fid, b.fid, c.fid) == (1, 2, 3)
+    # A través de la feature invertida y en cualquier orden
+    assert np.isclose(lr.route_distance(a, c), 200.0)
+    assert np.isclose(lr.route_distance(c, a), 200.0)
+    assert np.isclose(lr.route_distance(a, b), 120.0)
+    assert np.isclose(lr.route_distance(b, c), 80.0)
+    # Misma feature
+    assert np.isclose(lr.route_distance(a, lr.nearest(10.0, 1.0)), 40.0)
+    # Desde PK localizados, igual que desde puntos proyectados
+    assert np.isclose(lr.route_distance(lr.locate("R", 0.05), lr.locate("R", 0.25)), 200.0)
+
+    # En metros, con un factor plano de la capa a metros
+    lr.prepare_planar_metres(2.0)
+    assert np.isclose(lr.route_distance(a, c, metric=True), 400.0)
+    assert np.isclose(lr.route_distance(b, c, metric=True), 160.0)
+
+    # Vías distintas o feature sin M en la cadena: no hay distancia
+    assert lr.route_distance(a, lr.nearest(50.0, 49.0)) is None
+    assert lr.route_distance(a, lr.nearest(450.0, 1.0)) is None
+
+
+def test_locate_many_matches_locate(mixed_network):
+    from core.linref import STATUS_FOUND, STATUS_OUT_OF_RANGE, STATUS_UNKNOWN_ROAD
+
+    lr = mixed_network
+    rng = np.random.default_rng(3)
+    roads = ["LARGA"] * 200 + ["INV", "INV", "MULTI", "MULTI", "MULTI", "NOMONO", "V7",
+                               "LARGA", "LARGA", "NADA", None, "LARGA", "MULTI"]
+    pks = np.r_[rng.uniform(0.0, 141.421, 200),
+                0.0, 1.234, 0.3, 0.53, 1.2, 0.075, 0.0005,
+                141.421, 150.0, 1.0, 1.0, np.nan, np.nan]
+    res = lr.locate_many(roads, pks)
+    for i, (road, pk) in enumerate(zip(roads, pks)):
+        loc = None if np.isnan(pk) else lr.locate(road, pk)
+        if loc is None:
+            assert res.status[i] != STATUS_FOUND
+            assert np.isnan(res.x[i]) and np.isnan(res.y[i])
+        else:
+            assert res.status[i] == STATUS_FOUND
+            assert np.isclose(res.x[i], loc.x) and np.isclose(res.y[i], loc.y)
+    # Fuera de rango, vía desconocida o nula y PK NaN (con vía conocida o no)
+    assert res.status[-5:].tolist() == [STATUS_OUT_OF_RANGE, STATUS_UNKNOWN_ROAD,
+                                        STATUS_UNKNOWN_ROAD, STATUS_OUT_OF_RANGE,
+                                        STATUS_OUT_OF_RANGE]
+    # Hueco de M entre las partes de MULTI (500 → 550)
+    assert res.status[203] == STATUS_OUT_OF_RANGE
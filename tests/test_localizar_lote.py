@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la lectura de PK de tools/localizar_lote.py sin QGIS (ver el
+fixture ``headless``).
+"""
+
+import pytest
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("12+300", 12.3),
+    (" 12 + 300 ", 12.3),
+    ("0+050", 0.05),
+    ("-1+200", -1.2),
+    ("12+300,5", 12.3005),
+    ("12,5", 12.5),
+    ("12.5", 12.5),
+    (12, 12.0),
+    (12.5, 12.5),
+    (None, None),
+    ("", None),
+    ("12+", None),
+    ("km 12", None),
+])
+def test_parse_pk(headless, value, expected):
+    parse_pk = headless("tools.localizar_lote").parse_pk
+    result = parse_pk(value)
+    if expected is None:
+        assert result is None
+    else:
+        assert result == pytest.approx(expected)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Pruebas del R-tree de segmentos (core/segtree.py) contra fuerza bruta."""
+
+import numpy as np
+import pytest
+
+from core.linref import LinearReference, nearest_on_segments
+from core.segtree import SegmentTree
+
+
+def _brute_force(x, y, seg, px, py):
+    """Distancia de (px, py) a cada segmento de ``seg``."""
+    ax, ay = x[seg], y[seg]
+    dx, dy = x[seg + 1] - ax, y[seg + 1] - ay
+    l2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.clip(np.where(l2 > 0, ((px - ax) * dx + (py - ay) * dy) / l2, 0.0), 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def _random_network(rng, n_feat=300):
+    """Polilíneas aleatorias con segmentos de longitudes muy distintas."""
+    features = []
+    for fid in range(n_feat):
+        n = int(rng.integers(2, 8))
+        scale = 10.0 ** rng.uniform(-1, 3)
+        xs = rng.uniform(0, 5000) + np.cumsum(rng.normal(0, scale, n))
+        ys = rng.uniform(0, 5000) + np.cumsum(rng.normal(0, scale, n))
+        features.append((fid, "R%d" % (fid % 7), [(xs, ys, np.arange(n, dtype=float))]))
+    return LinearReference.from_parts(features, m_units="m")
+
+
+@pytest.mark.parametrize("fanout", [2, 4, SegmentTree.FANOUT])
+def test_candidates_keep_nearest_segment(fanout):
+    rng = np.random.default_rng(fanout)
+    lr = _random_network(rng)
+    seg = np.nonzero(lr.seg_valid)[0]
+    tree = SegmentTree(lr.x, lr.y, seg, fanout=fanout)
+    for px, py in rng.uniform(-500.0, 5500.0, (400, 2)):
+        dist = _brute_force(lr.x, lr.y, seg, px, py)
+        cand = tree.candidates(px, py)
+        # La poda nunca descarta un segmento a la distancia mínima
+        assert set(seg[np.isclose(dist, dist.min())]) <= set(cand.tolist())
+        hit = nearest_on_segments(lr.x, lr.y, px, py, cand)
+        assert np.isclose(hit[4], dist.min())
+
+        # Con max_dist: todos los segmentos dentro del radio que pueden ser el más cercano
+        max_dist = float(rng.uniform(1.0, 200.0))
+        cand = tree.candidates(px, py, max_dist)
+        if dist.min() <= max_dist:
+            assert np.isclose(nearest_on_segments(lr.x, lr.y, px, py, cand)[4], dist.min())
+        match = lr.nearest_within(px, py, max_dist)
+        if dist.min() > max_dist:
+            assert match is None
+        else:
+            assert np.isclose(match.dist, dist.min())
+
+
+def test_pairs_within_matches_brute_force():
+    rng = np.random.default_rng(7)
+    lr = _random_network(rng)
+    seg = np.nonzero(lr.seg_valid)[0]
+    tree = SegmentTree(lr.x, lr.y, seg, fanout=4)
+    px, py = rng.uniform(-500.0, 5500.0, (2, 300))
+    max_dist = 50.0
+    owner, s = tree.pairs_within(px, py, max_dist)
+    res = lr.nearest_many(px, py, max_dist)
+    for i in range(len(px)):
+        dist = _brute_force(lr.x, lr.y, seg, px[i], py[i])
+        # Todo segmento dentro del radio está entre los pares del punto
+        assert set(seg[dist <= max_dist]) <= set(s[owner == i].tolist())
+        if dist.min() > max_dist:
+            assert res.fi[i] == -1
+        else:
+            assert np.isclose(res.dist[i], dist.min())
+
+
+def test_equidistant_and_far_points():
+    # Dos segmentos paralelos separados 10 m y otro muy largo lejos
+    lr = LinearReference.from_parts([
+        (1, "A", [([0.0, 100.0], [0.0, 0.0], [0.0, 100.0])]),
+        (2, "B", [([0.0, 100.0], [10.0, 10.0], [0.0, 100.0])]),
+        (3, "C", [([0.0, 100000.0], [1000.0, 1000.0], [0.0, 100000.0])]),
+    ], m_units="m")
+    tree = SegmentTree(lr.x, lr.y, np.nonzero(lr.seg_valid)[0], fanout=2)
+
+    # Punto a la misma distancia (5 m) de A y B: ambos sobreviven a la poda
+    cand = set(tree.candidates(50.0, 5.0).tolist())
+    assert {lr.feat_offsets[0], lr.feat_offsets[1]} <= cand
+    match = lr.nearest(50.0, 5.0)
+    assert match.fid in (1, 2) and np.isclose(match.dist, 5.0)
+    res = lr.nearest_many([50.0, -3.0], [5.0, 5.0], 6.0)
+    assert np.allclose(res.dist, [5.0, np.hypot(3.0, 5.0)])
+
+    # Equidistante también de un extremo (esquina) y de un segmento
+    assert np.isclose(lr.nearest(-5.0, 5.0).dist, np.hypot(5.0, 5.0))
+
+    # Más allá de max_dist: nada, ni por punto ni por lotes
+    assert lr.nearest_within(50.0, 500.0, 100.0) is None
+    assert np.isclose(lr.nearest_within(50.0, 500.0, 500.0).dist, 490.0)
+    res = lr.nearest_many([50.0, 50.0], [500.0, 5.0], 100.0)
+    assert res.fi[0] == -1 and np.isclose(res.dist[1], 5.0)
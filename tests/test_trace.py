@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Pruebas del ajuste de trazas (core/trace.py)."""
+
+import numpy as np
+
+from core.trace import TraceMatcher
+
+
+def test_candidate_pairs_match_brute_force(mixed_network):
+    lr = mixed_network
+    rng = np.random.default_rng(2)
+    fi = rng.integers(1, lr.feature_count, 300)
+    px = np.r_[lr.x[lr.feat_offsets[fi]] + rng.uniform(-3.0, 3.0, len(fi)), [5000.0, 70000.0]]
+    py = np.r_[lr.y[lr.feat_offsets[fi]] + rng.uniform(-3.0, 3.0, len(fi)), [5003.0, 69999.0]]
+
+    owner, s, t, d2 = lr._candidate_pairs(px, py, 5.0)
+    assert np.all(np.diff(owner) >= 0)
+
+    seg = np.nonzero(lr.seg_valid)[0]
+    ax, ay = lr.x[seg], lr.y[seg]
+    dx, dy = lr.x[seg + 1] - ax, lr.y[seg + 1] - ay
+    for i in range(len(px)):
+        tt = np.clip(((px[i] - ax) * dx + (py[i] - ay) * dy) / (dx * dx + dy * dy), 0.0, 1.0)
+        dd = (px[i] - ax - tt * dx) ** 2 + (py[i] - ay - tt * dy) ** 2
+        assert set(seg[dd <= 25.0].tolist()) == set(s[owner == i].tolist())
+
+
+def test_trace_follows_long_segment(mixed_network):
+    lr = mixed_network
+    d = np.linspace(1000.0, 90000.0, 2000)
+    res = TraceMatcher(lr, 5.0).match(d + 2.0, d - 1.0)
+    assert np.all(res.fid == 0)
+    assert np.all(np.diff(res.pk) > 0)
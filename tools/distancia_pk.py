@@ -5,20 +5,13 @@ from qgis.PyQt.QtCore import Qt
 from qgis.gui import QgsMapTool, QgsVertexMarker
 from qgis.core import (
     QgsPointXY,
-    QgsGeometry,
-    QgsCoordinateTransform,
-    QgsProject,
-    QgsCoordinateReferenceSystem,
-    QgsWkbTypes,
-    QgsVectorLayer,
-    QgsSpatialIndex,
     Qgis
 )
 
-from ..settings import read_current_settings
-
-# Campo por defecto histórico (fallback si no hay settings)
-EXPECTED_FIELD = "ID_ROAD"
+from .federation import NetworkConfigError, configured_network
+from .indexing import IndexingStatus
+from .profiling import profiler
+from .transforms import transforms
 
 
 def formato_pk(pk_total):
@@ -38,6 +31,7 @@ class DistanciaPK:
         self.tool = None
         # Para controlar solo nuestro mensaje
         self.current_msg = None
+        self.indexing = IndexingStatus(iface, "Distancia PK")
 
     def initGui(self):
         import os
@@ -79,69 +73,24 @@ class DistanciaPK:
         Activa la herramienta usando la capa/campo/unidades definidos en settings.
         """
         try:
-            cfg = read_current_settings()
-            layer_name = cfg.get("layer_name") or ""
-            id_field = cfg.get("id_field") or EXPECTED_FIELD
-            m_units = cfg.get("m_units") or "m"
-
-            if not layer_name:
-                self.iface.messageBar().pushMessage(
-                    "Distancia PK",
-                    "No hay capa de trabajo configurada. Abre 'Configuración PK Tools' para definirla.",
-                    level=Qgis.Info
-                )
-                return False
-
-            # Buscar la capa por nombre
-            layer = None
-            for lyr in QgsProject.instance().mapLayers().values():
-                if isinstance(lyr, QgsVectorLayer) and lyr.name() == layer_name:
-                    layer = lyr
-                    break
-
-            if not layer:
-                self.iface.messageBar().pushMessage(
-                    "Distancia PK",
-                    f"No se ha encontrado la capa '{layer_name}'. Revisa la configuración de PK Tools.",
-                    level=Qgis.Warning
-                )
-                return False
-
-            # Validar tipo de geometría
-            if layer.geometryType() != QgsWkbTypes.LineGeometry:
-                self.iface.messageBar().pushMessage(
-                    "Distancia PK",
-                    f"La capa '{layer_name}' no es lineal.",
-                    level=Qgis.Warning
-                )
-                return False
-
-            # Validar presencia de M
-            if not QgsWkbTypes.hasM(layer.wkbType()):
-                self.iface.messageBar().pushMessage(
-                    "Distancia PK",
-                    f"La capa '{layer_name}' no tiene geometría M.",
-                    level=Qgis.Warning
-                )
-                return False
-
-            # Comprobar que existe el campo identificador
-            if layer.fields().indexOf(id_field) == -1:
-                self.iface.messageBar().pushMessage(
-                    "Distancia PK",
-                    f"La capa '{layer_name}' no tiene el campo '{id_field}'.",
-                    level=Qgis.Warning
-                )
+            # Capa principal y, si las hay, capas adicionales de la configuración;
+            # su preparación incluye las longitudes en metros (distancia lineal)
+            try:
+                network = configured_network(metric=True)
+            except NetworkConfigError as e:
+                self.iface.messageBar().pushMessage("Distancia PK", str(e), level=e.level)
                 return False
 
             # Crear herramienta si no existe
             if not self.tool:
                 self.tool = DistanciaTool(self.iface, self.canvas, self.show_distance_message)
 
-            self.tool.layer = layer
-            self.tool.index = QgsSpatialIndex(layer.getFeatures())
-            self.tool.id_field = id_field
-            self.tool.m_units = m_units
+            self.tool.network = network
+
+            # Motores de cada capa e índice común: se preparan en segundo plano
+            # (la herramienta se activa ya y muestra "Indexando…" hasta que estén)
+            self.tool.indexing = self.indexing
+            self.indexing.ensure_network_ready(network)
             self.tool.reset()
 
             self.canvas.setMapTool(self.tool)
@@ -161,21 +110,26 @@ class DistanciaPK:
 
         pk1_str = formato_pk(pk1)
         pk2_str = formato_pk(pk2)
+        # Sin ruta entre los puntos (dist_lineal_km None) no hay distancia lineal
+        lineal_str = (
+            "sin ruta entre los puntos" if dist_lineal_km is None
+            else f"{dist_lineal_km:.3f} km"
+        )
         texto = (
             f"{nombre_via} | PK1: {pk1_str} · PK2: {pk2_str} | "
-            f"Dist. PK: {dist_pk_km:.3f} km · Dist. Lineal: {dist_lineal_km:.3f} km"
+            f"Dist. PK: {dist_pk_km:.3f} km · Dist. Lineal: {lineal_str}"
         )
 
         msg = self.iface.messageBar().createMessage("Distancia PK", texto)
 
         btn_pk = QPushButton("Copiar distancia PK")
         btn_pk.clicked.connect(lambda: QApplication.clipboard().setText(f"{dist_pk_km:.3f} km"))
-
-        btn_lin = QPushButton("Copiar distancia lineal")
-        btn_lin.clicked.connect(lambda: QApplication.clipboard().setText(f"{dist_lineal_km:.3f} km"))
-
         msg.layout().addWidget(btn_pk)
-        msg.layout().addWidget(btn_lin)
+
+        if dist_lineal_km is not None:
+            btn_lin = QPushButton("Copiar distancia lineal")
+            btn_lin.clicked.connect(lambda: QApplication.clipboard().setText(f"{dist_lineal_km:.3f} km"))
+            msg.layout().addWidget(btn_lin)
 
         # Guardamos el handler para poder cerrar solo este mensaje
         self.current_msg = self.iface.messageBar().pushWidget(msg, Qgis.Info)
@@ -205,6 +159,7 @@ class DistanciaPK:
             if self.canvas.mapTool() == self.tool:
                 self.canvas.unsetMapTool(self.tool)
         self._close_messagebar()
+        self.indexing.clear()
 
 
 class DistanciaTool(QgsMapTool):
@@ -213,10 +168,8 @@ class DistanciaTool(QgsMapTool):
         self.iface = iface
         self.canvas = canvas
         self.callback = callback
-        self.layer = None
-        self.index = None
-        self.id_field = EXPECTED_FIELD   # se sobreescribe desde settings
-        self.m_units = "m"               # "m" (por defecto) o "km"
+        self.network = None              # FederatedNetwork de la configuración
+        self.indexing = None             # IndexingStatus del controlador
         self.reset()
 
     def reset(self):
@@ -229,7 +182,8 @@ class DistanciaTool(QgsMapTool):
         self.markers = []
         self.pk_values = []
         self.line_distances = []
-        self.first_feat = None
+        self.first_match = None
+        self.first_member = None   # capa (índice en la red) del primer punto
         self.click_count = 0
 
     def canvasReleaseEvent(self, event):
@@ -245,7 +199,7 @@ class DistanciaTool(QgsMapTool):
 
     def _process_click(self, click_pt_map):
         try:
-            if not self.layer or not self.index:
+            if not self.network:
                 self.iface.messageBar().pushMessage(
                     "Distancia PK",
                     "No hay capa válida asignada.",
@@ -253,29 +207,27 @@ class DistanciaTool(QgsMapTool):
                 )
                 return
 
-            map_crs = self.canvas.mapSettings().destinationCrs()
-            layer_crs = self.layer.crs()
+            # Mientras se indexa la red, el clic solo recuerda el estado "Indexando…"
+            if self.indexing is not None and not self.indexing.ensure_network_ready(self.network):
+                return
 
-            layer_pt = click_pt_map
-            if map_crs != layer_crs:
-                xf_to_layer = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
-                layer_pt = xf_to_layer.transform(click_pt_map)
+            op = profiler().start(f"distancia_clic{self.click_count + 1}")
+            map_crs = self.canvas.mapSettings().destinationCrs()
+            xfs = transforms()
 
             if self.click_count == 0:
-                # Primer punto
-                fids = self.index.nearestNeighbor(layer_pt, 5)
-                closest_feat, proj_pt_layer = None, None
-                min_d = float('inf')
-                for fid in fids:
-                    feat = self.layer.getFeature(fid)
-                    near = feat.geometry().nearestPoint(QgsGeometry.fromPointXY(QgsPointXY(layer_pt)))
-                    d = layer_pt.distance(near.asPoint())
-                    if d < min_d:
-                        min_d = d
-                        closest_feat = feat
-                        proj_pt_layer = near
-
-                if not closest_feat:
+                reference = self.network.reference()
+                op.mark("registro")
+
+                net_crs = self.network.crs
+                net_pt = xfs.point(map_crs, net_crs, click_pt_map)
+                op.mark("transformacion")
+
+                # Primer punto: segmento más cercano de todas las capas
+                hit = reference.nearest(net_pt.x(), net_pt.y())
+                op.mark("motor")
+
+                if hit is None:
                     self.iface.messageBar().pushMessage(
                         "Distancia PK",
                         "No se encontró línea cercana.",
@@ -283,46 +235,64 @@ class DistanciaTool(QgsMapTool):
                     )
                     return
 
-                self.first_feat = closest_feat
-                pk1, dist1 = self._compute_pk_and_dist(closest_feat.geometry(), proj_pt_layer)
+                self.first_member, match = hit
+                self.first_match = match
 
-                proj1_map = proj_pt_layer.asPoint()
-                if map_crs != layer_crs:
-                    xf_to_map = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-                    proj1_map = xf_to_map.transform(proj1_map)
+                proj1_map = xfs.point(net_crs, map_crs, QgsPointXY(match.x, match.y))
                 self._add_marker(proj1_map)
+                op.mark("marcador")
 
-                self.pk_values.append(pk1)
-                self.line_distances.append(dist1)
+                self.pk_values.append(match.pk)
+                self.line_distances.append(match.along)
                 self.click_count = 1
+                op.finish()
 
             else:
-                # Segundo punto sobre la MISMA geometría (first_feat)
-                geom = self.first_feat.geometry()
-                near_layer = geom.nearestPoint(QgsGeometry.fromPointXY(QgsPointXY(layer_pt)))
-                pk2, dist2 = self._compute_pk_and_dist(geom, near_layer)
-
-                proj2_map = near_layer.asPoint()
-                if map_crs != layer_crs:
-                    xf_to_map = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-                    proj2_map = xf_to_map.transform(proj2_map)
+                # Segundo punto en la capa del primero (su fid, vía y posición
+                # son de esa capa), sobre su CRS
+                engine = self.network.engine(self.first_member)
+                op.mark("registro")
+
+                layer_crs = self.network.layer_crs(self.first_member)
+                layer_pt = xfs.point(map_crs, layer_crs, click_pt_map)
+                op.mark("transformacion")
+
+                # Sobre la MISMA vía (cualquiera de sus features); sin
+                # identificador de vía, sobre la geometría del primer clic
+                if self.first_match.road is not None:
+                    match = engine.nearest_on_road(layer_pt.x(), layer_pt.y(), self.first_match.road)
+                else:
+                    match = engine.nearest(layer_pt.x(), layer_pt.y(), [self.first_match.fid])
+                op.mark("motor")
+                if match is None:
+                    return
+
+                proj2_map = xfs.point(layer_crs, map_crs, QgsPointXY(match.x, match.y))
                 self._add_marker(proj2_map)
+                op.mark("marcador")
 
-                self.pk_values.append(pk2)
-                self.line_distances.append(dist2)
+                self.pk_values.append(match.pk)
+                self.line_distances.append(match.along)
                 self.click_count = 2
 
                 dist_pk = abs(self.pk_values[1] - self.pk_values[0])               # km
-                dist_lineal = abs(self.line_distances[1] - self.line_distances[0]) # unidades de capa
-                # Se asume CRS en metros → pasa a km
-                dist_lineal_km = dist_lineal / 1000.0
+                # Longitud sobre la vía (cadena de features ordenada por M), en
+                # metros sobre el elipsoide del proyecto: las longitudes ya están
+                # calculadas en segundo plano (ensure_network_ready, arriba)
+                dist_lineal = engine.route_distance(self.first_match, match, metric=True)
+                if dist_lineal is None and match.fid == self.first_match.fid:
+                    # Sin identificador de vía: solo se mide dentro de la misma feature
+                    m1 = engine.metric_along(self.first_match.fid, self.first_match.along)
+                    m2 = engine.metric_along(match.fid, match.along)
+                    if m1 is not None and m2 is not None:
+                        dist_lineal = abs(m2 - m1)
+                op.mark("distancia")
+                # None: sin ruta entre los puntos (ver show_distance_message)
+                dist_lineal_km = None if dist_lineal is None else dist_lineal / 1000.0
 
                 # Nombre de la vía usando el campo configurado
-                try:
-                    val = self.first_feat[self.id_field]
-                    nombre_via = val if val not in (None, "") else "Vía desconocida"
-                except Exception:
-                    nombre_via = "Vía desconocida"
+                val = self.first_match.road
+                nombre_via = val if val not in (None, "") else "Vía desconocida"
 
                 self.callback(
                     nombre_via,
@@ -331,6 +301,8 @@ class DistanciaTool(QgsMapTool):
                     dist_pk,
                     dist_lineal_km
                 )
+                op.mark("interfaz")
+                op.finish()
 
         except Exception as e:
             self.iface.messageBar().pushMessage(
@@ -339,40 +311,6 @@ class DistanciaTool(QgsMapTool):
                 level=Qgis.Warning
             )
 
-    def _compute_pk_and_dist(self, geom_line, proj_pt_layer):
-        """
-        Devuelve:
-          - pk_km: PK interpolado en km, según valores M y unidades configuradas.
-          - dist_click: distancia acumulada a lo largo de la línea (unidades del CRS).
-        """
-        dist_click = geom_line.lineLocatePoint(proj_pt_layer)
-        verts = list(geom_line.vertices())
-        if len(verts) < 2:
-            return 0.0, 0.0
-
-        cum = [0.0]
-        for i in range(1, len(verts)):
-            seg = QgsGeometry.fromPolylineXY([QgsPointXY(verts[i-1]), QgsPointXY(verts[i])])
-            cum.append(cum[-1] + seg.length())
-
-        idx = next(
-            (i for i in range(len(cum)-1) if cum[i] <= dist_click <= cum[i+1]),
-            len(cum)-2
-        )
-
-        # Conversión de M según configuración:
-        #   - "m": divide entre 1000 (M en metros)
-        #   - "km": no divide (M en kilómetros)
-        factor = 1000.0 if (self.m_units or "m") == "m" else 1.0
-        m1 = verts[idx].m() / factor
-        m2 = verts[idx+1].m() / factor
-
-        start = cum[idx]
-        seg_len = cum[idx+1] - start
-        t = (dist_click - start) / seg_len if seg_len > 0 else 0.0
-        pk_km = m1 + t * (m2 - m1)
-        return pk_km, dist_click
-
     def _add_marker(self, map_pt):
         ring = QgsVertexMarker(self.canvas)
         ring.setCenter(QgsPointXY(map_pt))
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Red de trabajo federada: varias capas calibradas consultadas a la vez.
+
+La configuración puede definir, además de la capa principal, otras capas
+calibradas (p. ej. estatal, autonómica y municipal), cada una con su campo
+identificador y sus unidades de M. FederatedNetwork las valida, prepara el
+motor de cada una en el registro compartido (index_registry) y las reúne en
+un FederatedReference (core/federation.py) en el CRS de la capa principal:
+
+  - Identificar PK y el primer clic de Distancia PK hacen una sola búsqueda
+    del segmento más cercano entre todas las capas.
+  - Localizar PK encamina la vía a su capa con la tabla vía → capa.
+  - El segundo clic de Distancia PK sigue en la capa del primero.
+
+El índice común se construye en una QgsTask cuando los motores de todas las
+capas están listos, y se reutiliza mientras ninguno de ellos cambie (el
+registro los reconstruye tras cada edición). Con una sola capa no hay nada
+que construir: se usan su motor y su R-tree.
+
+Los procesos por lotes y los algoritmos de Processing siguen trabajando con
+la capa principal.
+"""
+
+from collections import namedtuple
+
+from qgis.core import (
+    Qgis, QgsApplication, QgsCoordinateTransform, QgsProject, QgsTask, QgsVectorLayer,
+    QgsWkbTypes
+)
+
+from ..core.federation import FederatedReference
+from ..settings import read_current_settings
+from .index_registry import index_registry
+from .pk_engine import metric_spec
+from .transforms import transform_xy, transforms
+
+
+NetworkLayer = namedtuple("NetworkLayer", "layer id_field m_units")
+
+
+class NetworkConfigError(Exception):
+    """Configuración de capas no válida; ``level`` es el nivel del mensaje."""
+
+    def __init__(self, message, level=Qgis.Warning):
+        super().__init__(message)
+        self.level = level
+
+
+def _find_layer(name):
+    for lyr in QgsProject.instance().mapLayers().values():
+        if isinstance(lyr, QgsVectorLayer) and lyr.name() == name:
+            return lyr
+    return None
+
+
+def configured_network(cfg=None, metric=False):
+    """
+    Red de trabajo según la configuración (``cfg`` = read_current_settings()).
+    Con ``metric``, su preparación incluye las longitudes en metros de cada
+    capa (ver FederatedNetwork.metric_spec).
+    Lanza NetworkConfigError si falta la configuración o alguna capa no vale.
+    """
+    cfg = cfg or read_current_settings()
+    entries = cfg.get("layers") or []
+    if not entries:
+        raise NetworkConfigError(
+            "No hay capa de trabajo configurada. Abre 'Configuración PK Tools' para definirla.",
+            Qgis.Info
+        )
+
+    members = []
+    for entry in entries:
+        name, id_field, m_units = entry["layer_name"], entry["id_field"], entry["m_units"]
+        layer = _find_layer(name)
+        if layer is None:
+            raise NetworkConfigError(
+                f"No se ha encontrado la capa '{name}'. Revisa la configuración de PK Tools."
+            )
+        if layer.geometryType() != QgsWkbTypes.LineGeometry:
+            raise NetworkConfigError(f"La capa '{name}' no es lineal.")
+        if not QgsWkbTypes.hasM(layer.wkbType()):
+            raise NetworkConfigError(f"La capa '{name}' no tiene geometría M.")
+        if layer.fields().indexOf(id_field) == -1:
+            raise NetworkConfigError(f"La capa '{name}' no tiene el campo '{id_field}'.")
+        members.append(NetworkLayer(layer, id_field, m_units))
+    return FederatedNetwork(members, metric)
+
+
+class _FederationTask(QgsTask):
+    """Lleva los vértices de todas las capas al CRS común y construye el R-tree."""
+
+    def __init__(self, key, engines, xfs):
+        super().__init__("PK Tools: indexando la red de varias capas", QgsTask.CanCancel)
+        self.key = key
+        self.engines = engines
+        self.xfs = xfs            # QgsCoordinateTransform (o None) por capa
+        self.callbacks = []
+        self.reference = None
+
+    def run(self):
+        coords = []
+        for i, (engine, xf) in enumerate(zip(self.engines, self.xfs)):
+            if self.isCanceled():
+                return False
+            coords.append(None if xf is None else transform_xy(xf, engine.x, engine.y))
+            self.setProgress(80.0 * (i + 1) / len(self.engines))
+        reference = FederatedReference(self.engines, coords)
+        reference.segment_tree()
+        self.reference = reference
+        return not self.isCanceled()
+
+    def finished(self, result):
+        _on_task_finished(self, result)
+
+
+# Índice común de la última red consultada: (clave, FederatedReference)
+_cache = None
+_task = None
+
+
+def _on_task_finished(task, ok):
+    global _cache, _task
+    if _task is task:
+        _task = None
+        if ok:
+            _cache = (task.key, task.reference)
+    for callback in task.callbacks:
+        callback(ok and _cache is not None and _cache[0] == task.key)
+
+
+def release_federation():
+    """Descarta el índice común (al descargar el plugin)."""
+    global _cache, _task
+    if _task is not None:
+        _task.cancel()
+    _cache = _task = None
+
+
+class FederatedNetwork:
+    """Capas calibradas de la configuración, por orden de prioridad."""
+
+    def __init__(self, members, metric=False):
+        self.members = list(members)
+        self.primary = self.members[0]
+        self.crs = self.primary.layer.crs()
+        self.metric = metric
+
+    def layer_crs(self, k):
+        return self.members[k].layer.crs()
+
+    def engine(self, k):
+        """Motor de PK (registro compartido) de la capa ``k``."""
+        m = self.members[k]
+        return index_registry().engine(m.layer, m.id_field, m.m_units)
+
+    def metric_spec(self, k):
+        """
+        Longitudes en metros que necesita la capa ``k`` (su CRS y el elipsoide
+        del proyecto), o None si la red no mide distancias.
+        """
+        if not self.metric:
+            return None
+        project = QgsProject.instance()
+        return metric_spec(self.layer_crs(k), project.ellipsoid(), project.transformContext())
+
+    def _key(self):
+        # Los motores cambian de identidad cuando el registro los reconstruye
+        return tuple(
+            (id(self.engine(k)), m.layer.id(), m.layer.crs().authid() or m.layer.crs().toWkt())
+            for k, m in enumerate(self.members)
+        ) + ((self.crs.authid() or self.crs.toWkt()),)
+
+    # ---------- Preparación ----------
+    def engines_ready(self, on_ready=None):
+        """True si los motores de todas las capas están listos (ver IndexRegistry.prepare)."""
+        registry = index_registry()
+        # Se lanzan todas las preparaciones a la vez (lista, no generador)
+        ready = [
+            registry.prepare(m.layer, m.id_field, m.m_units, on_ready, self.metric_spec(k))
+            for k, m in enumerate(self.members)
+        ]
+        return all(ready)
+
+    def prepare(self, on_ready=None):
+        """
+        True si la red está lista para consultar. Si no, lanza lo que falte
+        (motores de cada capa y, después, el índice común) y devuelve False;
+        ``on_ready(ok)`` se llama al terminar el paso en curso.
+        """
+        global _task
+        if not self.engines_ready(on_ready):
+            return False
+        key = self._key()
+        if _cache is not None and _cache[0] == key:
+            return True
+        if len(self.members) == 1:
+            # Una sola capa: se usan su motor y su R-tree, no hay que construir nada
+            self.reference()
+            return True
+        if _task is not None and _task.key != key:
+            _task.cancel()
+            _task = None
+        if _task is None:
+            xfs = [transforms().get(self.layer_crs(k), self.crs) for k in range(len(self.members))]
+            _task = _FederationTask(
+                key, [self.engine(k) for k in range(len(self.members))],
+                # Copias: la tarea las usa en otro hilo
+                [None if xf is None else QgsCoordinateTransform(xf) for xf in xfs]
+            )
+            QgsApplication.taskManager().addTask(_task)
+        if on_ready is not None and on_ready not in _task.callbacks:
+            _task.callbacks.append(on_ready)
+        return False
+
+    def pending_task(self):
+        """Tarea en curso del índice común, o None."""
+        return _task
+
+    def reference(self):
+        """
+        FederatedReference de la red. Si el índice común aún no está (ver
+        prepare), se construye aquí, en el hilo principal.
+        """
+        global _cache
+        engines = [self.engine(k) for k in range(len(self.members))]
+        key = self._key()
+        if _cache is None or _cache[0] != key:
+            xfs = transforms()
+            coords = [
+                None if self.layer_crs(k) == self.crs
+                else xfs.xy(self.layer_crs(k), self.crs, engine.x, engine.y)
+                for k, engine in enumerate(engines)
+            ]
+            _cache = (key, FederatedReference(engines, coords))
+        return _cache[1]
+
+    # ---------- Vías ----------
+    def road_catalogue(self):
+        """
+        Identificadores de vía de todas las capas como texto, ordenados sin
+        distinguir mayúsculas (catálogos cacheados en el registro).
+        """
+        registry = index_registry()
+        catalogues = [registry.road_catalogue(m.layer, m.id_field) for m in self.members]
+        if len(catalogues) == 1:
+            return catalogues[0]
+        return sorted(set().union(*catalogues), key=str.casefold)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Escritura de resultados a fichero (GeoPackage o FlatGeobuf).
+
+Las salidas grandes no pasan por una capa "memory": se abre un
+QgsVectorFileWriter y se le van entregando las features por bloques, de modo
+que la memoria no crece con el número de filas. En GeoPackage se puede añadir
+a una capa existente (append); FlatGeobuf solo admite crear el fichero.
+"""
+
+import os
+
+from qgis.core import QgsCoordinateTransformContext, QgsField, QgsFields, QgsVectorFileWriter
+
+
+# Extensión → driver de OGR
+DRIVERS = {
+    ".gpkg": "GPKG",
+    ".fgb": "FlatGeobuf",
+}
+
+FILE_FILTER = "GeoPackage (*.gpkg);;FlatGeobuf (*.fgb)"
+
+
+def driver_for(path):
+    """Driver de OGR según la extensión de ``path`` (GeoPackage por defecto)."""
+    return DRIVERS.get(os.path.splitext(path)[1].lower(), "GPKG")
+
+
+def default_layer_name(path):
+    """Nombre de capa por defecto: el del fichero sin extensión."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def unique_name(fields, name):
+    """``name`` o, si ya está en ``fields``, el primer ``name_1``, ``name_2``... libre."""
+    candidate, i = name, 1
+    while fields.indexOf(candidate) != -1:
+        candidate = f"{name}_{i}"
+        i += 1
+    return candidate
+
+
+def extend_fields(base, extra):
+    """Copia ``base`` y añade los campos ``extra`` (nombre, tipo) sin repetir nombres."""
+    fields = QgsFields(base)
+    for name, ftype in extra:
+        fields.append(QgsField(unique_name(fields, name), ftype))
+    return fields
+
+
+def create_writer(path, fields, wkb_type, crs, transform_context=None, layer_name=None,
+                  append=False):
+    """
+    Crea (o sobrescribe) el fichero ``path`` y devuelve el QgsVectorFileWriter.
+    Con ``append`` y un GeoPackage existente, añade a la capa ``layer_name``
+    (creándola si no existe; los campos que falten se añaden).
+    Hay que borrar el writer (``del writer``) para cerrar el fichero.
+    Lanza OSError si OGR no puede crearlo.
+    """
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = driver_for(path)
+    options.fileEncoding = "UTF-8"
+    options.layerName = layer_name or default_layer_name(path)
+    if append and os.path.exists(path):
+        if options.driverName != "GPKG":
+            raise OSError(f"No se puede añadir a '{path}': el formato no lo admite.")
+        if QgsVectorFileWriter.targetLayerExists(path, options.layerName):
+            options.actionOnExistingFile = QgsVectorFileWriter.AppendToLayerAddFields
+        else:
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    writer = QgsVectorFileWriter.create(
+        path, fields, wkb_type, crs,
+        transform_context or QgsCoordinateTransformContext(), options
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        message = writer.errorMessage()
+        del writer
+        raise OSError(f"No se puede crear '{path}': {message}")
+    return writer
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Diálogo del historial persistente (ver history_store).
+
+Muestra las consultas de una herramienta, más recientes primero, cargando
+PAGE_SIZE filas cada vez ("Cargar más"), con búsqueda por vía y/o PK. Sirve
+para elegir los puntos a exportar (casillas) y, si se pide (activatable),
+para volver a un punto concreto con doble clic.
+"""
+
+from qgis.PyQt.QtCore import Qt, QTimer
+from qgis.PyQt.QtWidgets import (
+    QDialog, QDialogButtonBox, QHBoxLayout, QLabel, QLineEdit, QListWidget,
+    QListWidgetItem, QMessageBox, QPushButton, QVBoxLayout
+)
+
+from .history_store import PAGE_SIZE
+
+
+class HistoryDialog(QDialog):
+    """Historial paginado con búsqueda y casillas de selección."""
+
+    SEARCH_DELAY_MS = 250
+
+    def __init__(self, parent, store, tool, title, formato_pk, activatable=False):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(460, 480)
+        self.store = store
+        self.tool = tool
+        self.formato_pk = formato_pk
+        self.entries = []
+        self.activated_entry = None   # entrada elegida con doble clic
+        self._exhausted = False
+
+        layout = QVBoxLayout(self)
+
+        self.le_search = QLineEdit()
+        self.le_search.setPlaceholderText("Buscar: vía, PK (12+300) o ambos (A-7 12)")
+        self.le_search.setClearButtonEnabled(True)
+        layout.addWidget(self.le_search)
+
+        self.lbl_count = QLabel()
+        layout.addWidget(self.lbl_count)
+
+        self.listw = QListWidget()
+        self.listw.setSelectionMode(QListWidget.NoSelection)
+        if activatable:
+            self.listw.itemDoubleClicked.connect(self._activate)
+        layout.addWidget(self.listw)
+
+        btn_row = QHBoxLayout()
+        self.btn_more = QPushButton("Cargar más")
+        btn_all = QPushButton("Marcar todo")
+        btn_none = QPushButton("Desmarcar todo")
+        btn_clear = QPushButton("Borrar historial…")
+        self.btn_more.clicked.connect(self._load_page)
+        btn_all.clicked.connect(lambda: self._set_all(Qt.Checked))
+        btn_none.clicked.connect(lambda: self._set_all(Qt.Unchecked))
+        btn_clear.clicked.connect(self._clear_history)
+        for b in (self.btn_more, btn_all, btn_none, btn_clear):
+            btn_row.addWidget(b)
+        layout.addLayout(btn_row)
+
+        btns = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        btns.accepted.connect(self.accept)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+
+        # La búsqueda se lanza al dejar de escribir, no en cada tecla
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self._search_timer.timeout.connect(self._reload)
+        self.le_search.textChanged.connect(lambda _: self._search_timer.start())
+
+        self._reload()
+
+    # ---------- Carga por páginas ----------
+    def _search(self):
+        return self.le_search.text().strip() or None
+
+    def _reload(self):
+        self.entries = []
+        self._exhausted = False
+        self.listw.clear()
+        total = self.store.count(self.tool, self._search())
+        self.lbl_count.setText(f"{total} puntos")
+        self._load_page()
+
+    def _load_page(self):
+        if self._exhausted:
+            return
+        after = self.entries[-1] if self.entries else None
+        page = self.store.page(self.tool, self._search(), after, PAGE_SIZE)
+        self._exhausted = len(page) < PAGE_SIZE
+        self.btn_more.setEnabled(not self._exhausted)
+        for e in page:
+            txt = (f"{e.time:%d/%m %H:%M} — PK {self.formato_pk(e.pk_km)} — "
+                   f"{e.via if e.via is not None else '?'}")
+            li = QListWidgetItem(txt)
+            li.setFlags(li.flags() | Qt.ItemIsUserCheckable)
+            li.setCheckState(Qt.Unchecked)
+            self.listw.addItem(li)
+        self.entries.extend(page)
+
+    # ---------- Selección ----------
+    def _set_all(self, state):
+        """Marca o desmarca todos los ítems cargados."""
+        for i in range(self.listw.count()):
+            self.listw.item(i).setCheckState(state)
+
+    def _activate(self, item):
+        self.activated_entry = self.entries[self.listw.row(item)]
+        self.accept()
+
+    def _clear_history(self):
+        answer = QMessageBox.question(
+            self, self.windowTitle(), "¿Borrar todo el historial de esta herramienta?",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if answer == QMessageBox.Yes:
+            self.store.clear(self.tool)
+            self._reload()
+
+    def selected_entries(self):
+        """Entradas marcadas, en el orden de la lista."""
+        return [self.entries[i] for i in range(self.listw.count())
+                if self.listw.item(i).checkState() == Qt.Checked]
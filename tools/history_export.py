@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación del historial de Identificar PK y Localizar PK a fichero.
+
+Los puntos seleccionados se escriben de una vez (una sola llamada a
+addFeatures, en una transacción en GeoPackage) en un GeoPackage o FlatGeobuf
+en WGS84, con campos tipados:
+  - VIA:        identificador de la vía
+  - PK_KM:      PK numérico en km
+  - PK:         PK en formato km+000
+  - LAT, LON:   coordenadas WGS84
+  - FID_ORIGEN: feature de la capa calibrada de la que sale el PK
+  - FECHA:      momento de la consulta
+Si el GeoPackage ya existe se puede añadir a su capa en lugar de
+sobrescribirlo, para acumular sesiones.
+"""
+
+import os
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsFeature, QgsField, QgsFields, QgsGeometry,
+    QgsPointXY, QgsProject, QgsVectorLayer, QgsWkbTypes
+)
+
+from .file_writer import FILE_FILTER, create_writer, default_layer_name, driver_for
+
+
+EXPORT_FIELDS = (
+    ("VIA", QVariant.String),
+    ("PK_KM", QVariant.Double),
+    ("PK", QVariant.String),
+    ("LAT", QVariant.Double),
+    ("LON", QVariant.Double),
+    ("FID_ORIGEN", QVariant.LongLong),
+    ("FECHA", QVariant.DateTime),
+)
+
+
+def ask_destination(parent, title):
+    """
+    Pide el fichero de destino. Si ya existe y es un GeoPackage, pregunta si
+    se añade o se sobrescribe. Devuelve (ruta, añadir) o None si se cancela.
+    """
+    path, selected = QFileDialog.getSaveFileName(
+        parent, title, "", FILE_FILTER, options=QFileDialog.DontConfirmOverwrite
+    )
+    if not path:
+        return None
+    if not os.path.splitext(path)[1]:
+        path += ".fgb" if "FlatGeobuf" in selected else ".gpkg"
+    if not os.path.exists(path):
+        return path, False
+
+    if driver_for(path) == "GPKG":
+        box = QMessageBox(QMessageBox.Question, title,
+                          f"'{os.path.basename(path)}' ya existe.", parent=parent)
+        btn_append = box.addButton("Añadir", QMessageBox.AcceptRole)
+        btn_replace = box.addButton("Sobrescribir", QMessageBox.DestructiveRole)
+        box.addButton(QMessageBox.Cancel)
+        box.exec_()
+        if box.clickedButton() == btn_append:
+            return path, True
+        if box.clickedButton() == btn_replace:
+            return path, False
+        return None
+
+    answer = QMessageBox.question(
+        parent, title, f"'{os.path.basename(path)}' ya existe. ¿Sobrescribir?",
+        QMessageBox.Yes | QMessageBox.No
+    )
+    return (path, False) if answer == QMessageBox.Yes else None
+
+
+def export_points(path, rows, append=False):
+    """
+    Escribe ``rows`` en ``path``: cada fila es
+    (vía, PK km, PK 'km+000', lat, lon, fid de origen, fecha).
+    Devuelve la capa del fichero lista para añadir al proyecto.
+    Lanza OSError si no se puede escribir.
+    """
+    fields = QgsFields()
+    for name, ftype in EXPORT_FIELDS:
+        fields.append(QgsField(name, ftype))
+
+    feats = []
+    for via, pk_km, pk_str, lat, lon, fid, when in rows:
+        f = QgsFeature(fields)
+        f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(lon, lat)))
+        f.setAttributes([
+            None if via is None else str(via), float(pk_km), pk_str,
+            float(lat), float(lon), None if fid is None else int(fid), when,
+        ])
+        feats.append(f)
+
+    name = default_layer_name(path)
+    writer = create_writer(
+        path, fields, QgsWkbTypes.Point, QgsCoordinateReferenceSystem("EPSG:4326"),
+        layer_name=name, append=append
+    )
+    try:
+        if not writer.addFeatures(feats):
+            raise OSError(f"No se pudo escribir en '{path}': {writer.errorMessage()}")
+    finally:
+        writer.flushBuffer()
+        del writer
+
+    uri = f"{path}|layername={name}" if driver_for(path) == "GPKG" else path
+    return QgsVectorLayer(uri, name, "ogr")
+
+
+def add_to_project(layer):
+    """
+    Añade la capa exportada al proyecto. Si ya estaba cargada (exportación
+    añadida al mismo fichero), recarga la existente en lugar de duplicarla.
+    """
+    project = QgsProject.instance()
+    for lyr in project.mapLayers().values():
+        if isinstance(lyr, QgsVectorLayer) and lyr.source() == layer.source():
+            lyr.dataProvider().reloadData()
+            lyr.updateExtents()
+            lyr.triggerRepaint()
+            return lyr
+    project.addMapLayer(layer)
+    return layer
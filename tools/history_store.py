@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Historial persistente de Identificar PK y Localizar PK.
+
+Cada consulta se guarda en una base SQLite del perfil de QGIS
+
+    <perfil>/pk_tools/historial.sqlite
+
+de modo que el historial sobrevive a los reinicios y puede crecer a miles de
+entradas por turno. La tabla tiene índices por herramienta + vía, PK y fecha,
+y las listas se cargan por páginas (paginación por clave: fecha e id de la
+última fila mostrada), así que el coste de abrir el menú o el diálogo no
+depende de lo largo que sea el historial.
+
+Búsqueda (search):
+  "A-7"          vías que empiezan por "A-7" (sin distinguir mayúsculas)
+  "12+300"       PK exacto (al metro)
+  "12"           cualquier PK entre 12+000 y 12+999
+  "A-7 12+300"   las dos cosas
+"""
+
+import os
+import sqlite3
+from collections import namedtuple
+from datetime import datetime
+
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
+
+
+TOOL_IDENTIFY = "identificar"
+TOOL_LOCATE = "localizar"
+
+PAGE_SIZE = 200
+
+HistoryEntry = namedtuple("HistoryEntry", "id tool via pk_km lat lon fid time")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id     INTEGER PRIMARY KEY,
+    tool   TEXT NOT NULL,
+    via    TEXT COLLATE NOCASE,
+    pk_km  REAL NOT NULL,
+    lat    REAL,
+    lon    REAL,
+    fid    INTEGER,
+    fecha  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_via ON history (tool, via, pk_km);
+CREATE INDEX IF NOT EXISTS history_pk ON history (tool, pk_km);
+CREATE INDEX IF NOT EXISTS history_fecha ON history (tool, fecha);
+"""
+
+_COLUMNS = "id, tool, via, pk_km, lat, lon, fid, fecha"
+
+
+def default_path():
+    """Base del historial en el perfil de QGIS."""
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "pk_tools", "historial.sqlite")
+
+
+def _parse_pk(token):
+    """'12+300' → (12.3, 12.3005); '12' o '12.5' → intervalo de ese km. None si no es PK."""
+    token = token.replace(",", ".")
+    try:
+        if "+" in token:
+            km, m = token.split("+", 1)
+            pk = int(km) + int(m) / 1000.0
+            return pk - 0.0005, pk + 0.0005
+        value = float(token)
+    except ValueError:
+        return None
+    if "." in token:
+        return value - 0.0005, value + 0.0005
+    return value, value + 1.0
+
+
+def parse_search(text):
+    """
+    Traduce el texto de búsqueda a (prefijo de vía, PK mínimo, PK máximo);
+    las partes que no aparecen son None.
+    """
+    tokens = (text or "").split()
+    pk_range = _parse_pk(tokens[-1]) if tokens else None
+    if pk_range is not None:
+        tokens = tokens[:-1]
+    road = " ".join(tokens) or None
+    return (road,) + (pk_range or (None, None))
+
+
+def _like_prefix(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+class HistoryStore:
+    """Historial en SQLite, compartido por las herramientas."""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            # Perfil de solo lectura o base dañada: historial solo de sesión
+            QgsMessageLog.logMessage(
+                f"No se pudo abrir el historial '{self.path}' ({e}); se usa uno temporal.",
+                "PK Tools", Qgis.Warning
+            )
+            self.path = ":memory:"
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    # ---------- Escritura ----------
+    def add(self, tool, via, pk_km, lat, lon, fid, when=None):
+        """Guarda una consulta. Devuelve su HistoryEntry."""
+        when = when or datetime.now()
+        with self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO history (tool, via, pk_km, lat, lon, fid, fecha) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (tool, None if via is None else str(via), float(pk_km), lat, lon,
+                 None if fid is None else int(fid), when.isoformat(timespec="seconds"))
+            )
+        return HistoryEntry(cur.lastrowid, tool, via, float(pk_km), lat, lon, fid, when)
+
+    def clear(self, tool):
+        with self._conn:
+            self._conn.execute("DELETE FROM history WHERE tool = ?", (tool,))
+
+    # ---------- Consulta ----------
+    def _where(self, tool, search):
+        road, pk_lo, pk_hi = parse_search(search)
+        sql, params = ["tool = ?"], [tool]
+        if road is not None:
+            sql.append("via LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(road))
+        if pk_lo is not None:
+            sql.append("pk_km >= ? AND pk_km < ?")
+            params += [pk_lo, pk_hi]
+        return sql, params
+
+    def page(self, tool, search=None, after=None, limit=PAGE_SIZE):
+        """
+        Entradas más recientes primero. ``after`` es la última entrada de la
+        página anterior (None = primera página).
+        """
+        sql, params = self._where(tool, search)
+        if after is not None:
+            sql.append("(fecha, id) < (?, ?)")
+            params += [after.time.isoformat(timespec="seconds"), after.id]
+        rows = self._conn.execute(
+            f"SELECT {_COLUMNS} FROM history WHERE {' AND '.join(sql)} "
+            "ORDER BY fecha DESC, id DESC LIMIT ?",
+            params + [int(limit)]
+        ).fetchall()
+        return [
+            HistoryEntry(i, t, via, pk, lat, lon, fid, datetime.fromisoformat(fecha))
+            for i, t, via, pk, lat, lon, fid, fecha in rows
+        ]
+
+    def count(self, tool, search=None):
+        sql, params = self._where(tool, search)
+        return self._conn.execute(
+            f"SELECT COUNT(*) FROM history WHERE {' AND '.join(sql)}", params
+        ).fetchone()[0]
+
+
+_store = None
+
+
+def history_store():
+    """Historial compartido (se abre la primera vez)."""
+    global _store
+    if _store is None:
+        _store = HistoryStore()
+    return _store
+
+
+def release_history_store():
+    """Cierra la base del historial."""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Identificar PK por lotes.
+
+Aplica la misma lógica que Identificar PK (línea más cercana + interpolación
+del M) a todas las features de una capa de puntos y devuelve una copia de la
+capa con los campos:
+  - VIA:      identificador de la vía
+  - PK_KM:    PK numérico en km
+  - PK:       PK en formato km+000
+  - DIST:     distancia del punto a la vía (unidades de la capa calibrada)
+  - LADO:     D (derecha) / I (izquierda) según el sentido creciente del PK
+La proyección se hace de forma vectorizada sobre la red preparada
+(PKEngine.nearest_many), sin llamadas a nearestPoint por punto.
+"""
+
+import numpy as np
+from qgis.PyQt.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QDoubleSpinBox,
+    QDialogButtonBox
+)
+from qgis.PyQt.QtCore import Qt, QVariant
+from qgis.core import (
+    QgsProject, QgsVectorLayer, QgsWkbTypes, QgsFeature, QgsField, QgsFields
+)
+
+from .file_writer import unique_name
+from .transforms import transforms
+
+
+SIDE_LABELS = {1: "D", -1: "I", 0: ""}
+
+OUTPUT_FIELDS = (
+    ("VIA", QVariant.String),
+    ("PK_KM", QVariant.Double),
+    ("PK", QVariant.String),
+    ("DIST", QVariant.Double),
+    ("LADO", QVariant.String),
+)
+
+
+def identify_layer(engine, points, network_crs, max_dist, formato_pk,
+                   name="Identificación PK (lote)"):
+    """
+    Identifica el PK de todas las features de ``points``.
+    Devuelve (capa de salida en memoria, número de puntos identificados).
+    """
+    feats = list(points.getFeatures())
+
+    # Coordenadas en el CRS de la capa calibrada (transformadas de una vez)
+    xs = np.full(len(feats), np.nan)
+    ys = np.full(len(feats), np.nan)
+    for i, feat in enumerate(feats):
+        geom = feat.geometry()
+        if geom is None or geom.isEmpty():
+            continue
+        pt = geom.vertexAt(0)
+        xs[i], ys[i] = pt.x(), pt.y()
+    xs, ys = transforms().xy(points.crs(), network_crs, xs, ys)
+
+    res = engine.nearest_many(xs, ys, max_dist)
+
+    # Capa de salida: copia de la capa de puntos + campos de PK
+    fields = QgsFields(points.fields())
+    names = []
+    for fname, ftype in OUTPUT_FIELDS:
+        names.append(unique_name(fields, fname))
+        fields.append(QgsField(names[-1], ftype))
+
+    geom_type = QgsWkbTypes.displayString(points.wkbType())
+    out = QgsVectorLayer(geom_type, name, "memory")
+    out.setCrs(points.crs())
+    prov = out.dataProvider()
+    prov.addAttributes(fields.toList())
+    out.updateFields()
+
+    new_feats = []
+    for i, feat in enumerate(feats):
+        f = QgsFeature(out.fields())
+        f.setGeometry(feat.geometry())
+        fi = int(res.fi[i])
+        if fi >= 0:
+            pk = float(res.pk[i])
+            extra = [
+                engine.roads[fi], pk, formato_pk(pk),
+                float(res.dist[i]), SIDE_LABELS[int(res.side[i])],
+            ]
+        else:
+            extra = [None] * len(OUTPUT_FIELDS)
+        f.setAttributes(feat.attributes() + extra)
+        new_feats.append(f)
+
+    prov.addFeatures(new_feats)
+    out.updateExtents()
+    return out, int((res.fi >= 0).sum())
+
+
+class IdentificarLoteDialog(QDialog):
+    """Diálogo para elegir la capa de puntos y la distancia máxima de búsqueda."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Identificar PK de una capa de puntos")
+        self.setMinimumWidth(380)
+
+        self._layers = [
+            lyr for lyr in QgsProject.instance().mapLayers().values()
+            if isinstance(lyr, QgsVectorLayer)
+            and lyr.geometryType() == QgsWkbTypes.PointGeometry
+        ]
+
+        layout = QVBoxLayout(self)
+
+        row_layer = QHBoxLayout()
+        row_layer.addWidget(QLabel("Capa de puntos:"))
+        self.cbo_layer = QComboBox()
+        for lyr in self._layers:
+            self.cbo_layer.addItem(lyr.name())
+        row_layer.addWidget(self.cbo_layer)
+        layout.addLayout(row_layer)
+
+        row_dist = QHBoxLayout()
+        row_dist.addWidget(QLabel("Distancia máxima a la vía (unidades de la capa calibrada):"))
+        self.spn_dist = QDoubleSpinBox()
+        self.spn_dist.setRange(0.01, 1e7)
+        self.spn_dist.setDecimals(2)
+        self.spn_dist.setValue(50.0)
+        row_dist.addWidget(self.spn_dist)
+        layout.addLayout(row_dist)
+
+        btns = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
+            orientation=Qt.Horizontal,
+            parent=self
+        )
+        btns.accepted.connect(self.accept)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+
+    def selected_layer(self):
+        idx = self.cbo_layer.currentIndex()
+        if idx < 0 or idx >= len(self._layers):
+            return None
+        return self._layers[idx]
+
+    def max_distance(self):
+        return self.spn_dist.value()
@@ -4,29 +4,30 @@ Plugin QGIS: Identificar PK
 
 Herramienta para identificar un PK (punto kilométrico) en capas lineales
 con geometría M. Muestra un mensaje con información, enlaces a Street View
-y botones de copia rápida. Además permite exportar puntos identificados
-a una capa temporal de puntos.
+y botones de copia rápida. Los puntos identificados se guardan en un
+historial persistente (SQLite, con búsqueda) desde el que se pueden exportar
+a un GeoPackage o FlatGeobuf. En modo de lectura continua muestra la vía y el
+PK bajo el cursor en la barra de estado.
 """
 
 # IMPORTS
 from qgis.PyQt.QtGui import QIcon, QColor
 from qgis.PyQt.QtWidgets import (
     QAction, QPushButton, QApplication,
-    QMenu, QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem,
-    QDialogButtonBox, QLabel
+    QMenu, QDialog, QLabel
 )
-from qgis.PyQt.QtCore import Qt, QMimeData, QPoint, QVariant
+from qgis.PyQt.QtCore import Qt, QMimeData, QPoint, QTimer
 from qgis.gui import QgsMapTool, QgsVertexMarker
-from qgis.core import (
-    QgsPointXY, QgsGeometry, QgsCoordinateTransform, QgsProject,
-    QgsCoordinateReferenceSystem, QgsWkbTypes, QgsVectorLayer,
-    QgsSpatialIndex, QgsField, QgsFeature, Qgis
-)
-from ..settings import read_current_settings
-
-
-# Campo por defecto histórico (por si falta en settings)
-EXPECTED_FIELD = "ID_ROAD"
+from qgis.core import QgsPointXY, QgsProject, QgsRectangle, Qgis
+from .federation import NetworkConfigError, configured_network
+from .index_registry import index_registry
+from .indexing import IndexingStatus
+from .profiling import profiler
+from .transforms import transforms
+from .history_export import add_to_project, ask_destination, export_points
+from .history_dialog import HistoryDialog
+from .history_store import TOOL_IDENTIFY, history_store
+from .identificar_lote import IdentificarLoteDialog, identify_layer
 
 
 def formato_pk(pk_total):
@@ -48,6 +49,7 @@ class IdentificarPK:
         self.tool = None          # instancia de IdentificarPKTool
         self.action = None        # solo se usaría si esta clase tuviera su propio botón
         self._current_msg = None  # referencia al mensaje visible en la barra
+        self.indexing = IndexingStatus(iface, "Identificar PK")
 
     # ---------- Inicialización opcional ----------
     # (pk_tools.py ya gestiona la toolbar, esto solo se usaría si quisieras
@@ -66,6 +68,7 @@ class IdentificarPK:
     def unload(self):
         """Limpia todo al descargar el plugin."""
         self._pop_current_message()
+        self.indexing.clear()
         if self.tool:
             self.tool.clear_markers()
             if self.canvas.mapTool() == self.tool:
@@ -92,53 +95,24 @@ class IdentificarPK:
     def activate_tool(self):
         """Selecciona la capa de configuración y activa la herramienta de identificación."""
         try:
-            cfg = read_current_settings()
-            layer_name = cfg.get("layer_name") or ""
-            id_field = cfg.get("id_field") or EXPECTED_FIELD
-            m_units = cfg.get("m_units") or "m"
-
-            if not layer_name:
-                self.iface.messageBar().pushMessage(
-                    "Identificar PK",
-                    "No hay capa de trabajo configurada. Abre 'Configuración PK Tools' para definirla.",
-                    level=Qgis.Info
-                )
-                return False
-
-            # Buscar la capa por nombre
-            layer = None
-            for lyr in QgsProject.instance().mapLayers().values():
-                if isinstance(lyr, QgsVectorLayer) and lyr.name() == layer_name:
-                    layer = lyr
-                    break
-
-            # Validar capa
-            if (
-                layer is None
-                or layer.geometryType() != QgsWkbTypes.LineGeometry
-                or not QgsWkbTypes.hasM(layer.wkbType())
-                or layer.fields().indexOf(id_field) == -1
-            ):
-                self.iface.messageBar().pushMessage(
-                    "Identificar PK",
-                    (
-                        f"La capa configurada '{layer_name}' no es válida. "
-                        "Debe ser lineal, tener geometría M y contener el campo "
-                        f"'{id_field}'."
-                    ),
-                    level=Qgis.Warning
-                )
+            # Capa principal y, si las hay, capas adicionales de la configuración
+            try:
+                network = configured_network()
+            except NetworkConfigError as e:
+                self.iface.messageBar().pushMessage("Identificar PK", str(e), level=e.level)
                 return False
 
             # Inicializa la herramienta si no existe
             if not self.tool:
                 self.tool = IdentificarPKTool(self.iface, self.canvas, self.show_pk_message)
 
-            # Actualizar parámetros de la herramienta según la configuración
-            self.tool.layer = layer
-            self.tool.index = QgsSpatialIndex(layer.getFeatures())
-            self.tool.id_field = id_field
-            self.tool.m_units = m_units
+            # Actualizar la red de la herramienta según la configuración
+            self.tool.network = network
+
+            # Motores de cada capa e índice común: se preparan en segundo plano
+            # (la herramienta se activa ya y muestra "Indexando…" hasta que estén)
+            self.tool.indexing = self.indexing
+            self.indexing.ensure_network_ready(network)
 
             self.canvas.setMapTool(self.tool)
             return True
@@ -224,58 +198,7 @@ class IdentificarPK:
             if self.canvas.mapTool() == self.tool:
                 self.canvas.unsetMapTool(self.tool)
         self._pop_current_message()
-
-
-# ============================================================
-# DIALOGO DE EXPORTACION
-# ============================================================
-class ExportDialog(QDialog):
-    """Diálogo para seleccionar puntos recientes a exportar."""
-
-    def __init__(self, parent, items_recent_first):
-        super().__init__(parent)
-        self.setWindowTitle("Exportar puntos del historial")
-        self.items = items_recent_first
-
-        layout = QVBoxLayout(self)
-        layout.addWidget(QLabel("Selecciona los puntos a exportar:"))
-
-        # Lista con checkboxes
-        self.listw = QListWidget()
-        self.listw.setSelectionMode(QListWidget.NoSelection)
-        for i, it in enumerate(self.items):
-            txt = f"{i+1:02d} — PK {it['pk_str']} — {it['via']}"
-            li = QListWidgetItem(txt)
-            li.setFlags(li.flags() | Qt.ItemIsUserCheckable)
-            li.setCheckState(Qt.Unchecked)
-            self.listw.addItem(li)
-        layout.addWidget(self.listw)
-
-        # Botones de marcar/desmarcar todo
-        btn_row = QHBoxLayout()
-        btn_all = QPushButton("Marcar todo")
-        btn_none = QPushButton("Desmarcar todo")
-        btn_all.clicked.connect(lambda: self._set_all(Qt.Checked))
-        btn_none.clicked.connect(lambda: self._set_all(Qt.Unchecked))
-        btn_row.addWidget(btn_all)
-        btn_row.addWidget(btn_none)
-        layout.addLayout(btn_row)
-
-        # Botones OK / Cancelar
-        btns = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
-        btns.accepted.connect(self.accept)
-        btns.rejected.connect(self.reject)
-        layout.addWidget(btns)
-
-    def _set_all(self, state):
-        """Marca o desmarca todos los ítems."""
-        for i in range(self.listw.count()):
-            self.listw.item(i).setCheckState(state)
-
-    def selected_indices(self):
-        """Devuelve los índices seleccionados por el usuario."""
-        return [i for i in range(self.listw.count())
-                if self.listw.item(i).checkState() == Qt.Checked]
+        self.indexing.clear()
 
 
 # ============================================================
@@ -283,19 +206,38 @@ class ExportDialog(QDialog):
 # ============================================================
 class IdentificarPKTool(QgsMapTool):
     """Herramienta que captura clics en el mapa e identifica el PK más cercano."""
-    MAX_HISTORY = 30  # número máximo de puntos guardados en el historial
+    HOVER_INTERVAL_MS = 50    # lectura continua: como mucho una consulta cada 50 ms
+    HOVER_TOLERANCE_PX = 25   # lectura continua: distancia máxima a la vía, en píxeles
 
     def __init__(self, iface, canvas, callback):
         super().__init__(canvas)
         self.iface = iface
         self.canvas = canvas
         self.callback = callback
-        self.index = None
-        self.layer = None
+        self.network = None              # FederatedNetwork de la configuración
         self.markers = []
-        self.history = []
-        self.id_field = EXPECTED_FIELD   # se sobrescribe desde settings
-        self.m_units = "m"               # "m" (por defecto) o "km"
+        self.indexing = None             # IndexingStatus del controlador
+
+        # Lectura continua al mover el ratón: los eventos se agrupan con un
+        # temporizador y solo se consulta la última posición
+        self.hover = False
+        self._hover_pos = None
+        self._hover_label = None
+        self._hover_marker = None
+        self._hover_timer = QTimer()
+        self._hover_timer.setSingleShot(True)
+        self._hover_timer.setInterval(self.HOVER_INTERVAL_MS)
+        self._hover_timer.timeout.connect(self._hover_update)
+
+    # ---------- Activación ----------
+    def activate(self):
+        super().activate()
+        if self.hover:
+            self._show_hover_label()
+
+    def deactivate(self):
+        self._hide_hover()
+        super().deactivate()
 
     # ---------- Manejo de marcadores ----------
     def _add_marker(self, map_pt):
@@ -339,136 +281,174 @@ class IdentificarPKTool(QgsMapTool):
             punto = self.toMapCoordinates(event.pos())
             self.identify_point(punto)
 
+    def canvasMoveEvent(self, event):
+        if not self.hover:
+            return
+        # Solo se guarda la última posición; el temporizador agrupa los eventos
+        self._hover_pos = QPoint(event.pos())
+        if not self._hover_timer.isActive():
+            self._hover_timer.start()
+
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
             self.canvas.unsetMapTool(self)
 
+    # ---------- Lectura continua (hover) ----------
+    def set_hover(self, enabled):
+        """Activa o desactiva la lectura continua del PK bajo el cursor."""
+        self.hover = enabled
+        if enabled:
+            self._show_hover_label()
+        else:
+            self._hide_hover()
+
+    def _show_hover_label(self):
+        if self._hover_label is None:
+            self._hover_label = QLabel("PK: –")
+            self._hover_label.setToolTip("Identificar PK: vía y PK bajo el cursor")
+            self.iface.statusBarIface().addPermanentWidget(self._hover_label)
+
+    def _hide_hover(self):
+        self._hover_timer.stop()
+        self._hover_pos = None
+        if self._hover_label is not None:
+            self.iface.statusBarIface().removeWidget(self._hover_label)
+            self._hover_label.deleteLater()
+            self._hover_label = None
+        self._clear_hover_marker()
+
+    def _clear_hover_marker(self):
+        if self._hover_marker is not None:
+            try:
+                self.canvas.scene().removeItem(self._hover_marker)
+            except Exception:
+                pass
+            self._hover_marker = None
+
+    def _hover_transforms(self):
+        """Transformaciones mapa → red y red → mapa (None si coinciden)."""
+        map_crs = self.canvas.mapSettings().destinationCrs()
+        net_crs = self.network.crs
+        return transforms().get(map_crs, net_crs), transforms().get(net_crs, map_crs)
+
+    def _hover_update(self):
+        """Consulta el PK de la última posición del cursor y actualiza la lectura."""
+        if self._hover_pos is None or self._hover_label is None or not self.network:
+            return
+        try:
+            op = profiler().start("identificar_lectura")
+            if not self.network.prepare():
+                self._hover_label.setText("PK: indexando…")
+                return
+            reference = self.network.reference()
+            op.mark("registro")
+
+            # Punto y tolerancia (píxeles → unidades de la red)
+            point = self.toMapCoordinates(self._hover_pos)
+            tol = self.HOVER_TOLERANCE_PX * self.canvas.mapUnitsPerPixel()
+            to_net, to_map = self._hover_transforms()
+            if to_net is not None:
+                rect = to_net.transformBoundingBox(QgsRectangle(
+                    point.x() - tol, point.y() - tol, point.x() + tol, point.y() + tol
+                ))
+                point = to_net.transform(point)
+                tol = max(rect.width(), rect.height()) / 2.0
+            op.mark("transformacion")
+
+            # R-tree de segmentos de todas las capas: sin consultas al proveedor
+            hit = reference.nearest_within(point.x(), point.y(), tol)
+            op.mark("motor")
+            if hit is None:
+                self._hover_label.setText("PK: –")
+                self._clear_hover_marker()
+                return
+            match = hit[1]
+
+            nombre_via = match.road if match.road not in (None, "") else "Vía desconocida"
+            self._hover_label.setText(f"{nombre_via} · PK {formato_pk(match.pk)}")
+
+            proj_pt = QgsPointXY(match.x, match.y)
+            if to_map is not None:
+                proj_pt = to_map.transform(proj_pt)
+            if self._hover_marker is None:
+                self._hover_marker = QgsVertexMarker(self.canvas)
+                self._hover_marker.setColor(QColor(0, 0, 255))
+                self._hover_marker.setIconType(QgsVertexMarker.ICON_CROSS)
+                self._hover_marker.setIconSize(12)
+                self._hover_marker.setPenWidth(2)
+            self._hover_marker.setCenter(proj_pt)
+            op.mark("interfaz")
+            op.finish()
+        except Exception:
+            self._hover_label.setText("PK: –")
+
     # ---------- Historial ----------
-    def _push_history(self, via, pk_value, map_pt):
-        """Guarda el resultado en el historial."""
-        item = {
-            'via': via,
-            'pk_value': pk_value,
-            'pk_str': formato_pk(pk_value),
-            'map_pt': QgsPointXY(map_pt)
-        }
-        self.history.append(item)
-        if len(self.history) > self.MAX_HISTORY:
-            self.history = self.history[-self.MAX_HISTORY:]
+    def _push_history(self, via, pk_value, lat, lon, fid):
+        """Guarda el resultado en el historial persistente."""
+        history_store().add(TOOL_IDENTIFY, via, pk_value, lat, lon, fid)
 
     # ---------- Lógica de identificación ----------
     def identify_point(self, point):
         """Identifica el PK en el clic dado."""
         try:
-            if not self.layer or not self.index:
+            if not self.network:
                 self.iface.messageBar().pushMessage(
                     "Identificar PK", "No hay capa válida asignada.",
                     level=Qgis.Warning
                 )
                 return
 
+            # Mientras se indexa la red, el clic solo recuerda el estado "Indexando…"
+            if self.indexing is not None and not self.indexing.ensure_network_ready(self.network):
+                return
+
+            op = profiler().start("identificar")
+            reference = self.network.reference()
+            op.mark("registro")
+
             map_crs = self.canvas.mapSettings().destinationCrs()
-            layer = self.layer
-            layer_crs = layer.crs()
-
-            # Transformar punto al CRS de la capa
-            point_layer_crs = point
-            if layer_crs != map_crs:
-                xf_to_layer = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
-                point_layer_crs = xf_to_layer.transform(point)
-
-            # Buscar la línea más cercana
-            nearest_ids = self.index.nearestNeighbor(point_layer_crs, 5)
-            closest_feat, closest_dist, proj_pt = None, float('inf'), None
-            for fid in nearest_ids:
-                feat = layer.getFeature(fid)
-                geom = feat.geometry()
-                near = geom.nearestPoint(QgsGeometry.fromPointXY(QgsPointXY(point_layer_crs)))
-                d = point_layer_crs.distance(near.asPoint())
-                if d < closest_dist:
-                    closest_dist = d
-                    closest_feat = feat
-                    proj_pt = near
-
-            if not closest_feat or proj_pt is None:
+            net_crs = self.network.crs
+
+            # Transformar punto al CRS de la red (transformaciones cacheadas)
+            xfs = transforms()
+            point_net_crs = xfs.point(map_crs, net_crs, point)
+            op.mark("transformacion")
+
+            # Segmento más cercano de todas las capas (un solo R-tree) y PK
+            # sobre los arrays del motor de la capa a la que pertenece
+            hit = reference.nearest(point_net_crs.x(), point_net_crs.y())
+            op.mark("motor")
+            if hit is None:
                 self.iface.messageBar().pushMessage(
                     "Identificar PK", "No se encontró línea cercana.",
                     level=Qgis.Info
                 )
                 return
-
-            # Calcular PK interpolado según valores M
-            geom_line = closest_feat.geometry()
-            dist_click = geom_line.lineLocatePoint(proj_pt)
-            verts = list(geom_line.vertices())
-            if len(verts) < 2:
-                self.iface.messageBar().pushMessage(
-                    "Identificar PK", "Geometría no válida.",
-                    level=Qgis.Warning
-                )
-                return
-
-            cum = [0.0]
-            for i in range(1, len(verts)):
-                p0, p1 = verts[i-1], verts[i]
-                cum.append(
-                    cum[-1]
-                    + QgsGeometry.fromPointXY(QgsPointXY(p0)).distance(
-                        QgsGeometry.fromPointXY(QgsPointXY(p1))
-                    )
-                )
-
-            idx = next(
-                (i for i in range(len(cum) - 1) if cum[i] <= dist_click <= cum[i + 1]),
-                len(cum) - 2
-            )
-
-            # Conversión de M a km según configuración:
-            # - Si m_units == "m", el campo M está en metros → dividimos entre 1000
-            # - Si m_units == "km", el campo M ya está en kilómetros → no convertimos
-            factor = 1000.0 if (self.m_units or "m") == "m" else 1.0
-            m1 = verts[idx].m() / factor
-            m2 = verts[idx + 1].m() / factor
-
-            start_seg = cum[idx]
-            seg_len = cum[idx + 1] - start_seg
-            t = (dist_click - start_seg) / seg_len if seg_len > 0 else 0.0
-            pk_final = m1 + t * (m2 - m1)
+            match = hit[1]
+            pk_final = match.pk
 
             # Actualizar marcador
             self.clear_markers()
-            proj_pt_map = proj_pt.asPoint()
-            if layer_crs != map_crs:
-                xf_to_map = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-                proj_pt_map = xf_to_map.transform(proj_pt_map)
+            proj_pt_map = xfs.point(net_crs, map_crs, QgsPointXY(match.x, match.y))
             self._add_marker(proj_pt_map)
+            op.mark("marcador")
 
             # Coordenadas WGS84 para Street View
-            to_wgs84 = QgsCoordinateTransform(
-                map_crs,
-                QgsCoordinateReferenceSystem("EPSG:4326"),
-                QgsProject.instance()
-            )
-            proj_pt_wgs = to_wgs84.transform(proj_pt_map)
+            proj_pt_wgs = xfs.point(map_crs, xfs.wgs84, proj_pt_map)
+            op.mark("wgs84")
             lat, lon = proj_pt_wgs.y(), proj_pt_wgs.x()
             url_sv = (
                 f"https://www.google.com/maps/@?api=1&map_action=pano"
                 f"&viewpoint={lat},{lon}&heading=0&pitch=10&fov=250"
             )
 
-            field = self.id_field
-            try:
-                nombre_via = (
-                    closest_feat[field]
-                    if field and closest_feat[field] not in (None, "")
-                    else "Vía desconocida"
-                )
-            except Exception:
-                nombre_via = "Vía desconocida"
+            nombre_via = match.road if match.road not in (None, "") else "Vía desconocida"
 
             # Guardar en historial y mostrar mensaje
-            self._push_history(nombre_via, pk_final, proj_pt_map)
+            self._push_history(nombre_via, pk_final, lat, lon, match.fid)
             self.callback(nombre_via, pk_final, url_sv, lat, lon)
+            op.mark("interfaz")
+            op.finish()
 
         except Exception:
             self.iface.messageBar().pushMessage(
@@ -480,76 +460,90 @@ class IdentificarPKTool(QgsMapTool):
     def _show_context_menu(self, mouse_event):
         menu = QMenu()
         act_export = menu.addAction("Exportar puntos")
+        act_batch = menu.addAction("Identificar capa de puntos…")
+        menu.addSeparator()
+        act_hover = menu.addAction("Lectura continua al mover el ratón")
+        act_hover.setCheckable(True)
+        act_hover.setChecked(self.hover)
         global_pos = self.canvas.mapToGlobal(mouse_event.pos())
         action = menu.exec_(global_pos if isinstance(global_pos, QPoint) else mouse_event.globalPos())
         if action == act_export:
             self._export_points_dialog()
+        elif action == act_batch:
+            self._identify_layer_dialog()
+        elif action == act_hover:
+            self.set_hover(act_hover.isChecked())
+
+    def _identify_layer_dialog(self):
+        """
+        Identifica el PK de todas las features de una capa de puntos (sobre
+        la capa principal de la configuración).
+        """
+        if not self.network:
+            self.iface.messageBar().pushMessage(
+                "Identificar PK", "No hay capa válida asignada.",
+                level=Qgis.Warning
+            )
+            return
+        primary = self.network.primary
+        if self.indexing is not None and not self.indexing.ensure_ready(
+            primary.layer, primary.id_field, primary.m_units, self._identify_layer_dialog
+        ):
+            return
+
+        dlg = IdentificarLoteDialog(self.iface.mainWindow())
+        if dlg.exec_() != QDialog.Accepted or dlg.selected_layer() is None:
+            return
+
+        engine = index_registry().engine(primary.layer, primary.id_field, primary.m_units)
+        out, n_found = identify_layer(
+            engine, dlg.selected_layer(), primary.layer.crs(), dlg.max_distance(), formato_pk
+        )
+        QgsProject.instance().addMapLayer(out)
+        self.iface.messageBar().pushMessage(
+            "Identificar PK",
+            f"Puntos identificados: {n_found} de {out.featureCount()}.",
+            level=Qgis.Info
+        )
 
     def _export_points_dialog(self):
-        """Muestra el diálogo de exportación y guarda los puntos en una capa temporal."""
-        if not self.history:
+        """Muestra el diálogo de exportación y guarda los puntos en un fichero."""
+        store = history_store()
+        if not store.count(TOOL_IDENTIFY):
             self.iface.messageBar().pushMessage(
                 "Identificar PK", "No hay puntos recientes para exportar.",
                 level=Qgis.Info
             )
             return
 
-        base = self.history[-self.MAX_HISTORY:]
-        items_display = list(reversed(base))
-
-        dlg = ExportDialog(self.iface.mainWindow(), items_display)
-        if dlg.exec_() == QDialog.Accepted:
-            idxs = dlg.selected_indices()
-            if not idxs:
-                self.iface.messageBar().pushMessage(
-                    "Identificar PK", "No se seleccionaron puntos.",
-                    level=Qgis.Info
-                )
-                return
-            sel_items = [items_display[i] for i in idxs]
-            lyr = self._ensure_output_layer()
-            if not lyr:
-                self.iface.messageBar().pushMessage(
-                    "Identificar PK", "No se pudo crear la capa de salida.",
-                    level=Qgis.Warning
-                )
-                return
-
-            # Crear features y añadirlos
-            prov = lyr.dataProvider()
-            feats = []
-            for it in sel_items:
-                f = QgsFeature(lyr.fields())
-                f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(it['map_pt'])))
-                f['VIA'] = it['via']
-                f['PK'] = it['pk_str']
-                feats.append(f)
-
-            prov.addFeatures(feats)
-            lyr.updateExtents()
-            lyr.triggerRepaint()
-            lyr.dataProvider().forceReload()
-            # Exportación silenciosa
-
-    def _ensure_output_layer(self):
-        """Crea o recupera la capa temporal de salida."""
-        name = "Identificacion PKs"
-        prj = QgsProject.instance()
-        for lyr in prj.mapLayers().values():
-            if (isinstance(lyr, QgsVectorLayer)
-                and lyr.name() == name
-                and lyr.geometryType() == QgsWkbTypes.PointGeometry):
-                if {f.name() for f in lyr.fields()} >= {"VIA", "PK"}:
-                    return lyr
+        dlg = HistoryDialog(
+            self.iface.mainWindow(), store, TOOL_IDENTIFY,
+            "Exportar puntos del historial", formato_pk
+        )
+        if dlg.exec_() != QDialog.Accepted:
+            return
+        entries = dlg.selected_entries()
+        if not entries:
+            self.iface.messageBar().pushMessage(
+                "Identificar PK", "No se seleccionaron puntos.",
+                level=Qgis.Info
+            )
+            return
 
-        map_crs = self.canvas.mapSettings().destinationCrs()
-        authid = map_crs.authid() or "EPSG:4326"
-        vl = QgsVectorLayer(f"Point?crs={authid}", name, "memory")
-        prov = vl.dataProvider()
-        prov.addAttributes([
-            QgsField("VIA", QVariant.String),
-            QgsField("PK", QVariant.String)
-        ])
-        vl.updateFields()
-        prj.addMapLayer(vl)
-        return vl
+        dest = ask_destination(self.iface.mainWindow(), "Exportar puntos identificados")
+        if dest is None:
+            return
+        path, append = dest
+        rows = [
+            (e.via, e.pk_km, formato_pk(e.pk_km), e.lat, e.lon, e.fid, e.time)
+            for e in entries
+        ]
+        try:
+            add_to_project(export_points(path, rows, append))
+        except OSError as e:
+            self.iface.messageBar().pushMessage("Identificar PK", str(e), level=Qgis.Warning)
+            return
+        self.iface.messageBar().pushMessage(
+            "Identificar PK", f"Exportados {len(rows)} puntos a {path}.",
+            level=Qgis.Info
+        )
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Caché en disco de los motores de PK.
+
+Guarda los arrays preparados de un PKEngine (coordenadas, M, longitudes
+acumuladas, índice de vías, R-tree de segmentos...) en una carpeta junto al
+proyecto:
+
+    <proyecto>.pkcache/<clave>-<sufijo>/
+        meta.json     huella de la capa + lista de vías (se escribe el último)
+        *.npy         un array por fichero (se abren con memory-map)
+
+En la sesión siguiente se validan contra la huella de la capa (fuente,
+número de features, fecha de modificación del fichero, campo y unidades)
+y, si coinciden, se abren mapeados en memoria en lugar de releer la capa.
+Solo se cachean capas basadas en fichero sin cambios pendientes, y en
+Processing solo cuando se usa la capa entera (ver is_subset_source).
+
+Cada escritura va a una carpeta nueva: la anterior puede seguir abierta
+(memory-map) y en Windows no se puede borrar ni sustituir. Las versiones
+viejas se borran después, cuando se puede, y la caché del perfil (proyectos
+sin guardar) se recorta por antigüedad y tamaño.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+from qgis.core import QgsApplication, QgsProject, QgsProviderRegistry
+
+from .pk_engine import PKEngine
+
+
+CACHE_VERSION = 2
+CACHE_SUFFIX = ".pkcache"
+
+# Caché del perfil: se descarta lo que lleve PROFILE_MAX_AGE segundos sin
+# usarse y, después, lo menos usado hasta bajar de PROFILE_MAX_BYTES
+PROFILE_MAX_AGE = 30 * 24 * 3600
+PROFILE_MAX_BYTES = 2 * 1024 ** 3
+# Carpetas sin meta.json más antiguas que esto: escrituras abandonadas
+STALE_WRITE_AGE = 3600
+
+# base: ruta de la caché sin sufijo de versión; evict: recortar al guardar
+CacheTarget = namedtuple("CacheTarget", "base fingerprint evict")
+
+
+# ---------------------------
+# Ubicación y huella
+# ---------------------------
+def _profile_root():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "pk_tools", "cache")
+
+
+def cache_root():
+    """Carpeta de caché: junto al proyecto o, si no está guardado, en el perfil."""
+    project = QgsProject.instance()
+    if project.fileName():
+        base = os.path.splitext(os.path.basename(project.fileName()))[0]
+        return os.path.join(project.absolutePath(), base + CACHE_SUFFIX)
+    return _profile_root()
+
+
+def _layer_path(layer):
+    """Ruta del fichero de la capa, o None si no es una capa de fichero."""
+    parts = QgsProviderRegistry.instance().decodeUri(
+        layer.dataProvider().name(), layer.source()
+    )
+    path = parts.get("path")
+    return path if path and os.path.isfile(path) else None
+
+
+def layer_fingerprint(layer, id_field, m_units):
+    """Huella que identifica la versión de la capa (None si no se puede cachear)."""
+    if layer.isEditable() and layer.isModified():
+        return None
+    path = _layer_path(layer)
+    if path is None:
+        return None
+    return {
+        "version": CACHE_VERSION,
+        "source": layer.source(),
+        "provider": layer.dataProvider().name(),
+        "feature_count": int(layer.featureCount()),
+        "mtime": os.path.getmtime(path),
+        "size": os.path.getsize(path),
+        "id_field": id_field,
+        "m_units": m_units,
+    }
+
+
+def _cache_key(fingerprint):
+    key = "\n".join((fingerprint["source"], fingerprint["id_field"], fingerprint["m_units"]))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def is_subset_source(definition):
+    """
+    True si ``definition`` (valor del parámetro de Processing, p. ej. un
+    QgsProcessingFeatureSourceDefinition) limita las features de la capa:
+    solo las seleccionadas, un número máximo o una expresión de filtro. La
+    caché es de la capa entera, así que en ese caso no vale.
+    """
+    if getattr(definition, "selectedFeaturesOnly", False):
+        return True
+    limit = getattr(definition, "featureLimit", -1)
+    if limit is not None and limit >= 0:   # -1: sin límite
+        return True
+    return bool(getattr(definition, "filterExpression", ""))
+
+
+def cache_target(layer, id_field, m_units):
+    """
+    Destino de la caché para la capa (CacheTarget), o None si la capa no se
+    puede cachear. Se calcula en el hilo principal, ya que consulta la capa
+    y el proyecto; load_from / save_to se pueden usar después desde una tarea.
+    """
+    fingerprint = layer_fingerprint(layer, id_field, m_units)
+    if fingerprint is None:
+        return None
+    root = cache_root()
+    return CacheTarget(
+        os.path.join(root, _cache_key(fingerprint)), fingerprint, root == _profile_root()
+    )
+
+
+# ---------------------------
+# Versiones y limpieza
+# ---------------------------
+def _versions(base):
+    """
+    Carpetas guardadas para ``base``: [(fecha de meta.json o None, ruta)],
+    las completas primero y de la más reciente a la más antigua.
+    """
+    root, name = os.path.split(base)
+    found = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                # Sin sufijo: carpeta de la versión 1 de la caché
+                if entry.is_dir() and (entry.name == name or entry.name.startswith(name + "-")):
+                    try:
+                        written = os.path.getmtime(os.path.join(entry.path, "meta.json"))
+                    except OSError:
+                        written = None
+                    found.append((written, entry.path))
+    except OSError:
+        return []
+    found.sort(key=lambda item: (item[0] is not None, item[0] or 0.0), reverse=True)
+    return found
+
+
+def _remove(folder):
+    """Borra una versión; devuelve False si no se ha podido (p. ej. abierta en Windows)."""
+    try:
+        # meta.json primero: lo que quede a medias ya no se da por completo
+        os.remove(os.path.join(folder, "meta.json"))
+    except OSError:
+        pass
+    shutil.rmtree(folder, ignore_errors=True)
+    return not os.path.exists(folder)
+
+
+def _is_stale(folder, now):
+    """Escritura abandonada: carpeta sin meta.json y sin tocar desde hace tiempo."""
+    try:
+        return now - os.path.getmtime(folder) > STALE_WRITE_AGE
+    except OSError:
+        return False
+
+
+def _cleanup(base, keep):
+    """Borra las versiones de ``base`` que ``keep`` sustituye (las que se dejen, otra vez será)."""
+    now = time.time()
+    for written, folder in _versions(base):
+        if folder != keep and (written is not None or _is_stale(folder, now)):
+            _remove(folder)
+
+
+def _folder_size(folder):
+    try:
+        with os.scandir(folder) as entries:
+            return sum(e.stat().st_size for e in entries if e.is_file())
+    except OSError:
+        return 0
+
+
+def _evict(root, keep):
+    """
+    Recorta la caché del perfil: fuera las carpetas que llevan
+    PROFILE_MAX_AGE sin usarse y, después, las menos usadas hasta quedar por
+    debajo de PROFILE_MAX_BYTES. La fecha de la carpeta marca su último uso.
+    """
+    now = time.time()
+    folders = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if not entry.is_dir() or entry.path == keep:
+                    continue
+                complete = os.path.isfile(os.path.join(entry.path, "meta.json"))
+                if not complete and not _is_stale(entry.path, now):
+                    continue   # otra escritura en curso
+                try:
+                    used = entry.stat().st_mtime
+                except OSError:
+                    continue
+                folders.append((used, _folder_size(entry.path), entry.path))
+    except OSError:
+        return
+    folders.sort()
+    total = _folder_size(keep) + sum(size for _, size, _ in folders)
+    for used, size, folder in folders:
+        if now - used <= PROFILE_MAX_AGE and total <= PROFILE_MAX_BYTES:
+            break
+        if _remove(folder):
+            total -= size
+
+
+# ---------------------------
+# Lectura / escritura
+# ---------------------------
+def load_engine(layer, id_field, m_units):
+    """Devuelve el motor guardado si la huella coincide, o None."""
+    target = cache_target(layer, id_field, m_units)
+    return None if target is None else load_from(target, m_units)
+
+
+def save_engine(layer, engine, id_field):
+    """Guarda el motor en la caché. Devuelve True si se ha escrito."""
+    target = cache_target(layer, id_field, engine.m_units)
+    return False if target is None else save_to(target, engine)
+
+
+def load_from(target, m_units):
+    """Abre el motor guardado para ``target`` (ver cache_target) si la huella coincide."""
+    for written, folder in _versions(target.base):
+        if written is None:
+            continue
+        engine = _load_folder(folder, target.fingerprint, m_units)
+        if engine is not None:
+            try:
+                os.utime(folder)   # último uso (ver _evict)
+            except OSError:
+                pass
+            return engine
+    return None
+
+
+def _load_folder(folder, fingerprint, m_units):
+    try:
+        with open(os.path.join(folder, "meta.json"), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        if meta.get("fingerprint") != fingerprint:
+            return None
+        arrays = {
+            name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="r")
+            for name in meta["arrays"]
+        }
+        return PKEngine.from_arrays(arrays, meta["roads"], meta["road_keys"], m_units)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_to(target, engine):
+    """Guarda el motor para ``target`` (ver cache_target). Devuelve True si se ha escrito."""
+    arrays, roads, road_keys = engine.to_arrays()
+    root, key = os.path.split(target.base)
+    folder = None
+    try:
+        os.makedirs(root, exist_ok=True)
+        # Carpeta nueva en cada escritura: la anterior puede estar abierta
+        folder = tempfile.mkdtemp(prefix=key + "-", dir=root)
+        for name, arr in arrays.items():
+            np.save(os.path.join(folder, name + ".npy"), np.asarray(arr))
+        meta = {
+            "fingerprint": target.fingerprint,
+            "arrays": sorted(arrays),
+            "roads": roads,
+            "road_keys": road_keys,
+        }
+        # meta.json al final: marca la carpeta como completa
+        with open(os.path.join(folder, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+    except (OSError, TypeError, ValueError):
+        # TypeError: identificadores de vía no serializables en JSON
+        if folder is not None:
+            _remove(folder)
+        return False
+
+    _cleanup(target.base, folder)
+    if target.evict:
+        _evict(root, folder)
+    return True
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de índices por capa, compartido por todas las herramientas.
+
+Los motores de PK (PKEngine) de cada capa, con su R-tree de segmentos, se
+construyen una sola vez y se reutilizan al cambiar de herramienta. Los clics
+se resuelven sobre ese R-tree, sin índice espacial de QGIS ni peticiones de
+geometría al proveedor. Cada entrada escucha las señales de su capa y:
+  - altas, bajas y cambios
+    de geometría:           marca esas features como pendientes en los motores
+  - cambios del campo de
+    vía:                    igual, solo en los motores de ese campo; los
+                            cambios de otros atributos se ignoran
+  - altas, bajas y cambios
+    del campo de vía:       descarta el catálogo de vías de ese campo
+  - guardar / deshacer la
+    edición, dataSourceChanged: descarta todo
+Las features pendientes se releen al usar el motor (PKEngine.patched): el
+resto de la red se copia del motor anterior sin volver a leer la capa. Si
+son muchas, se descarta el motor y se reconstruye entero.
+El registro se vacía al limpiar el proyecto o al eliminar la capa.
+
+Los motores se buscan primero en la caché en disco (index_cache) y, si hay
+que construirlos, se guardan allí para la sesión siguiente.
+
+Las herramientas preparan la capa con prepare(), que lanza la construcción
+como una QgsTask cancelable (con progreso en el gestor de tareas) en lugar de
+bloquear la interfaz; al terminar se avisa a quien la haya pedido. La misma
+tarea calcula, si se piden, las longitudes en metros de un CRS + elipsoide
+(ver PKEngine.metric_lengths), que se fijan en el motor ya en el hilo
+principal.
+"""
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import QgsApplication, QgsProject, QgsTask, QgsVectorLayerFeatureSource
+
+from .pk_engine import PKEngine
+from . import index_cache
+
+
+# Fracción de features pendientes a partir de la que se reconstruye el motor
+# entero en lugar de releer solo las editadas
+PATCH_LIMIT = 0.25
+
+
+class _LayerEntry:
+    """Índices cacheados de una capa y conexión a sus señales."""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.engines = {}   # (id_field, m_units) → PKEngine
+        self.dirty = {}     # (id_field, m_units) → fids editados que hay que releer
+        self.tasks = {}     # (id_field, m_units) → _PrepareTask en curso
+        self.road_names = {}  # id_field → catálogo de vías (texto, ordenado)
+        self.generation = 0  # cambia en cada invalidación
+        self._connections = [
+            (layer.featureAdded, self._on_feature_added),
+            (layer.featureDeleted, self._on_feature_deleted),
+            (layer.geometryChanged, self._on_geometry_invalidated),
+            (layer.attributeValueChanged, self._on_attributes_changed),
+            (layer.afterCommitChanges, self.invalidate),
+            (layer.afterRollBack, self.invalidate),
+            (layer.dataSourceChanged, self.invalidate),
+        ]
+        for signal, slot in self._connections:
+            signal.connect(slot)
+
+    def disconnect(self):
+        for signal, slot in self._connections:
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+        self._connections = []
+
+    # ---------- Invalidación ----------
+    def invalidate(self, *args):
+        self.road_names.clear()
+        self._drop_engines()
+
+    def _drop_engines(self):
+        # Las tareas en curso leen una versión anterior de la capa: sus
+        # resultados se descartan al terminar (ver IndexRegistry._on_task_finished)
+        self.engines.clear()
+        self.dirty.clear()
+        self.generation += 1
+
+    def _mark_dirty(self, fid, id_field=None):
+        """Marca ``fid`` como pendiente en los motores (de ``id_field``, si se indica)."""
+        for key, engine in list(self.engines.items()):
+            if id_field is not None and key[0] != id_field:
+                continue
+            fids = self.dirty.setdefault(key, set())
+            fids.add(fid)
+            if len(fids) > PATCH_LIMIT * max(engine.feature_count, 1):
+                del self.engines[key]
+                del self.dirty[key]
+        self.generation += 1
+
+    def cancel_tasks(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+    def _on_feature_added(self, fid):
+        self.road_names.clear()
+        self._mark_dirty(fid)
+
+    def _on_feature_deleted(self, fid):
+        self.road_names.clear()
+        self._mark_dirty(fid)
+
+    def _on_geometry_invalidated(self, fid, *args):
+        self._mark_dirty(fid)
+
+    def _on_attributes_changed(self, fid, idx, value):
+        # Solo importa el campo de vía: los motores no guardan otros atributos
+        fields = self.layer.fields()
+        if not 0 <= idx < fields.count():
+            return
+        name = fields.at(idx).name()
+        if name not in {key[0] for key in self.engines} | set(self.road_names):
+            return
+        self.road_names.pop(name, None)
+        self._mark_dirty(fid, name)
+
+
+class _PrepareTask(QgsTask):
+    """
+    Construye en segundo plano el motor de PK y su R-tree de segmentos (o
+    reutiliza ``engine``, ya construido, releyendo solo las features
+    ``patch``) y, con ``metric`` (MetricSpec), sus longitudes en metros.
+    """
+
+    def __init__(self, layer, id_field, m_units, generation, engine=None, metric=None,
+                 patch=None):
+        super().__init__(f"PK Tools: indexando '{layer.name()}'", QgsTask.CanCancel)
+        self.layer_id = layer.id()
+        self.key = (id_field, m_units)
+        self.generation = generation
+        self.callbacks = []
+        self.on_finished = None
+        self.engine = engine
+        self.metric = metric
+        self.metric_cum = None
+        self.patch = set(patch or ())
+        # Todo lo que consulta la capa o el proyecto se captura aquí (hilo principal)
+        if engine is None or self.patch:
+            self._source = QgsVectorLayerFeatureSource(layer)
+            self._fields = layer.fields()
+        if engine is None:
+            self._total = layer.featureCount()
+            self._cache = index_cache.cache_target(layer, id_field, m_units)
+
+    def run(self):
+        if self.engine is None:
+            self.engine = self._build()
+            if self.engine is None or self.isCanceled():
+                return False
+        elif self.patch:
+            self.engine = self.engine.patched(self._source, self._fields, self.patch, self.key[0])
+            self.engine.segment_tree()
+            if self.isCanceled():
+                return False
+        if self.metric is not None:
+            # Solo se calcula: el motor puede estar en uso en el hilo principal
+            self.metric_cum = self.engine.metric_lengths(self.metric)
+        return not self.isCanceled()
+
+    def _build(self):
+        id_field, m_units = self.key
+        engine = None
+        if self._cache is not None:
+            engine = index_cache.load_from(self._cache, m_units)
+        if engine is None:
+            engine = PKEngine.from_source(
+                self._source, self._fields, self._total, id_field, m_units, feedback=self
+            )
+            if engine is None or self.isCanceled():
+                return None
+            if self._cache is not None:
+                index_cache.save_to(self._cache, engine)
+        engine.segment_tree()
+        return engine
+
+    def finished(self, result):
+        if self.on_finished is not None:
+            self.on_finished(self, result)
+
+
+class IndexRegistry:
+    """Índices por id de capa, válidos mientras dure el proyecto."""
+
+    def __init__(self, project=None):
+        self.project = project or QgsProject.instance()
+        self._entries = {}
+        self.project.cleared.connect(self.clear)
+        self.project.layersWillBeRemoved.connect(self._on_layers_removed)
+
+    def _entry(self, layer):
+        entry = self._entries.get(layer.id())
+        if entry is None:
+            entry = _LayerEntry(layer)
+            self._entries[layer.id()] = entry
+        return entry
+
+    def engine(self, layer, id_field, m_units="m"):
+        """Motor de PK de la capa para el campo y unidades indicados."""
+        entry = self._entry(layer)
+        key = (id_field, m_units)
+        engine = entry.engines.get(key)
+        if engine is None:
+            engine = index_cache.load_engine(layer, id_field, m_units)
+            if engine is None:
+                engine = PKEngine.from_layer(layer, id_field, m_units)
+                index_cache.save_engine(layer, engine, id_field)
+            entry.engines[key] = engine
+        elif entry.dirty.get(key):
+            engine = engine.patched(layer, layer.fields(), entry.dirty.pop(key), id_field)
+            entry.engines[key] = engine
+        return engine
+
+    def road_catalogue(self, layer, id_field):
+        """
+        Identificadores de vía de la capa como texto, ordenados sin distinguir
+        mayúsculas. Se leen con uniqueValues (solo el campo, sin geometría; el
+        proveedor lo resuelve con un SELECT DISTINCT cuando puede) y se
+        cachean hasta la siguiente edición de la capa.
+        """
+        entry = self._entry(layer)
+        names = entry.road_names.get(id_field)
+        if names is None:
+            idx = layer.fields().indexOf(id_field)
+            values = layer.uniqueValues(idx) if idx != -1 else set()
+            names = sorted(
+                {
+                    str(v) for v in values
+                    if v is not None and not (isinstance(v, QVariant) and v.isNull())
+                } - {""},
+                key=str.casefold
+            )
+            entry.road_names[id_field] = names
+        return names
+
+    # ---------- Preparación en segundo plano ----------
+    def prepare(self, layer, id_field, m_units="m", on_ready=None, metric=None):
+        """
+        Prepara el motor de la capa (y su R-tree de segmentos) en una QgsTask;
+        con ``metric`` (ver pk_engine.metric_spec), también sus longitudes en
+        metros para ese CRS + elipsoide.
+
+        Devuelve True si ya estaban listos. Si no, lanza la tarea (o reutiliza
+        la que esté en curso) y devuelve False; ``on_ready(ok)`` se llama en el
+        hilo principal cuando termina. Si la tarea en curso no calcula esas
+        longitudes, al terminar hay que volver a llamar a prepare.
+        """
+        entry = self._entry(layer)
+        key = (id_field, m_units)
+        engine = entry.engines.get(key)
+        patch = entry.dirty.get(key)
+        if (engine is not None and not patch
+                and (metric is None or engine.metric_key == metric.key)):
+            return True
+        task = entry.tasks.get(key)
+        if task is None:
+            task = _PrepareTask(layer, id_field, m_units, entry.generation, engine, metric, patch)
+            task.on_finished = self._on_task_finished
+            entry.tasks[key] = task
+            QgsApplication.taskManager().addTask(task)
+        if on_ready is not None and on_ready not in task.callbacks:
+            task.callbacks.append(on_ready)
+        return False
+
+    def pending_task(self, layer, id_field, m_units="m"):
+        """Tarea de preparación en curso para la capa, o None."""
+        entry = self._entries.get(layer.id())
+        return None if entry is None else entry.tasks.get((id_field, m_units))
+
+    def _on_task_finished(self, task, ok):
+        entry = self._entries.get(task.layer_id)
+        if entry is None or entry.tasks.get(task.key) is not task:
+            ok = False
+        else:
+            del entry.tasks[task.key]
+            # Si la capa ha cambiado durante la construcción, el resultado no vale
+            ok = ok and task.generation == entry.generation
+            if ok:
+                if task.metric_cum is not None:
+                    task.engine.set_metric_cum(task.metric_cum, task.metric.key)
+                entry.engines[task.key] = task.engine
+                entry.dirty.pop(task.key, None)
+        for callback in task.callbacks:
+            callback(ok)
+
+    def invalidate(self, layer_id):
+        entry = self._entries.get(layer_id)
+        if entry is not None:
+            entry.invalidate()
+
+    def clear(self):
+        for entry in self._entries.values():
+            entry.cancel_tasks()
+            entry.disconnect()
+        self._entries = {}
+
+    def release(self):
+        """Desconecta el registro del proyecto (al descargar el plugin)."""
+        self.clear()
+        for signal, slot in (
+            (self.project.cleared, self.clear),
+            (self.project.layersWillBeRemoved, self._on_layers_removed),
+        ):
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass
+
+    def _on_layers_removed(self, layer_ids):
+        for layer_id in layer_ids:
+            entry = self._entries.pop(layer_id, None)
+            if entry is not None:
+                entry.cancel_tasks()
+                entry.disconnect()
+
+
+_registry = None
+
+
+def index_registry():
+    """Devuelve el registro compartido (se crea la primera vez)."""
+    global _registry
+    if _registry is None:
+        _registry = IndexRegistry()
+    return _registry
+
+
+def release_index_registry():
+    """Libera el registro compartido y sus conexiones."""
+    global _registry
+    if _registry is not None:
+        _registry.release()
+        _registry = None
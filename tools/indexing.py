@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Estado "Indexando…" de las herramientas.
+
+Mientras la capa de trabajo se prepara en segundo plano (ver
+IndexRegistry.prepare) la herramienta muestra un mensaje con barra de
+progreso en lugar de congelar el mapa; al terminar se retira el mensaje y se
+ejecuta la acción pendiente (p. ej. abrir el diálogo de Localizar PK). Con
+varias capas configuradas (ver federation) se espera a todas ellas y al
+índice común.
+"""
+
+from qgis.PyQt.QtWidgets import QProgressBar
+from qgis.core import Qgis
+
+from .index_registry import index_registry
+
+
+class IndexingStatus:
+    """Mensaje de indexación de una herramienta y acciones pendientes."""
+
+    def __init__(self, iface, title):
+        self.iface = iface
+        self.title = title
+        self._msg = None
+        self._bar = None
+        self._pending = []
+        self._network = None   # red que se sigue preparando al terminar cada paso
+
+    def ensure_ready(self, layer, id_field, m_units, on_ready=None, metric=None):
+        """
+        Devuelve True si la capa ya está preparada (con ``metric``, también
+        sus longitudes en metros). Si no, lanza la preparación, muestra el
+        estado "Indexando…" y devuelve False; ``on_ready()`` se ejecutará
+        cuando la capa esté lista.
+        """
+        registry = index_registry()
+        if registry.prepare(layer, id_field, m_units, self._on_finished, metric):
+            return True
+        if on_ready is not None and on_ready not in self._pending:
+            self._pending.append(on_ready)
+        if self._msg is None:
+            self._show(f"Indexando la capa '{layer.name()}'…",
+                       registry.pending_task(layer, id_field, m_units))
+        return False
+
+    def ensure_network_ready(self, network, on_ready=None):
+        """
+        Igual que ensure_ready para una FederatedNetwork: todas sus capas
+        (se preparan a la vez) y, después, el índice común.
+        """
+        ready = [
+            self.ensure_ready(m.layer, m.id_field, m.m_units, on_ready, network.metric_spec(k))
+            for k, m in enumerate(network.members)
+        ]
+        if not all(ready):
+            self._network = network
+            return False
+        if network.prepare(self._on_finished):
+            return True
+        self._network = network
+        if on_ready is not None and on_ready not in self._pending:
+            self._pending.append(on_ready)
+        if self._msg is None:
+            self._show(f"Indexando la red de {len(network.members)} capas…",
+                       network.pending_task())
+        return False
+
+    def clear(self):
+        """Retira el mensaje y olvida las acciones pendientes."""
+        self._pending = []
+        self._network = None
+        self._pop()
+
+    # ---------- Mensaje ----------
+    def _show(self, text, task):
+        widget = self.iface.messageBar().createMessage(self.title, text)
+        self._bar = QProgressBar()
+        self._bar.setRange(0, 100)
+        widget.layout().addWidget(self._bar)
+        if task is not None:
+            task.progressChanged.connect(self._on_progress)
+        self._msg = self.iface.messageBar().pushWidget(widget, Qgis.Info)
+
+    def _on_progress(self, value):
+        try:
+            if self._bar is not None:
+                self._bar.setValue(int(value))
+        except RuntimeError:
+            # El usuario ha cerrado el mensaje
+            self._bar = None
+
+    def _pop(self):
+        if self._msg is not None:
+            try:
+                self.iface.messageBar().popWidget(self._msg)
+            except RuntimeError:
+                pass
+        self._msg = None
+        self._bar = None
+
+    def _on_finished(self, ok):
+        pending, self._pending = self._pending, []
+        network, self._network = self._network, None
+        self._pop()
+        if not ok:
+            self.iface.messageBar().pushMessage(
+                self.title,
+                "No se ha completado la indexación de la capa (cancelada o "
+                "modificada mientras se preparaba). Vuelve a intentarlo.",
+                level=Qgis.Warning
+            )
+            return
+        for action in pending:
+            action()
+        # Sin acción pendiente que lo haga, se sigue con el resto de la red
+        # (otras capas o el índice común)
+        if network is not None and self._network is None and self._msg is None:
+            self.ensure_network_ready(network)
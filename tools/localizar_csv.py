@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Localizar PK desde CSV muy grandes, en streaming.
+
+Para tablas de decenas de millones de filas (vía, PK) no se carga el CSV
+como capa ni se construye una capa en memoria: el fichero se lee por bloques
+con el módulo csv, cada bloque se localiza con PKEngine.locate_many y se
+escribe directamente a GeoPackage o FlatGeobuf (tools/file_writer.py). La
+memoria usada depende del tamaño de bloque, no del número de filas.
+
+Salida: columnas del CSV (texto) + PK_KM + ESTADO, como en Localizar PK por
+lotes; las filas no encontradas se escriben sin geometría. Si la lectura
+falla a mitad o se cancela, se borra la salida incompleta.
+
+Codificación: la indicada o, por defecto, detectada con el primer bloque del
+fichero: UTF-8 (con o sin BOM) si es válido y, si no, Windows-1252. En UTF-8
+detectado, los bytes sueltos que no lo sean más adelante se leen como
+Windows-1252 en lugar de cortar la lectura.
+"""
+
+import codecs
+import csv
+import io
+import os
+
+import numpy as np
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import QgsFeature, QgsField, QgsFields, QgsGeometry, QgsPointXY, QgsWkbTypes
+
+from .pk_engine import STATUS_FOUND
+from .localizar_lote import STATUS_LABELS, parse_pk, road_lookup
+from .file_writer import create_writer, unique_name
+
+
+CHUNK = 50000   # filas por bloque
+
+# Separadores que se prueban al leer la cabecera
+DELIMITERS = ",;\t|"
+
+# Codificaciones que se ofrecen (None: detectar)
+ENCODINGS = [None, "utf-8-sig", "cp1252", "latin-1"]
+ENCODING_LABELS = ["Detectar", "UTF-8", "Windows-1252", "ISO-8859-1"]
+
+SNIFF_BYTES = 1 << 20   # bytes leídos para detectar la codificación
+CP1252_FALLBACK = "pk_tools.cp1252"
+
+
+def _cp1252_fallback(error):
+    """Bytes que no son UTF-8: se leen como Windows-1252."""
+    bad = error.object[error.start:error.end]
+    return bad.decode("cp1252", errors="replace"), error.end
+
+
+codecs.register_error(CP1252_FALLBACK, _cp1252_fallback)
+
+
+def detect_encoding(path, encoding=None):
+    """
+    (codificación, errors) para abrir el CSV: la indicada, estricta, o la
+    detectada con los primeros SNIFF_BYTES (ver cabecera del módulo).
+    """
+    if encoding:
+        return encoding, "strict"
+    with open(path, "rb") as f:
+        sample = f.read(SNIFF_BYTES)
+    try:
+        # Incremental: un carácter cortado al final del bloque no cuenta
+        codecs.getincrementaldecoder("utf-8-sig")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return "cp1252", "replace"
+    return "utf-8-sig", CP1252_FALLBACK
+
+
+def sniff_delimiter(line):
+    """Separador más frecuente de la cabecera entre los habituales (',' por defecto)."""
+    counts = [(line.count(d), d) for d in DELIMITERS]
+    best = max(counts)
+    return best[1] if best[0] else ","
+
+
+def read_header(path, delimiter=None, encoding=None):
+    """Devuelve (columnas, separador) de la primera línea del CSV."""
+    encoding, errors = detect_encoding(path, encoding)
+    with open(path, encoding=encoding, errors=errors, newline="") as f:
+        line = f.readline()
+    delimiter = delimiter or sniff_delimiter(line)
+    header = next(csv.reader([line], delimiter=delimiter), [])
+    return [name.strip() for name in header], delimiter
+
+
+def iter_csv_chunks(path, road_col, pk_col, delimiter=None, chunk=CHUNK, encoding=None):
+    """
+    Lee el CSV por bloques. Genera (filas, vías, PK en km, fracción leída),
+    con los PK no válidos como NaN. Las filas más cortas que la cabecera se
+    completan con None. Con una codificación explícita que no corresponda
+    al fichero, lanza UnicodeDecodeError al llegar al primer byte inválido.
+    """
+    header, delimiter = read_header(path, delimiter, encoding)
+    encoding, errors = detect_encoding(path, encoding)
+    try:
+        road_i, pk_i = header.index(road_col), header.index(pk_col)
+    except ValueError:
+        raise ValueError(f"El CSV no tiene las columnas '{road_col}' y '{pk_col}'.") from None
+    ncols = len(header)
+    size = max(os.path.getsize(path), 1)
+
+    with open(path, "rb") as raw:
+        text = io.TextIOWrapper(raw, encoding=encoding, errors=errors, newline="")
+        reader = csv.reader(text, delimiter=delimiter)
+        next(reader, None)
+        rows, roads, pks = [], [], []
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != ncols:
+                row = (row + [None] * ncols)[:ncols]
+            rows.append(row)
+            roads.append(row[road_i])
+            pk = parse_pk(row[pk_i])
+            pks.append(np.nan if pk is None else pk)
+            if len(rows) >= chunk:
+                yield rows, roads, np.asarray(pks, dtype=np.float64), raw.tell() / size
+                rows, roads, pks = [], [], []
+        if rows:
+            yield rows, roads, np.asarray(pks, dtype=np.float64), 1.0
+
+
+def locate_csv(engine, path, road_col, pk_col, dest_path, crs, transform_context=None,
+               delimiter=None, chunk=CHUNK, feedback=None, encoding=None):
+    """
+    Localiza todas las filas del CSV ``path`` y las escribe en ``dest_path``
+    (.gpkg o .fgb) en el CRS de la capa calibrada ``crs``.
+
+    ``feedback`` (QgsFeedback...) es opcional: progreso y cancelación.
+    ``encoding``: codificación del CSV (None: detectar, ver detect_encoding).
+    Devuelve un dict estado → filas, o None si se cancela. Si se cancela o
+    algo falla, borra ``dest_path`` (y los ficheros auxiliares de
+    GeoPackage) y, en caso de error, lo relanza.
+    """
+    header, delimiter = read_header(path, delimiter, encoding)
+    fields = QgsFields()
+    for name in header:
+        fields.append(QgsField(unique_name(fields, name or "campo"), QVariant.String))
+    fields.append(QgsField(unique_name(fields, "PK_KM"), QVariant.Double))
+    fields.append(QgsField(unique_name(fields, "ESTADO"), QVariant.String))
+
+    lookup = road_lookup(engine)
+    counts = np.zeros(len(STATUS_LABELS), dtype=np.int64)
+    writer = create_writer(dest_path, fields, QgsWkbTypes.Point, crs, transform_context)
+    complete = False
+    try:
+        for rows, roads, pks, done in iter_csv_chunks(path, road_col, pk_col, delimiter, chunk,
+                                                      encoding):
+            if feedback is not None and feedback.isCanceled():
+                return None
+            res = engine.locate_many([lookup.get(r, r) for r in roads], pks)
+            status = res.status
+            found = status == STATUS_FOUND
+            xs, ys = res.x.tolist(), res.y.tolist()
+            feats = []
+            for i, row in enumerate(rows):
+                f = QgsFeature(fields)
+                pk = pks[i]
+                f.setAttributes(row + [None if pk != pk else float(pk),
+                                       STATUS_LABELS[int(status[i])]])
+                if found[i]:
+                    f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xs[i], ys[i])))
+                feats.append(f)
+            writer.addFeatures(feats)
+            counts += np.bincount(status, minlength=len(STATUS_LABELS))
+            if feedback is not None:
+                feedback.setProgress(100.0 * done)
+        if feedback is not None and feedback.isCanceled():
+            return None
+        complete = True
+    finally:
+        writer.flushBuffer()
+        del writer
+        if not complete:
+            # No se deja un fichero a medias que parezca un resultado
+            for name in (dest_path, dest_path + "-wal", dest_path + "-shm"):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+    return {STATUS_LABELS[k]: int(counts[k]) for k in STATUS_LABELS}
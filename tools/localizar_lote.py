@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Localizar PK por lotes.
+
+Toma una tabla (capa con o sin geometría, p. ej. un CSV) con una columna de
+vía y otra de PK y genera una capa de puntos con todas las filas, su punto
+localizado y una columna de estado:
+  - ENCONTRADO
+  - FUERA DE RANGO
+  - VIA DESCONOCIDA
+Las filas no encontradas se conservan sin geometría para poder revisarlas.
+"""
+
+import re
+
+import numpy as np
+from qgis.PyQt.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QDialogButtonBox
+)
+from qgis.PyQt.QtCore import Qt, QVariant
+from qgis.core import (
+    QgsProject, QgsVectorLayer, QgsFeature, QgsFeatureRequest, QgsField,
+    QgsFields, QgsGeometry, QgsPointXY
+)
+
+from .pk_engine import STATUS_FOUND, STATUS_OUT_OF_RANGE, STATUS_UNKNOWN_ROAD
+from .file_writer import unique_name
+
+
+STATUS_LABELS = {
+    STATUS_FOUND: "ENCONTRADO",
+    STATUS_OUT_OF_RANGE: "FUERA DE RANGO",
+    STATUS_UNKNOWN_ROAD: "VIA DESCONOCIDA",
+}
+
+_PK_TEXT = re.compile(r"^\s*(-?\d+)\s*\+\s*(\d+(?:[.,]\d*)?)\s*$")
+
+
+def parse_pk(value):
+    """
+    Convierte un PK a km. Acepta números (km) y textos 'km+mmm'
+    (p. ej. '123+450' → 123.45). Devuelve None si no es válido.
+    """
+    if value is None or (isinstance(value, QVariant) and value.isNull()):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    match = _PK_TEXT.match(text)
+    if match:
+        km = int(match.group(1))
+        m = float(match.group(2).replace(",", "."))
+        return km - m / 1000.0 if text.startswith("-") else km + m / 1000.0
+    try:
+        return float(text.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def road_lookup(engine):
+    """Permite casar identificadores de vía aunque la tabla los lea como texto."""
+    return {str(k): k for k in engine.road_keys if k is not None}
+
+
+def locate_table(engine, table, road_field, pk_field, crs, name="Localización PK (lote)"):
+    """
+    Localiza todas las filas de ``table``. Devuelve (capa, recuento), donde
+    capa es una capa de puntos en memoria (CRS de la capa calibrada) con los
+    atributos originales más PK_KM y ESTADO, y recuento un dict estado → filas.
+    """
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+    lookup = road_lookup(engine)
+
+    rows, roads, pks = [], [], []
+    for feat in table.getFeatures(request):
+        attrs = feat.attributes()
+        via = feat[road_field]
+        via = lookup.get(str(via), via)
+        pk = parse_pk(feat[pk_field])
+        rows.append(attrs)
+        roads.append(via)
+        pks.append(float("nan") if pk is None else pk)
+
+    res = engine.locate_many(roads, pks)
+    status = res.status
+
+    # Capa de salida: campos de la tabla + PK_KM + ESTADO
+    fields = QgsFields(table.fields())
+    pk_name = unique_name(fields, "PK_KM")
+    fields.append(QgsField(pk_name, QVariant.Double))
+    st_name = unique_name(fields, "ESTADO")
+    fields.append(QgsField(st_name, QVariant.String))
+
+    out = QgsVectorLayer("Point", name, "memory")
+    out.setCrs(crs)
+    prov = out.dataProvider()
+    prov.addAttributes(fields.toList())
+    out.updateFields()
+
+    feats = []
+    for i, attrs in enumerate(rows):
+        f = QgsFeature(out.fields())
+        pk = pks[i]
+        f.setAttributes(attrs + [None if pk != pk else pk, STATUS_LABELS[int(status[i])]])
+        if status[i] == STATUS_FOUND:
+            f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(float(res.x[i]), float(res.y[i]))))
+        feats.append(f)
+
+    prov.addFeatures(feats)
+    out.updateExtents()
+
+    counts = np.bincount(status, minlength=len(STATUS_LABELS))
+    return out, {STATUS_LABELS[k]: int(counts[k]) for k in STATUS_LABELS}
+
+
+class LocalizarLoteDialog(QDialog):
+    """Diálogo para elegir la tabla y las columnas de vía y PK."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Localizar PK por lote")
+        self.setMinimumWidth(380)
+
+        self._layers = [
+            lyr for lyr in QgsProject.instance().mapLayers().values()
+            if isinstance(lyr, QgsVectorLayer)
+        ]
+
+        layout = QVBoxLayout(self)
+
+        row_layer = QHBoxLayout()
+        row_layer.addWidget(QLabel("Tabla de entrada:"))
+        self.cbo_layer = QComboBox()
+        for lyr in self._layers:
+            self.cbo_layer.addItem(lyr.name())
+        self.cbo_layer.currentIndexChanged.connect(self._on_layer_changed)
+        row_layer.addWidget(self.cbo_layer)
+        layout.addLayout(row_layer)
+
+        row_road = QHBoxLayout()
+        row_road.addWidget(QLabel("Campo de vía:"))
+        self.cbo_road = QComboBox()
+        row_road.addWidget(self.cbo_road)
+        layout.addLayout(row_road)
+
+        row_pk = QHBoxLayout()
+        row_pk.addWidget(QLabel("Campo de PK (km o 'km+mmm'):"))
+        self.cbo_pk = QComboBox()
+        row_pk.addWidget(self.cbo_pk)
+        layout.addLayout(row_pk)
+
+        btns = QDialogButtonBox(
+            QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
+            orientation=Qt.Horizontal,
+            parent=self
+        )
+        btns.accepted.connect(self.accept)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+
+        self._on_layer_changed(self.cbo_layer.currentIndex())
+
+    def _on_layer_changed(self, idx):
+        self.cbo_road.clear()
+        self.cbo_pk.clear()
+        if idx < 0 or idx >= len(self._layers):
+            return
+        names = [fld.name() for fld in self._layers[idx].fields()]
+        self.cbo_road.addItems(names)
+        self.cbo_pk.addItems(names)
+        for i, name in enumerate(names):
+            if name.upper() in ("ID_ROAD", "VIA", "CARRETERA"):
+                self.cbo_road.setCurrentIndex(i)
+            if name.upper() in ("PK", "PK_KM"):
+                self.cbo_pk.setCurrentIndex(i)
+
+    def selected_layer(self):
+        idx = self.cbo_layer.currentIndex()
+        if idx < 0 or idx >= len(self._layers):
+            return None
+        return self._layers[idx]
+
+    def selected_road_field(self):
+        return self.cbo_road.currentText()
+
+    def selected_pk_field(self):
+        return self.cbo_pk.currentText()
@@ -2,21 +2,23 @@
 from qgis.PyQt.QtGui import QIcon, QColor
 from qgis.PyQt.QtWidgets import (
     QAction, QDialog, QVBoxLayout, QHBoxLayout, QLabel,
-    QLineEdit, QCompleter, QPushButton, QMenu, QApplication,
-    QListWidget, QListWidgetItem, QDialogButtonBox
+    QLineEdit, QCompleter, QPushButton, QMenu, QApplication
 )
-from qgis.PyQt.QtCore import QMimeData, QVariant
+from qgis.PyQt.QtCore import Qt, QMimeData, QStringListModel
 from qgis.gui import QgsVertexMarker
 from qgis.core import (
-    QgsPointXY, QgsCoordinateTransform, QgsProject, QgsCoordinateReferenceSystem,
-    QgsWkbTypes, QgsVectorLayer, QgsFields, QgsField, QgsFeature, QgsGeometry,
+    QgsPointXY, QgsProject,
     Qgis
 )
-from ..settings import read_current_settings
-
-# Campo por defecto histórico (fallback)
-EXPECTED_FIELD = "ID_ROAD"
-
+from .federation import NetworkConfigError, configured_network
+from .index_registry import index_registry
+from .indexing import IndexingStatus
+from .profiling import profiler
+from .transforms import transforms
+from .history_export import add_to_project, ask_destination, export_points
+from .history_dialog import HistoryDialog
+from .history_store import TOOL_LOCATE, history_store
+from .localizar_lote import LocalizarLoteDialog, locate_table
 
 def formato_pk(pk_total):
     km = int(pk_total)
@@ -25,16 +27,18 @@ def formato_pk(pk_total):
 
 
 class LocalizarPK:
+    MENU_HISTORY = 15   # consultas recientes que se muestran en el menú
+
     def __init__(self, iface):
         self.iface = iface
         self.canvas = iface.mapCanvas()
         self.action = None
         self.history_menu = None
-        self.history = []   # [(via, pk_km, map_pt)]
         self.markers = []   # [QgsVertexMarker, QgsVertexMarker]
-        self.layer = None
-        self.id_field = EXPECTED_FIELD
-        self.m_units = "m"   # "m" (por defecto) o "km"
+        self.network = None   # FederatedNetwork de la configuración
+        self.indexing = IndexingStatus(iface, "Localizar PK")
+        self._road_model = None         # modelo del completer de vías
+        self._road_model_names = None   # catálogo con el que se construyó
 
     def create_action(self):
         icon = QIcon(":/plugins/pk_tools/icons/localizar.png")
@@ -42,6 +46,7 @@ class LocalizarPK:
         self.action.setToolTip("Localizar punto según PK en vía calibrada")
         self.history_menu = QMenu(self.iface.mainWindow())
         self.history_menu.setTitle("Historial")
+        self.history_menu.aboutToShow.connect(self._update_history_menu)
         self.action.setMenu(self.history_menu)
         self.action.triggered.connect(self.run)
         self._update_history_menu()
@@ -55,80 +60,32 @@ class LocalizarPK:
         self.action.setToolTip("Localizar punto según PK en vía calibrada")
         self.history_menu = QMenu(self.iface.mainWindow())
         self.history_menu.setTitle("Historial")
+        self.history_menu.aboutToShow.connect(self._update_history_menu)
         self.action.setMenu(self.history_menu)
         self.action.triggered.connect(self.open_dialog)
         self.iface.addToolBarIcon(self.action)
         self._update_history_menu()
 
     def unload(self):
+        self.indexing.clear()
         if self.action:
             self.iface.removeToolBarIcon(self.action)
 
     # ---------------------------------------------------
     # Apertura del diálogo principal
     # ---------------------------------------------------
-    def open_dialog(self):
+    def _prepare_layer(self):
         """
-        Abre el diálogo de localización usando la capa/campo/unidades definidos en settings.
+        Valida las capas/campos/unidades definidos en settings y guarda la red
+        en la instancia. Devuelve True si la configuración es válida.
         """
         try:
-            cfg = read_current_settings()
-            layer_name = cfg.get("layer_name") or ""
-            id_field = cfg.get("id_field") or EXPECTED_FIELD
-            m_units = cfg.get("m_units") or "m"
-
-            if not layer_name:
-                self.iface.messageBar().pushMessage(
-                    "Localizar PK",
-                    "No hay capa de trabajo configurada. Abre 'Configuración PK Tools' para definirla.",
-                    level=Qgis.Info
-                )
-                return
-
-            # Buscar capa por nombre
-            layer = None
-            for lyr in QgsProject.instance().mapLayers().values():
-                if isinstance(lyr, QgsVectorLayer) and lyr.name() == layer_name:
-                    layer = lyr
-                    break
+            self.network = configured_network()
+            return True
 
-            if not layer:
-                self.iface.messageBar().pushMessage(
-                    "Localizar PK",
-                    f"No se ha encontrado la capa '{layer_name}'. Revisa la configuración de PK Tools.",
-                    level=Qgis.Warning
-                )
-                return
-
-            # Validar geometría lineal con M y campo identificador
-            if layer.geometryType() != QgsWkbTypes.LineGeometry:
-                self.iface.messageBar().pushMessage(
-                    "Localizar PK",
-                    f"La capa '{layer_name}' no es lineal.",
-                    level=Qgis.Warning
-                )
-                return
-
-            if not QgsWkbTypes.hasM(layer.wkbType()):
-                self.iface.messageBar().pushMessage(
-                    "Localizar PK",
-                    f"La capa '{layer_name}' no tiene geometría M.",
-                    level=Qgis.Warning
-                )
-                return
-
-            if layer.fields().indexOf(id_field) == -1:
-                self.iface.messageBar().pushMessage(
-                    "Localizar PK",
-                    f"La capa '{layer_name}' no tiene el campo '{id_field}'.",
-                    level=Qgis.Warning
-                )
-                return
-
-            # Guardar en la instancia
-            self.layer = layer
-            self.id_field = id_field
-            self.m_units = m_units
+        except NetworkConfigError as e:
+            self.iface.messageBar().pushMessage("Localizar PK", str(e), level=e.level)
+            return False
 
         except Exception:
             self.iface.messageBar().pushMessage(
@@ -136,15 +93,38 @@ class LocalizarPK:
                 "Error inesperado al preparar la capa.",
                 level=Qgis.Warning
             )
+            return False
+
+    def _road_completer(self, parent):
+        """
+        Completer de vías sobre el catálogo cacheado en el registro (solo el
+        campo identificador, sin geometría) de todas las capas de la red. El
+        modelo está ordenado sin
+        distinguir mayúsculas, así que QCompleter busca los prefijos por
+        búsqueda binaria en lugar de recorrer toda la lista.
+        """
+        names = self.network.road_catalogue()
+        if self._road_model is None or self._road_model_names is not names:
+            if self._road_model is not None:
+                self._road_model.deleteLater()
+            self._road_model = QStringListModel(names, self.iface.mainWindow())
+            self._road_model_names = names
+
+        completer = QCompleter(self._road_model, parent)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
+        return completer
+
+    def open_dialog(self):
+        """
+        Abre el diálogo de localización usando la capa/campo/unidades definidos en settings.
+        """
+        if not self._prepare_layer():
             return
 
-        # A partir de aquí, self.layer está validada
-        field = self.id_field
-        road_names = sorted({
-            f[field]
-            for f in self.layer.getFeatures()
-            if f[field]
-        })
+        # A partir de aquí, self.network está validada. Los motores se van
+        # preparando en segundo plano mientras se escribe la vía y el PK.
+        self.indexing.ensure_network_ready(self.network)
 
         # ----- Construcción del diálogo -----
         dlg = QDialog(self.iface.mainWindow())
@@ -155,8 +135,7 @@ class LocalizarPK:
         h1 = QHBoxLayout()
         h1.addWidget(QLabel("Carretera:"))
         self.le_road = QLineEdit()
-        completer = QCompleter(road_names)
-        self.le_road.setCompleter(completer)
+        self.le_road.setCompleter(self._road_completer(self.le_road))
         h1.addWidget(self.le_road)
         vbox.addLayout(h1)
 
@@ -200,78 +179,35 @@ class LocalizarPK:
     # Lógica de localización
     # ---------------------------------------------------
     def locate(self, via, pk_km):
-        field = self.id_field or EXPECTED_FIELD
-
-        # 0) Preparar objetivo según unidades del M
-        # Si m_units == "m": M en metros → target_m = pk_km * 1000
-        # Si m_units == "km": M en kilómetros → target_m = pk_km
-        if (self.m_units or "m") == "m":
-            target_m = pk_km * 1000.0
-        else:
-            target_m = pk_km
-
-        EPS = 1e-6
-
-        # 1) Reunir TODAS las features de la vía
-        if not self.layer:
+        # 1) Comprobar que hay red preparada
+        if not self.network:
             self.iface.messageBar().pushWarning("Localizar PK", "No hay capa seleccionada.")
             return
+        if not self.indexing.ensure_network_ready(
+            self.network, lambda: self.locate(via, pk_km)
+        ):
+            return
 
-        feats = [f for f in self.layer.getFeatures() if f[field] == via]
-        if not feats:
+        op = profiler().start("localizar")
+        # La vía llega como texto: la tabla vía → capa da la capa que la
+        # contiene y el identificador real
+        routed = self.network.reference().route(via)
+        if routed is None:
             self.iface.messageBar().pushInfo("Localizar PK", f"No se encontró vía '{via}'.")
             return
+        member, via = routed
+        engine = self.network.engine(member)
 
-        # 2) Auxiliar: interpolar por M (multipartes + M invertida)
-        def _interpolate_point_by_m(geom, target_val):
-            verts = list(geom.vertices())
-            if len(verts) < 2:
-                return None
-            for i in range(len(verts) - 1):
-                p0, p1 = verts[i], verts[i + 1]
-                m0, m1 = p0.m(), p1.m()
-                if m0 is None or m1 is None:
-                    continue
-                # ¿target entre m0 y m1 sin asumir orden?
-                if (m0 - EPS <= target_val <= m1 + EPS) or (m1 - EPS <= target_val <= m0 + EPS):
-                    if abs(m1 - m0) < EPS:
-                        return QgsPointXY(p0.x(), p0.y())
-                    t = (target_val - m0) / (m1 - m0)
-                    x = p0.x() + t * (p1.x() - p0.x())
-                    y = p0.y() + t * (p1.y() - p0.y())
-                    return QgsPointXY(x, y)
-            return None
-
-        # 3) Buscar el tramo que contiene el target
-        global_min = None
-        global_max = None
-        map_pt = None
-
-        for f in feats:
-            geom = f.geometry()
-            m_vals = [pt.m() for pt in geom.vertices() if pt.m() is not None]
-            if not m_vals:
-                continue
-            fmin, fmax = min(m_vals), max(m_vals)
-            global_min = fmin if global_min is None else min(global_min, fmin)
-            global_max = fmax if global_max is None else max(global_max, fmax)
-
-            if fmin - EPS <= target_m <= fmax + EPS:
-                pt = _interpolate_point_by_m(geom, target_m)
-                if pt is not None:
-                    map_pt = pt
-                    break  # encontrado
-
-        if map_pt is None:
-            if global_min is not None and global_max is not None:
-                # Convertimos el rango a km para que sea consistente con pk_km
-                if (self.m_units or "m") == "m":
-                    min_km = global_min / 1000.0
-                    max_km = global_max / 1000.0
-                else:
-                    min_km = global_min
-                    max_km = global_max
+        op.mark("registro")
 
+        # 2) Buscar el tramo que contiene el PK (multipartes + M invertida)
+        loc = engine.locate(via, pk_km)
+        op.mark("motor")
+
+        if loc is None:
+            rango = engine.road_range(via)
+            if rango is not None:
+                min_km, max_km = rango
                 self.iface.messageBar().pushInfo(
                     "Localizar PK",
                     f"PK {formato_pk(pk_km)} fuera de rango de la vía "
@@ -284,23 +220,21 @@ class LocalizarPK:
                 )
             return
 
-        # 4) Transformar al CRS del mapa
+        map_pt = QgsPointXY(loc.x, loc.y)
+
+        # 3) Transformar al CRS del mapa
         map_crs = self.canvas.mapSettings().destinationCrs()
-        layer_crs = self.layer.crs()
-        if layer_crs != map_crs:
-            xf = QgsCoordinateTransform(layer_crs, map_crs, QgsProject.instance())
-            map_pt = xf.transform(map_pt)
+        xfs = transforms()
+        map_pt = xfs.point(self.network.layer_crs(member), map_crs, map_pt)
+        op.mark("transformacion")
 
-        # 5) Dibujar marcador y UI
+        # 4) Dibujar marcador y UI
         self._limpiar_marcadores()
         self._add_marker(map_pt, QColor(0, 0, 255))
+        op.mark("marcador")
 
-        crs_wgs84 = QgsCoordinateTransform(
-            map_crs,
-            QgsCoordinateReferenceSystem("EPSG:4326"),
-            QgsProject.instance()
-        )
-        pt_wgs = crs_wgs84.transform(map_pt)
+        pt_wgs = xfs.point(map_crs, xfs.wgs84, map_pt)
+        op.mark("wgs84")
         lat, lon = pt_wgs.y(), pt_wgs.x()
         url_sv = (
             "https://www.google.com/maps/@?api=1&map_action=pano"
@@ -336,9 +270,10 @@ class LocalizarPK:
 
         self.iface.messageBar().pushWidget(msg, level=Qgis.Info)
 
-        # 6) Historial
-        self.history.insert(0, (via, pk_km, map_pt))
-        self._update_history_menu()
+        # 5) Historial (persistente; el menú se rehace al abrirlo)
+        history_store().add(TOOL_LOCATE, via, pk_km, lat, lon, loc.fid)
+        op.mark("interfaz")
+        op.finish()
 
     # ---------------------------------------------------
     # Utilidades de zoom y marcadores
@@ -386,35 +321,40 @@ class LocalizarPK:
         act_clear.triggered.connect(self._limpiar_marcadores)
         self.history_menu.addAction(act_clear)
 
-        # 2) Exportar puntos
-        act_export = QAction("Exportar puntos", self.iface.mainWindow())
+        # 2) Historial completo: búsqueda, exportación y vuelta a un punto
+        act_export = QAction("Historial completo / exportar…", self.iface.mainWindow())
         act_export.triggered.connect(self._exportar_historial)
         self.history_menu.addAction(act_export)
 
-        # 3) Separador
+        # 3) Localizar por lote (tabla de vía + PK)
+        act_batch = QAction("Localizar por lote…", self.iface.mainWindow())
+        act_batch.triggered.connect(self.open_batch_dialog)
+        self.history_menu.addAction(act_batch)
+
+        # 4) CSV muy grande → GeoPackage/FlatGeobuf (algoritmo de Processing)
+        act_csv = QAction("Localizar CSV grande a fichero…", self.iface.mainWindow())
+        act_csv.triggered.connect(self.open_csv_dialog)
+        self.history_menu.addAction(act_csv)
+
+        # 5) Separador
         self.history_menu.addSeparator()
 
-        # 4) Historial (más recientes primero)
-        for via, pk_km, map_pt in self.history:
-            texto = f"{via} – {formato_pk(pk_km)}"
+        # 6) Últimas consultas (más recientes primero; una página corta)
+        for entry in history_store().page(TOOL_LOCATE, limit=self.MENU_HISTORY):
+            texto = f"{entry.via} – {formato_pk(entry.pk_km)}"
             act = QAction(texto, self.iface.mainWindow())
-            act.triggered.connect(
-                lambda checked, v=via, p=pk_km, mp=map_pt: self._from_history(v, p, mp)
-            )
+            act.triggered.connect(lambda checked, e=entry: self._from_history(e))
             self.history_menu.addAction(act)
 
-    def _from_history(self, via, pk_km, map_pt):
+    def _from_history(self, entry):
         # Redibuja el marcador y muestra el mensaje
+        via, pk_km, lat, lon = entry.via, entry.pk_km, entry.lat, entry.lon
+        xfs = transforms()
+        map_pt = xfs.point(
+            xfs.wgs84, self.canvas.mapSettings().destinationCrs(), QgsPointXY(lon, lat)
+        )
         self._limpiar_marcadores()
         self._add_marker(map_pt, QColor(0, 0, 255))
-
-        crs_wgs84 = QgsCoordinateTransform(
-            self.canvas.mapSettings().destinationCrs(),
-            QgsCoordinateReferenceSystem("EPSG:4326"),
-            QgsProject.instance()
-        )
-        pt_wgs = crs_wgs84.transform(map_pt)
-        lat, lon = pt_wgs.y(), pt_wgs.x()
         url_sv = (
             "https://www.google.com/maps/@?api=1&map_action=pano"
             f"&viewpoint={lat:.6f},{lon:.6f}&heading=0&pitch=10&fov=250"
@@ -450,84 +390,86 @@ class LocalizarPK:
         self.iface.messageBar().pushWidget(msg, level=Qgis.Info)
 
     def _exportar_historial(self):
-        if not self.history:
+        store = history_store()
+        if not store.count(TOOL_LOCATE):
             self.iface.messageBar().pushWarning("Exportar", "No hay puntos en el historial.")
             return
 
-        dlg = QDialog(self.iface.mainWindow())
-        dlg.setWindowTitle("Exportar puntos del historial")
-        vbox = QVBoxLayout()
-
-        label = QLabel("Selecciona los puntos a exportar:")
-        vbox.addWidget(label)
-
-        list_widget = QListWidget()
-        list_widget.setSelectionMode(QListWidget.MultiSelection)
+        # Casillas para exportar; doble clic para volver a un punto
+        dlg = HistoryDialog(
+            self.iface.mainWindow(), store, TOOL_LOCATE,
+            "Historial de Localizar PK", formato_pk, activatable=True
+        )
+        if dlg.exec_() != QDialog.Accepted:
+            return
+        if dlg.activated_entry is not None:
+            self._from_history(dlg.activated_entry)
+            return
 
-        # Desmarcados por defecto, más recientes primero (self.history ya lo está)
-        for i, (via, pk_km, _) in enumerate(self.history):
-            texto = f"{via} – {formato_pk(pk_km)} ({pk_km:.3f} km)"
-            item = QListWidgetItem(texto)
-            item.setSelected(False)
-            item.setData(1000, i)  # índice en self.history
-            list_widget.addItem(item)
+        seleccionados = dlg.selected_entries()
+        if not seleccionados:
+            return
 
-        vbox.addWidget(list_widget)
+        dest = ask_destination(self.iface.mainWindow(), "Exportar historial de PKs")
+        if dest is None:
+            return
+        path, append = dest
 
-        # Botones: Marcar/Desmarcar todos
-        hbtn = QHBoxLayout()
-        btn_sel_all = QPushButton("Marcar todos")
-        btn_unsel_all = QPushButton("Desmarcar todos")
-        btn_sel_all.clicked.connect(
-            lambda: [list_widget.item(i).setSelected(True) for i in range(list_widget.count())]
-        )
-        btn_unsel_all.clicked.connect(
-            lambda: [list_widget.item(i).setSelected(False) for i in range(list_widget.count())]
-        )
-        hbtn.addWidget(btn_sel_all)
-        hbtn.addWidget(btn_unsel_all)
-        vbox.addLayout(hbtn)
+        # Las coordenadas WGS84 se guardaron al localizar: no hay que transformar
+        rows = [
+            (e.via, e.pk_km, formato_pk(e.pk_km), e.lat, e.lon, e.fid, e.time)
+            for e in seleccionados
+        ]
+        try:
+            add_to_project(export_points(path, rows, append))
+        except OSError as e:
+            self.iface.messageBar().pushWarning("Exportar", str(e))
+            return
+        self.iface.messageBar().pushInfo("Exportar", f"Exportados {len(rows)} puntos a {path}.")
 
-        # Aceptar / Cancelar
-        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
-        buttons.accepted.connect(dlg.accept)
-        buttons.rejected.connect(dlg.reject)
-        vbox.addWidget(buttons)
+    def open_batch_dialog(self):
+        """
+        Localiza todas las filas de una tabla de vía + PK y crea una capa de
+        puntos (sobre la capa principal de la configuración).
+        """
+        if not self._prepare_layer():
+            return
+        primary = self.network.primary
+        if not self.indexing.ensure_ready(
+            primary.layer, primary.id_field, primary.m_units, self.open_batch_dialog
+        ):
+            return
+        engine = index_registry().engine(primary.layer, primary.id_field, primary.m_units)
 
-        dlg.setLayout(vbox)
+        dlg = LocalizarLoteDialog(self.iface.mainWindow())
         if dlg.exec_() != QDialog.Accepted:
             return
-
-        seleccionados = [item.data(1000) for item in list_widget.selectedItems()]
-        if not seleccionados:
+        table = dlg.selected_layer()
+        if table is None:
             return
 
-        # Crear capa temporal (EPSG:4326)
-        vl = QgsVectorLayer("Point?crs=EPSG:4326", "Localización de PKs", "memory")
-        pr = vl.dataProvider()
-        pr.addAttributes([
-            QgsField("VIA", QVariant.String),
-            QgsField("PK", QVariant.String)
-        ])
-        vl.updateFields()
-
-        # Transformación a WGS84 desde CRS del mapa
-        xf = QgsCoordinateTransform(
-            self.canvas.mapSettings().destinationCrs(),
-            QgsCoordinateReferenceSystem("EPSG:4326"),
-            QgsProject.instance()
+        out, counts = locate_table(
+            engine, table, dlg.selected_road_field(), dlg.selected_pk_field(), primary.layer.crs()
         )
+        QgsProject.instance().addMapLayer(out)
 
-        for idx in seleccionados:
-            via, pk_km, map_pt = self.history[idx]
-            pt = xf.transform(map_pt)
-            feat = QgsFeature()
-            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(pt)))
-            feat.setAttributes([via, formato_pk(pk_km)])
-            pr.addFeature(feat)
+        self.iface.messageBar().pushInfo(
+            "Localizar PK",
+            "Lote localizado: " + " · ".join(f"{k}: {v}" for k, v in counts.items())
+        )
 
-        vl.updateExtents()
-        QgsProject.instance().addMapLayer(vl)
+    def open_csv_dialog(self):
+        """Abre "Localizar PK desde CSV" con la capa principal configurada."""
+        params = {}
+        if self._prepare_layer():
+            primary = self.network.primary
+            params = {
+                "NETWORK": primary.layer,
+                "NETWORK_ID_FIELD": primary.id_field,
+                "M_UNITS": ["m", "km"].index(primary.m_units),
+            }
+        import processing  # Solo disponible dentro de QGIS
+        processing.execAlgorithmDialog("pktools:localizarcsv", params)
 
     def run(self):
         """Método de entrada para integrarlo en el plugin unificado."""
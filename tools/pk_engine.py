@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de referenciación lineal compartido por las herramientas de PK Tools.
+
+Adaptador de QGIS sobre el núcleo sin Qt (core/linref.py): lee UNA vez la
+capa de trabajo (lineal con M) y construye con ella el motor de arrays sobre
+el que se resuelven las consultas "punto → PK" y "PK → punto".
+
+Las distancias en metros se miden como QgsDistanceArea: sobre el elipsoide
+del proyecto (o del contexto de Processing) si lo hay y, si no, en el plano
+convirtiendo las unidades del CRS. Ver prepare_metric.
+"""
+
+from collections import namedtuple
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCoordinateTransformContext,
+    QgsEllipsoidUtils, QgsFeatureRequest, QgsGeometry, QgsUnitTypes,
+    QgsWkbTypes
+)
+
+from ..core.linref import (  # noqa: F401  (reexportados para las herramientas)
+    EPS, STATUS_FOUND, STATUS_OUT_OF_RANGE, STATUS_UNKNOWN_ROAD,
+    PKMatch, PKLocation, PKLocationArray, PKSegment, PKEvent, PKMatchArray,
+    LinearReference, parse_wkb_lines, wkb_parts
+)
+from ..core.geodesy import WGS84_A, WGS84_F
+from .transforms import transform_xy
+
+
+# CRS de la capa y elipsoide de las longitudes en metros; ``key`` las identifica
+MetricSpec = namedtuple("MetricSpec", "key crs ellipsoid transform_context")
+
+
+def metric_spec(crs, ellipsoid, transform_context):
+    """
+    Parámetros de las longitudes en metros (ver PKEngine.prepare_metric).
+    Son copias: se pueden capturar en el hilo principal y usar en una QgsTask.
+    """
+    ellipsoid = ellipsoid or "NONE"
+    return MetricSpec(
+        (crs.authid() or crs.toWkt(), ellipsoid), QgsCoordinateReferenceSystem(crs),
+        ellipsoid, QgsCoordinateTransformContext(transform_context)
+    )
+
+
+def _line_records(features, id_field):
+    """(fid, vía, WKB) de cada feature con geometría; las curvas se segmentan."""
+    for feat in features:
+        geom = feat.geometry()
+        if geom is None or geom.isEmpty():
+            continue
+        if QgsWkbTypes.isCurvedType(geom.wkbType()):
+            geom = QgsGeometry(geom.constGet().segmentize())
+        road = feat[id_field]
+        if isinstance(road, QVariant) and road.isNull():
+            road = None
+        yield feat.id(), road, geom.asWkb()
+
+
+class PKEngine(LinearReference):
+    """Red calibrada preparada en arrays, construida desde una capa de QGIS."""
+
+    @classmethod
+    def from_layer(cls, layer, id_field, m_units="m", feedback=None):
+        """
+        Lee la capa una sola vez y construye el motor.
+
+        ``feedback`` (QgsFeedback, QgsTask...) es opcional: se usa para
+        informar del progreso y para cancelar; en ese caso devuelve None.
+        """
+        return cls.from_source(
+            layer, layer.fields(), layer.featureCount(), id_field, m_units, feedback
+        )
+
+    @classmethod
+    def from_source(cls, source, fields, feature_count, id_field, m_units="m", feedback=None):
+        """
+        Igual que from_layer, pero leyendo de cualquier fuente con getFeatures()
+        (p. ej. un QgsVectorLayerFeatureSource capturado en el hilo principal
+        para leerlo desde una QgsTask).
+        """
+        request = QgsFeatureRequest().setSubsetOfAttributes([id_field], fields)
+        total = max(feature_count, 1)
+        canceled = []
+
+        def features():
+            for count, feat in enumerate(source.getFeatures(request)):
+                if feedback is not None and count % 1000 == 0:
+                    if feedback.isCanceled():
+                        canceled.append(True)
+                        return
+                    feedback.setProgress(100.0 * count / total)
+                yield feat
+
+        engine = cls.from_wkb(_line_records(features(), id_field), m_units)
+        return None if canceled else engine
+
+    def patched(self, source, fields, fids, id_field):
+        """
+        Motor con las features ``fids`` releídas de ``source`` (las que ya
+        no existen se quitan) y el resto copiado de este: tras editar unas
+        pocas features no hace falta volver a leer toda la capa.
+        """
+        request = (QgsFeatureRequest().setFilterFids(list(fids))
+                   .setSubsetOfAttributes([id_field], fields))
+        records = _line_records(source.getFeatures(request), id_field)
+        return self.replace_features(fids, wkb_parts(records))
+
+    def prepare_metric(self, crs, ellipsoid, transform_context):
+        """
+        Prepara las longitudes en metros (``metric_cum``) para el CRS de la
+        capa y el elipsoide dado (acrónimo, "NONE" = plano). Solo se recalcula
+        si cambian el CRS o el elipsoide.
+          - con elipsoide: vértices → geográficas del elipsoide (de una vez)
+            y longitudes geodésicas vectorizadas
+          - sin elipsoide y CRS geográfico: geodésicas sobre WGS 84
+          - sin elipsoide y CRS proyectado: longitud plana × factor a metros
+        Para no bloquear la interfaz, las herramientas las calculan en una
+        QgsTask con metric_spec + metric_lengths (ver IndexRegistry.prepare).
+        """
+        spec = metric_spec(crs, ellipsoid, transform_context)
+        if self.metric_cum is None or self.metric_key != spec.key:
+            self.set_metric_cum(self.metric_lengths(spec), spec.key)
+
+    def metric_lengths(self, spec):
+        """``metric_cum`` para ``spec`` (ver metric_spec), sin guardarlo en el motor."""
+        params = None
+        if spec.ellipsoid != "NONE":
+            params = QgsEllipsoidUtils.ellipsoidParameters(spec.ellipsoid)
+        if params is not None and params.valid:
+            xf = QgsCoordinateTransform(spec.crs, params.crs, spec.transform_context)
+            lon, lat = transform_xy(xf, self.x, self.y)
+            a, b = params.semiMajor, params.semiMinor
+            f = 1.0 / params.inverseFlattening if params.inverseFlattening > 0 else (a - b) / a
+            return self.geodesic_cum(lon, lat, a, f)
+        if spec.crs.isGeographic():
+            return self.geodesic_cum(self.x, self.y, WGS84_A, WGS84_F)
+        return self.cum * QgsUnitTypes.fromUnitToUnitFactor(
+            spec.crs.mapUnits(), QgsUnitTypes.DistanceMeters
+        )
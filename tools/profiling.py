@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Medición de tiempos por etapas de las herramientas (opcional).
+
+Cuando está activada (opciones de PK Tools), cada clic de Identificar,
+Localizar y Distancia registra cuánto tarda cada etapa (transformación de
+coordenadas, motor, marcadores, interfaz...) y escribe una
+línea en el registro de mensajes de QGIS, pestaña "PK Tools". Se acumulan
+recuento, media, p95 y máximo por etapa para mostrar un resumen o exportar
+un perfil JSON.
+
+Uso en una herramienta:
+    op = profiler().start("identificar")
+    ...                      # etapa 1
+    op.mark("transformacion")
+    ...                      # etapa 2
+    op.mark("motor")
+    op.finish()
+
+Desactivada, start() devuelve una operación vacía: el coste es una llamada.
+"""
+
+import json
+import time
+from collections import deque
+
+import numpy as np
+from qgis.core import Qgis, QgsMessageLog, QgsSettings
+
+from ..settings import SETTINGS_GROUP
+
+
+LOG_TAG = "PK Tools"
+KEY_ENABLED = SETTINGS_GROUP + "/profiling"
+
+# Duraciones que se guardan por etapa para calcular percentiles
+SAMPLES = 1000
+
+
+class _StageStats:
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def as_dict(self):
+        ms = np.asarray(self.samples, dtype=np.float64) * 1000.0
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000.0, 3),
+            "mean_ms": round(self.total * 1000.0 / max(self.count, 1), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3) if len(ms) else 0.0,
+            "max_ms": round(self.max * 1000.0, 3),
+        }
+
+
+class _NullOperation:
+    """Operación vacía (medición desactivada)."""
+
+    def mark(self, stage):
+        pass
+
+    def finish(self):
+        pass
+
+
+_NULL_OPERATION = _NullOperation()
+
+
+class _Operation:
+    """Una ejecución de una operación: tiempos de sus etapas en orden."""
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self.name = name
+        self.stages = []
+        self._t0 = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """Cierra la etapa ``stage``: tiempo transcurrido desde la marca anterior."""
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last))
+        self._last = now
+
+    def finish(self):
+        """Registra la operación (tiempo total = desde start())."""
+        self._profiler._record(self, time.perf_counter() - self._t0)
+
+
+class Profiler:
+    """Acumulador de tiempos por operación y etapa."""
+
+    def __init__(self):
+        self.enabled = QgsSettings().value(KEY_ENABLED, False, type=bool)
+        self._stats = {}    # (operación, etapa) → _StageStats
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        QgsSettings().setValue(KEY_ENABLED, self.enabled)
+        QgsMessageLog.logMessage(
+            "Medición de tiempos " + ("activada." if self.enabled else "desactivada."),
+            LOG_TAG, Qgis.Info
+        )
+
+    def start(self, name):
+        """Empieza a medir una operación (o devuelve la operación vacía)."""
+        if not self.enabled:
+            return _NULL_OPERATION
+        return _Operation(self, name)
+
+    def _record(self, op, total):
+        for stage, seconds in op.stages:
+            self._stats.setdefault((op.name, stage), _StageStats()).add(seconds)
+        self._stats.setdefault((op.name, "total"), _StageStats()).add(total)
+        detail = " · ".join(f"{stage} {seconds * 1000.0:.2f}" for stage, seconds in op.stages)
+        QgsMessageLog.logMessage(
+            f"{op.name}: {total * 1000.0:.2f} ms ({detail})", LOG_TAG, Qgis.Info
+        )
+
+    # ---------- Resumen y exportación ----------
+    def reset(self):
+        self._stats = {}
+
+    def as_dict(self):
+        """{operación: {etapa: estadísticas}} en orden de aparición."""
+        out = {}
+        for (name, stage), stats in self._stats.items():
+            out.setdefault(name, {})[stage] = stats.as_dict()
+        return out
+
+    def summary(self):
+        """Tabla de texto con recuento, media, p95 y máximo (ms) por etapa."""
+        data = self.as_dict()
+        if not data:
+            return "Sin tiempos registrados."
+        lines = [f"{'operación / etapa':<34}{'n':>7}{'media':>10}{'p95':>10}{'máx':>10}"]
+        for name, stages in data.items():
+            for stage, s in stages.items():
+                lines.append(
+                    f"{name + ' / ' + stage:<34}{s['count']:>7}"
+                    f"{s['mean_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['max_ms']:>10.2f}"
+                )
+        return "\n".join(lines)
+
+    def log_summary(self):
+        QgsMessageLog.logMessage("Resumen de tiempos (ms):\n" + self.summary(), LOG_TAG, Qgis.Info)
+
+    def dump_json(self, path):
+        """Guarda el perfil acumulado en ``path`` (JSON)."""
+        data = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "qgis": Qgis.QGIS_VERSION,
+            "operations": self.as_dict(),
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+_profiler = None
+
+
+def profiler():
+    """Medidor de tiempos compartido por las herramientas."""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
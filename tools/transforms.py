@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Transformaciones de coordenadas compartidas por las herramientas.
+
+Construir un QgsCoordinateTransform cuesta bastante más que usarlo, y cada
+clic necesitaba hasta tres (mapa → capa, capa → mapa, mapa → WGS84). Aquí se
+guardan por pareja de CRS y se reutilizan; la caché se vacía cuando cambian
+el CRS o el contexto de transformaciones del proyecto, o al cerrarlo. Un
+cambio de CRS del mapa no necesita vaciarla: la pareja de CRS es otra.
+
+transform_xy transforma arrays de coordenadas de una vez (una sola llamada a
+C++ por bloque) para exportaciones y operaciones por lotes.
+"""
+
+import numpy as np
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException, QgsLineString,
+    QgsPointXY, QgsProject
+)
+
+
+WGS84 = "EPSG:4326"
+
+
+def _crs_key(crs):
+    return crs.authid() or crs.toWkt()
+
+
+class TransformCache:
+    """QgsCoordinateTransform por pareja de CRS, con el contexto del proyecto."""
+
+    def __init__(self):
+        self._cache = {}
+        self.wgs84 = QgsCoordinateReferenceSystem(WGS84)
+        project = QgsProject.instance()
+        project.crsChanged.connect(self.clear)
+        project.transformContextChanged.connect(self.clear)
+        project.cleared.connect(self.clear)
+
+    def get(self, src, dst):
+        """Transformación src → dst, o None si los dos CRS son iguales."""
+        key = (_crs_key(src), _crs_key(dst))
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        xf = None if src == dst else QgsCoordinateTransform(src, dst, QgsProject.instance())
+        self._cache[key] = xf
+        return xf
+
+    def point(self, src, dst, pt):
+        """Transforma un QgsPointXY de src a dst (devuelve el mismo si coinciden)."""
+        xf = self.get(src, dst)
+        return QgsPointXY(pt) if xf is None else xf.transform(pt)
+
+    def xy(self, src, dst, xs, ys):
+        """Transforma arrays de coordenadas de src a dst (ver transform_xy)."""
+        return transform_xy(self.get(src, dst), xs, ys)
+
+    def clear(self, *args):
+        self._cache = {}
+
+    def release(self):
+        """Desconecta las señales del proyecto."""
+        project = QgsProject.instance()
+        for signal in (project.crsChanged, project.transformContextChanged, project.cleared):
+            try:
+                signal.disconnect(self.clear)
+            except (TypeError, RuntimeError):
+                pass
+        self._cache = {}
+
+
+def transform_xy(xf, xs, ys, chunk=100000):
+    """
+    Transforma los arrays ``xs``, ``ys`` con ``xf`` (QgsCoordinateTransform o
+    None = sin transformar). Devuelve dos arrays nuevos de float64.
+
+    Los puntos se transforman por bloques como vértices de una línea
+    (QgsLineString.transform), una llamada a C++ por bloque en lugar de una
+    por punto. Las coordenadas NaN se conservan; si un bloque falla, se
+    repite punto a punto y los que no se pueden transformar quedan en NaN.
+    """
+    xs = np.array(xs, dtype=np.float64)
+    ys = np.array(ys, dtype=np.float64)
+    if xf is None or not len(xs):
+        return xs, ys
+    valid = np.nonzero(~(np.isnan(xs) | np.isnan(ys)))[0]
+    for c0 in range(0, len(valid), chunk):
+        idx = valid[c0:c0 + chunk]
+        # Una línea necesita al menos dos vértices
+        idx2 = idx if len(idx) > 1 else np.r_[idx, idx]
+        line = QgsLineString(xs[idx2].tolist(), ys[idx2].tolist())
+        try:
+            line.transform(xf)
+        except QgsCsException:
+            _transform_each(xf, xs, ys, idx)
+            continue
+        xs[idx] = np.asarray(line.xVector(), dtype=np.float64)[:len(idx)]
+        ys[idx] = np.asarray(line.yVector(), dtype=np.float64)[:len(idx)]
+    return xs, ys
+
+
+def _transform_each(xf, xs, ys, idx):
+    for i in idx.tolist():
+        try:
+            pt = xf.transform(QgsPointXY(xs[i], ys[i]))
+            xs[i], ys[i] = pt.x(), pt.y()
+        except QgsCsException:
+            xs[i] = ys[i] = np.nan
+
+
+_transforms = None
+
+
+def transforms():
+    """Caché de transformaciones compartida (se crea la primera vez)."""
+    global _transforms
+    if _transforms is None:
+        _transforms = TransformCache()
+    return _transforms
+
+
+def release_transforms():
+    """Libera la caché compartida y sus conexiones."""
+    global _transforms
+    if _transforms is not None:
+        _transforms.release()
+        _transforms = None